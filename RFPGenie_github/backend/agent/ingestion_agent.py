@@ -0,0 +1,52 @@
+from functools import lru_cache
+from backend.config import settings
+from backend.llm import get_adk_llm_client
+
+# Knowledge base collections a chunk can be filed under
+CATEGORIES = [
+    "Company Profile",
+    "Case Studies",
+    "Technical Capabilities",
+    "Methodology and Delivery",
+    "Team and Expertise",
+    "Commercials and Pricing",
+    "Certifications and Compliance",
+    "General",
+]
+
+INGESTION_INSTRUCTION = (
+        f"""You are an expert knowledge base curator. Your task is to split a company document into self-contained chunks and file each chunk under the most relevant collection.
+
+        **Instructions:**
+
+        1.  **Read the Document:** You will be given the source file name on the first line (`Source: <name>`) followed by the full text of the document.
+        2.  **Chunk by Meaning:** Split the document into chunks that each cover a single topic. A chunk should be a few paragraphs at most and must make sense on its own.
+        3.  **Preserve the Text:** Keep the original wording of the document. Do not summarise or invent content.
+        4.  **Categorise:** Assign every chunk to exactly one of these collections: {", ".join(CATEGORIES)}. Use "General" only when nothing else fits.
+        5.  **Structure the Output:** Return a JSON array only. Each element must be an object with the keys `collection` (one of the collections above), `content` (the chunk text) and `metadata` (an object that contains at least `source`, set to the source file name).
+        """
+)
+
+CATEGORIZATION_INSTRUCTION = (
+        f"""You are an expert knowledge base curator. Your task is to file already chunked passages of a company document under the most relevant collection.
+
+        **Instructions:**
+
+        1.  **Read the Passages:** You will be given the source file name on the first line (`Categorize: <name>`) followed by numbered passages (`[1]`, `[2]`, ...). Long passages are cut short.
+        2.  **Categorise:** Assign every passage to exactly one of these collections: {", ".join(CATEGORIES)}. Use "General" only when nothing else fits.
+        3.  **Structure the Output:** Return a JSON object only, mapping each passage number (as a string) to its collection, e.g. {{"1": "Case Studies", "2": "General"}}.
+        """
+)
+
+
+@lru_cache(maxsize=None)
+def get_ingestion_agent():
+    """Agent for chunking uploaded documents into categorised knowledge base entries."""
+    from google.adk.agents import LlmAgent
+    from google.adk.models.lite_llm import LiteLlm
+
+    return LlmAgent(
+        name="IngestionAgent",
+        model=LiteLlm(model=settings.CATEGORIZATION_MODEL, api_key=settings.OPENAI_API_KEY or None, llm_client=get_adk_llm_client()),
+        instruction=INGESTION_INSTRUCTION,
+    )
@@ -1,13 +1,13 @@
-from google.adk.agents import LlmAgent
-from google.adk.models.lite_llm import LiteLlm
-from backend.agent.tools.rag_tool import query_collection_tool
+from functools import lru_cache
+from typing import Optional
 from backend.config import settings
+from backend.llm import get_adk_llm_client
+from backend.routing import TASK_FINAL_PROPOSAL, TASK_INITIAL_DRAFT, model_ladder
 
-# Agent for generating the initial draft
-initial_draft_agent = LlmAgent(
-    name="InitialDraftAgent",
-    model=LiteLlm(model="gpt-4-turbo", api_key=settings.OPENAI_API_KEY),
-    instruction=(
+# Agents are built on first use; google.adk and litellm are slow to import and
+# the routers only need the instructions for most calls.
+
+INITIAL_DRAFT_INSTRUCTION = (
         """You are an expert proposal writer creating a first draft. Your task is to read a scope document and generate content for a structured proposal based on it.
 
         **Instructions:**
@@ -18,16 +18,21 @@ initial_draft_agent = LlmAgent(
         4.  **Handle Missing Information:** If the scope document does not contain explicit information for a section (e.g., 'Budget'), state that the information is not available or make a reasonable placeholder statement like \"The budget will be determined based on the final scope of work.\". Do not leave sections blank unless absolutely necessary.
         5.  **Structure the Output:** Create a JSON object where the keys are the section titles from the provided list, and the values are the generated content for each section. The content should be plain text with appropriate line breaks.
         """
-    )
 )
 
+SCOPE_EXTRACTION_INSTRUCTION = (
+        """You are an expert bid analyst. Your task is to pull the facts a proposal writer needs out of one segment of a long scope document.
+
+        **Instructions:**
+
+        1.  **Read the Input:** You will be given the proposal's section titles (`sections: [...]`) followed by one segment of the scope document. Other segments are handled separately, so only use this one.
+        2.  **Extract Facts:** For each section title, list the facts from the segment that are relevant to it: goals, deliverables, requirements, constraints, dates, quantities, budgets and evaluation criteria. Keep names and numbers exactly as written.
+        3.  **Be Brief:** Each fact is one short sentence. Do not summarise the segment as a whole and do not invent facts; omit sections the segment says nothing about.
+        4.  **Structure the Output:** Return a JSON object only, mapping section titles to lists of facts, e.g. {"Timeline": ["Go-live is required by March 2025."]}.
+        """
+)
 
-# Agent for generating the final proposal
-final_proposal_agent = LlmAgent(
-    name="FinalProposalAgent",
-    model=LiteLlm(model="gpt-4-turbo", api_key=settings.OPENAI_API_KEY),
-    tools=[query_collection_tool],
-    instruction=(
+FINAL_PROPOSAL_INSTRUCTION = (
         """You are a master proposal writer. Your goal is to create a comprehensive, professional, and persuasive RFP response by strictly following these instructions.
 
         You have access to the following tool to help you:
@@ -79,5 +84,33 @@ final_proposal_agent = LlmAgent(
             *   After processing all sections, combine the final content into a single, complete RFP document.
             *   The output MUST be a single block of well-formatted and professional HTML.
             *   Each section must start with an `<h2>` tag for its title.
-        """)
-)
\ No newline at end of file
+        """
+)
+
+
+@lru_cache(maxsize=None)
+def get_initial_draft_agent(model: Optional[str] = None):
+    """Agent for generating the initial draft, on the strongest routed model unless ``model`` is given."""
+    from google.adk.agents import LlmAgent
+    from google.adk.models.lite_llm import LiteLlm
+
+    return LlmAgent(
+        name="InitialDraftAgent",
+        model=LiteLlm(model=model or model_ladder(TASK_INITIAL_DRAFT)[-1], api_key=settings.OPENAI_API_KEY or None, llm_client=get_adk_llm_client()),
+        instruction=INITIAL_DRAFT_INSTRUCTION,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_final_proposal_agent(model: Optional[str] = None):
+    """Agent for generating the final proposal, on the strongest routed model unless ``model`` is given."""
+    from google.adk.agents import LlmAgent
+    from google.adk.models.lite_llm import LiteLlm
+    from backend.agent.tools.rag_tool import get_query_collection_tool
+
+    return LlmAgent(
+        name="FinalProposalAgent",
+        model=LiteLlm(model=model or model_ladder(TASK_FINAL_PROPOSAL)[-1], api_key=settings.OPENAI_API_KEY or None, llm_client=get_adk_llm_client()),
+        tools=[get_query_collection_tool()],
+        instruction=FINAL_PROPOSAL_INSTRUCTION,
+    )
\ No newline at end of file
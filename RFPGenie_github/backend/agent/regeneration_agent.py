@@ -1,12 +1,11 @@
 
-from google.adk.agents import LlmAgent
-from google.adk.models.lite_llm import LiteLlm
+from functools import lru_cache
+from typing import Optional
 from backend.config import settings
+from backend.llm import get_adk_llm_client
+from backend.routing import TASK_REGENERATE, model_ladder
 
-regeneration_agent = LlmAgent(
-    name="RegenerationAgent",
-    model=LiteLlm(model="gpt-4-turbo", api_key=settings.OPENAI_API_KEY),
-    instruction=(
+REGENERATION_INSTRUCTION = (
         """You are a writing assistant with expertise in refining professional documents. Your task is to rewrite a single section of a proposal based on the user's request.
 
         **Instructions:**
@@ -17,5 +16,17 @@ regeneration_agent = LlmAgent(
         4.  **Rewrite and Refine:** Rewrite the source content into a new, improved version. Do not just append information. The output should be a complete, standalone piece of text for that section.
         5.  **Output Format:** The output MUST be a single block of well-formatted HTML. Use tags like `<p>`, `<ul>`, `<li>`, and `<strong>` as appropriate. Do not wrap the output in `<html>` or `<body>` tags.
         """
-    )
 )
+
+
+@lru_cache(maxsize=None)
+def get_regeneration_agent(model: Optional[str] = None):
+    """Agent for rewriting a single proposal section, built on first use; defaults to the fast routed model."""
+    from google.adk.agents import LlmAgent
+    from google.adk.models.lite_llm import LiteLlm
+
+    return LlmAgent(
+        name="RegenerationAgent",
+        model=LiteLlm(model=model or model_ladder(TASK_REGENERATE)[0], api_key=settings.OPENAI_API_KEY or None, llm_client=get_adk_llm_client()),
+        instruction=REGENERATION_INSTRUCTION,
+    )
@@ -1,67 +1,104 @@
+import asyncio
 import logging
-import litellm
-from typing import List
-from backend.database import supabase_rag
-from google.adk.tools import FunctionTool
+from functools import lru_cache
+from typing import Any, Dict, List
+from backend.database import get_supabase_rag
 from backend.config import settings
+from backend.embeddings import EmbeddingModelMismatch, ensure_collection_models, get_embedding_provider
+from backend.logging_config import Payload, log_payload
+from backend.rerank import arerank, match_count
+from backend.snapshots import get_local_index
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def query_collections(query: str, collections: List[str]) -> str:
-    """Queries one or more collections in the RAG database with a given query to find relevant context."""
-    logger.info(f"[RAG_TOOL] Received query: '{query}' for collections: {collections}")
+NO_COLLECTIONS_MESSAGE = "No collections were specified for the query."
+NO_MATCHES_MESSAGE = "No relevant information was found in the knowledge base for the specified query and collections."
+ERROR_MESSAGE = "An error occurred while trying to query the knowledge base."
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+def _match_documents(query_embedding: List[float], collections: List[str], model_id: str) -> List[Dict[str, Any]]:
+    """Checks the collections were embedded with ``model_id`` and calls the match_documents RPC.
+
+    With ``RAG_LOCAL_SNAPSHOT`` set, the snapshot is searched instead.
+    """
+    local_index = get_local_index()
+    if local_index is not None:
+        local_index.check_models(collections, model_id)
+        return local_index.search(query_embedding, collections, match_count(), settings.RAG_MATCH_THRESHOLD)
+    ensure_collection_models(collections, model_id)
+
+    rpc_params = {
+        "query_embedding": query_embedding,
+        "match_threshold": settings.RAG_MATCH_THRESHOLD,
+        "match_count": match_count(),
+        "collection_filter": collections
+    }
+    # Only sent when set, so the RPC also works against a match_documents that predates them
+    if settings.RAG_HNSW_EF_SEARCH:
+        rpc_params["ef_search"] = settings.RAG_HNSW_EF_SEARCH
+    if settings.RAG_IVFFLAT_PROBES:
+        rpc_params["probes"] = settings.RAG_IVFFLAT_PROBES
+    logger.debug(
+        "[RAG_TOOL] Executing RPC 'match_documents' with match_threshold=%s, match_count=%s, collection_filter=%s",
+        rpc_params['match_threshold'], rpc_params['match_count'], rpc_params['collection_filter'],
+    )
+    return get_supabase_rag().rpc("match_documents", rpc_params).execute().data
+
+def _format_context(data: List[Dict[str, Any]]) -> str:
+    if not data:
+        logger.info("[RAG_TOOL] No matching documents found in the database.")
+        return NO_MATCHES_MESSAGE
+
+    logger.info(
+        "[RAG_TOOL] Found %d matching documents.", len(data),
+        extra={
+            "similarities": [round(item.get('similarity', 0.0), 4) for item in data],
+            "sources": [item.get('metadata', {}).get('source') for item in data],
+        },
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, item in enumerate(data):
+            log_payload(logger, logging.DEBUG, "[RAG_TOOL] Chunk %s", item['content'], chunk=i + 1)
+
+    contexts = [item['content'] for item in data]
+    context_str = CONTEXT_SEPARATOR.join(contexts)
+    logger.debug("[RAG_TOOL] Returning context of %d characters.", len(context_str))
+    return context_str
+
+async def aquery_collections(query: str, collections: List[str]) -> str:
+    """Queries the collections for context relevant to ``query``.
+
+    The embedding goes through the LLM governor like every other model call,
+    and the blocking Supabase calls run in a worker thread, so retrieval does
+    not stall the event loop.
+    """
+    logger.info("[RAG_TOOL] Received query: '%s' for collections: %s", Payload(query, max_chars=200), collections)
 
     if not collections:
         logger.warning("[RAG_TOOL] No collections specified. Aborting query.")
-        return "No collections were specified for the query."
+        return NO_COLLECTIONS_MESSAGE
 
     try:
-        # 1. Generate embedding for the query
-        logger.debug("[RAG_TOOL] Generating embedding for the query...")
-        embedding_response = litellm.embedding(
-            model="text-embedding-3-small",
-            input=[query]
-        )
-        query_embedding = embedding_response.data[0]['embedding']
-        logger.debug("[RAG_TOOL] Embedding generated successfully.")
-
-        # 2. Call the match_documents RPC function in Supabase
-        rpc_params = {
-            "query_embedding": query_embedding,
-            "match_threshold": settings.RAG_MATCH_THRESHOLD,
-            "match_count": 5,
-            "collection_filter": collections
-        }
-        logger.info(f"[RAG_TOOL] Executing RPC 'match_documents' with params: {{match_threshold: {rpc_params['match_threshold']}, match_count: {rpc_params['match_count']}, collection_filter: {rpc_params['collection_filter']}}}")
-        
-        response = supabase_rag.rpc("match_documents", rpc_params).execute()
-        data = response.data
-        logger.debug(f"[RAG_TOOL] Raw response from Supabase: {data}")
-
-        if not data:
-            logger.info("[RAG_TOOL] No matching documents found in the database.")
-            return "No relevant information was found in the knowledge base for the specified query and collections."
-
-        logger.info(f"[RAG_TOOL] Found {len(data)} matching documents. Details:")
-        for i, item in enumerate(data):
-            similarity = item.get('similarity', 'N/A')
-            source = item.get('metadata', {}).get('source', 'N/A')
-            logger.info(f"  [CHUNK {i+1}] Similarity: {similarity:.4f}, Source: {source}")
-            logger.info(f"  [CHUNK {i+1}] Content: {item['content'][:150]}...")
-
-        # 3. Process and format the results
-        contexts = [item['content'] for item in data]
-        context_str = "\n\n---\n\n".join(contexts)
-        
-        logger.info(f"[RAG_TOOL] Found {len(contexts)} matching documents. Returning formatted context string.")
-        logger.debug(f"[RAG_TOOL] Returning context: {context_str[:500]}...") # Log first 500 chars
-        return context_str
-
+        provider = get_embedding_provider()
+        query_embedding = (await provider.embed([query]))[0]
+        data = await asyncio.to_thread(_match_documents, query_embedding, collections, provider.model_id)
+        return _format_context(await arerank(query, data))
+    except EmbeddingModelMismatch as e:
+        logger.warning("[RAG_TOOL] %s", e)
+        return str(e)
     except Exception as e:
-        logger.error(f"[RAG_TOOL] An unexpected error occurred: {e}", exc_info=True)
-        return "An error occurred while trying to query the knowledge base."
+        logger.error("[RAG_TOOL] An unexpected error occurred: %s", e, exc_info=True)
+        return ERROR_MESSAGE
+
+
+@lru_cache(maxsize=None)
+def get_query_collection_tool():
+    """Wraps aquery_collections in a FunctionTool for the agent to use."""
+    from google.adk.tools import FunctionTool
 
+    # The tool is named and described after this function
+    async def query_collections(query: str, collections: List[str]) -> str:
+        """Queries one or more collections in the RAG database with a given query to find relevant context."""
+        return await aquery_collections(query, collections)
 
-# Wrap the function in a FunctionTool for the agent to use
-query_collection_tool = FunctionTool(query_collections)
\ No newline at end of file
+    return FunctionTool(query_collections)
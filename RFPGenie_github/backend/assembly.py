@@ -0,0 +1,192 @@
+"""Incremental assembly of the final proposal.
+
+The final HTML of every section is stored in ``FinalSection`` with a
+fingerprint of everything that went into it: the selected version's content,
+the section's collection mappings and custom prompt, the revision of each
+mapped knowledge base collection, the proposal name and the final proposal
+instruction. The stored fingerprint also covers the model that generated the
+section, and stays current while that model is on the final proposal ladder. A
+new final generation only sends the sections whose fingerprint changed to the
+agent, then stitches the document back together from the stored sections. When
+nothing changed no model call is made.
+
+The agent's ``<h2>`` titles are matched to the section names loosely
+(numbering, case and punctuation are ignored), and by position when titles do
+not match. An answer that still leaves out a regenerated section raises
+:class:`IncompleteAssembly` instead of producing a document without it.
+
+Collection revisions are bumped by uploads and deletions, so new knowledge base
+content invalidates the sections that draw on it.
+"""
+import datetime
+import hashlib
+import html
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .agent.main_agent import FINAL_PROPOSAL_INSTRUCTION
+from .database import get_session_factory
+from .models import CollectionRevision, FinalSection, Proposal
+from .routing import TASK_FINAL_PROPOSAL, model_ladder
+
+logger = logging.getLogger(__name__)
+
+
+class IncompleteAssembly(Exception):
+    """Raised when the agent's answer leaves out sections it was asked to generate."""
+
+    def __init__(self, missing: List[str]):
+        super().__init__(f"The answer has no content for the sections {missing}.")
+        self.missing = missing
+
+
+def section_fingerprint(proposal_name: str, section_name: str, content: str, collection_mappings: List[str],
+                        custom_prompt: str, revisions: Dict[str, int]) -> str:
+    """Digest of a section's inputs; see :func:`generated_fingerprint` for what is stored."""
+    payload = json.dumps({
+        "proposal": proposal_name,
+        "section": section_name,
+        "content": content,
+        "collections": sorted(collection_mappings or []),
+        "custom_prompt": custom_prompt or "",
+        "revisions": {collection: revisions.get(collection, 0) for collection in sorted(collection_mappings or [])},
+        "instruction": hashlib.sha256(FINAL_PROPOSAL_INSTRUCTION.encode("utf-8")).hexdigest(),
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def generated_fingerprint(inputs: str, model: str) -> str:
+    """The fingerprint stored with a section's HTML: its inputs and the model that generated it."""
+    return hashlib.sha256(f"{inputs}:{model}".encode("utf-8")).hexdigest()
+
+
+def _is_current(row: Optional[FinalSection], inputs: str, models: List[str]) -> bool:
+    return row is not None and row.fingerprint in {generated_fingerprint(inputs, model) for model in models}
+
+
+async def collection_revisions(session: AsyncSession, collections: Iterable[str]) -> Dict[str, int]:
+    names = sorted(set(collections))
+    if not names:
+        return {}
+    result = await session.exec(select(CollectionRevision).where(CollectionRevision.collection.in_(names)))
+    return {row.collection: row.revision for row in result.all()}
+
+
+async def bump_collection_revisions(collections: Iterable[str]) -> None:
+    """Marks the collections as changed; called after documents are inserted or deleted."""
+    names = sorted(set(collections))
+    if not names:
+        return
+    for attempt in range(2):
+        now = datetime.datetime.utcnow()
+        async with get_session_factory()() as session:
+            await session.exec(
+                update(CollectionRevision)
+                .where(CollectionRevision.collection.in_(names))
+                .values(revision=CollectionRevision.revision + 1, updated_at=now)
+            )
+            existing = await collection_revisions(session, names)
+            session.add_all([CollectionRevision(collection=name, revision=1, updated_at=now) for name in names if name not in existing])
+            try:
+                await session.commit()
+                break
+            except IntegrityError:
+                # A concurrent bump created one of the rows first; the retry increments it
+                await session.rollback()
+                if attempt:
+                    raise
+    logger.info("Bumped knowledge base revision of %s.", names)
+
+
+@dataclass
+class AssemblyPlan:
+    # section name -> input fingerprint, for every section of the document in order
+    fingerprints: Dict[str, str]
+    # section name -> section id, for the sections that need generating
+    stale: Dict[str, int]
+
+
+async def plan_final_sections(session: AsyncSession, proposal: Proposal, selected_versions: Dict[int, str]) -> AssemblyPlan:
+    """Fingerprints the selected sections and finds those without current final HTML."""
+    sections = [section for section in sorted(proposal.proposal_sections, key=lambda s: s.id) if section.id in selected_versions]
+    revisions = await collection_revisions(session, (c for section in sections for c in section.collection_mappings or []))
+    fingerprints = {
+        section.section_name: section_fingerprint(
+            proposal.name, section.section_name, selected_versions[section.id],
+            section.collection_mappings, section.custom_prompt, revisions,
+        )
+        for section in sections
+    }
+    result = await session.exec(select(FinalSection).where(FinalSection.proposal_id == proposal.id))
+    stored = {row.section_name: row for row in result.all()}
+    models = model_ladder(TASK_FINAL_PROPOSAL)
+    stale = {
+        section.section_name: section.id for section in sections
+        if not _is_current(stored.get(section.section_name), fingerprints[section.section_name], models)
+    }
+    return AssemblyPlan(fingerprints=fingerprints, stale=stale)
+
+
+def match_outputs(outputs: Dict[str, str], names: List[str]) -> Dict[str, str]:
+    """Assigns the agent's sections, keyed by ``<h2>`` title in answer order, to the section ``names``.
+
+    Titles are compared without numbering, case and punctuation ("1. Why Us:"
+    is "Why Us"). Sections left over on both sides are paired in order when
+    there are as many of each. Content before the first heading (key ``""``)
+    is the section itself when one section is left, and otherwise kept at the
+    start of the first matched section.
+    """
+    lead = outputs.get("", "")
+    by_title = {_normalize(title): title for title in outputs if title}
+    matched = {name: outputs[by_title[_normalize(name)]] for name in names if _normalize(name) in by_title}
+    used = {by_title[_normalize(name)] for name in matched}
+    missing = [name for name in names if name not in matched]
+    leftover = [title for title in outputs if title and title not in used]
+    if missing and len(leftover) == len(missing):
+        matched.update(zip(missing, (outputs[title] for title in leftover)))
+    elif lead and len(missing) == 1:
+        matched[missing[0]] = lead
+        lead = ""
+    if lead and matched:
+        first = next(name for name in names if name in matched)
+        matched[first] = f"{lead}{matched[first]}"
+    return matched
+
+
+async def store_and_assemble(session: AsyncSession, proposal_id: int, outputs: Dict[str, str], fingerprints: Dict[str, str],
+                             model: Optional[str] = None) -> str:
+    """Stores sections freshly generated by ``model`` and returns the document built from all current sections.
+
+    Nothing is committed here. Raises :class:`IncompleteAssembly`, before
+    storing anything, when a section without current HTML is not in ``outputs``.
+    """
+    result = await session.exec(select(FinalSection).where(FinalSection.proposal_id == proposal_id))
+    stored = {row.section_name: row for row in result.all()}
+    models = model_ladder(TASK_FINAL_PROPOSAL)
+    stale = [name for name, inputs in fingerprints.items() if not _is_current(stored.get(name), inputs, models)]
+    generated = match_outputs(outputs, stale) if model else {}
+    missing = [name for name in stale if name not in generated]
+    if missing:
+        raise IncompleteAssembly(missing)
+
+    now = datetime.datetime.utcnow()
+    for name, content in generated.items():
+        row = stored.get(name) or FinalSection(proposal_id=proposal_id, section_name=name, fingerprint="", html="")
+        row.fingerprint, row.html, row.updated_at = generated_fingerprint(fingerprints[name], model), content, now
+        session.add(row)
+        stored[name] = row
+    return "".join(f"<h2>{html.escape(name, quote=False)}</h2>{stored[name].html}" for name in fingerprints)
+
+
+_NUMBERING = re.compile(r"^(?:section\s+)?(?:\d+(?:\.\d+)*[.):-]?|[ivx]+[.)])\s+", re.IGNORECASE)
+
+
+def _normalize(title: str) -> str:
+    text = " ".join(html.unescape(title).lower().split())
+    return " ".join(re.sub(r"[^\w]+", " ", _NUMBERING.sub("", text)).split())
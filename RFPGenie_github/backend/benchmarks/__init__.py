@@ -0,0 +1,7 @@
+"""Offline performance benchmarks for the backend.
+
+Run from the project root with ``python -m backend.benchmarks --help``.
+"""
+from .fakes import FakeCompletionProvider, FakeEmbeddingProvider, InMemorySupabase
+from .harness import BenchmarkConfig, ScenarioResult, SCENARIOS, run_benchmark, format_report, compare_to_baseline
+from .startup import run_startup_benchmark, format_startup_report
@@ -0,0 +1,67 @@
+import argparse
+import json
+import logging
+import sys
+
+from .harness import BenchmarkConfig, SCENARIOS, run_benchmark, format_report, compare_to_baseline
+from .startup import run_startup_benchmark, format_startup_report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.benchmarks", description="Offline load benchmark for the RFPGenie backend.")
+    parser.add_argument("--requests", type=int, default=20, help="Timed requests per scenario.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum in-flight requests.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated subset of: {', '.join(SCENARIOS)}.")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fixed seconds per completion call.")
+    parser.add_argument("--tokens-per-second", type=float, default=500.0, help="Simulated completion token rate.")
+    parser.add_argument("--completion-tokens", type=int, default=200, help="Approximate tokens per generated answer.")
+    parser.add_argument("--embedding-latency", type=float, default=0.01, help="Seconds per embedding call.")
+    parser.add_argument("--supabase-latency", type=float, default=0.005, help="Seconds per Supabase round trip.")
+    parser.add_argument("--document-paragraphs", type=int, default=12, help="Paragraphs per generated test document.")
+    parser.add_argument("--json", dest="json_path", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON file from a previous run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 regression against the baseline (fraction).")
+    parser.add_argument("--startup", action="store_true", help="Measure cold import time of the app instead of running the load scenarios.")
+    parser.add_argument("--startup-runs", type=int, default=5, help="Fresh interpreters to time with --startup.")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        result = run_startup_benchmark(args.startup_runs)
+        print(format_startup_report(result))
+        if args.json_path:
+            with open(args.json_path, "w") as f:
+                json.dump({"startup": result}, f, indent=2)
+        return 1 if result["heavy_modules"] else 0
+
+    logging.basicConfig(level=logging.WARNING)
+    config = BenchmarkConfig(
+        requests=args.requests,
+        concurrency=args.concurrency,
+        scenarios=tuple(s.strip() for s in args.scenarios.split(",") if s.strip()),
+        llm_latency=args.llm_latency,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        embedding_latency=args.embedding_latency,
+        supabase_latency=args.supabase_latency,
+        document_paragraphs=args.document_paragraphs,
+    )
+    results = run_benchmark(config)
+    print(format_report(results))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({r.scenario: r.to_dict() for r in results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 1 if any(r.errors for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
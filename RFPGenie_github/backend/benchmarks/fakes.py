@@ -0,0 +1,358 @@
+"""Deterministic local stand-ins for the external services used by the backend.
+
+None of these classes touch the network. Latencies are simulated with sleeps so
+that the benchmark sees the same blocking/non-blocking behaviour as the real
+clients: the sync Supabase client and ``litellm.embedding`` block the event
+loop, the async litellm calls do not.
+"""
+import ast
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import operator
+import re
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import litellm
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_FILLER = (
+    "our delivery team brings proven experience aligned to the client objectives "
+    "with a clear plan measurable outcomes and transparent governance"
+).split()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _text(content: Any) -> str:
+    """Flattens OpenAI-style message content (str or list of parts) into text."""
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(_field(part, "text", "") or "" for part in content)
+    return str(content)
+
+
+def _filler(n_words: int, seed: str) -> str:
+    offset = int(hashlib.blake2b(seed.encode(), digest_size=2).hexdigest(), 16)
+    words = itertools.islice(itertools.cycle(_FILLER), offset % len(_FILLER), offset % len(_FILLER) + n_words)
+    return " ".join(words).capitalize() + "."
+
+
+class FakeCompletionProvider:
+    """Stand-in for ``litellm.acompletion``.
+
+    Each call sleeps for ``latency`` seconds plus ``completion_tokens / tokens_per_second``
+    and returns a ``litellm.ModelResponse`` shaped like a real OpenAI reply. The reply
+    depends only on the prompt, so runs are reproducible:
+
+    * ingestion prompts (``Source: ...``) get a fenced JSON array of chunks,
+    * categorisation prompts (``Categorize: ...``) get a JSON object assigning a
+      category to every numbered passage,
+    * fact extraction prompts (``Extract facts: ...``) get one fact per section
+      taken from the start of the segment,
+    * initial draft prompts (``scope_document: ...``) get a JSON object keyed by section,
+    * tool-enabled prompts with collection mappings first get a ``query_collections``
+      tool call, then an HTML answer once a tool result is present.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        tokens_per_second: float = 500.0,
+        completion_tokens: int = 200,
+        categories: Optional[List[str]] = None,
+    ):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.categories = categories or ["General"]
+        self.calls = 0
+        self._tool_call_ids = itertools.count(1)
+
+    async def acompletion(self, model: str, messages: List[Any], tools: Optional[List[dict]] = None, **kwargs) -> "litellm.ModelResponse":
+        import litellm
+
+        self.calls += 1
+        prompt_text = "\n".join(_text(_field(m, "content")) for m in messages)
+        message = self._respond(messages, tools)
+        output_text = message.get("content") or json.dumps(message.get("tool_calls"))
+        completion_tokens = estimate_tokens(output_text)
+
+        await asyncio.sleep(self.latency + completion_tokens / self.tokens_per_second)
+
+        prompt_tokens = estimate_tokens(prompt_text)
+        return litellm.ModelResponse(
+            model=model,
+            choices=[{"index": 0, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop", "message": message}],
+            usage={"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        )
+
+    def _respond(self, messages: List[Any], tools: Optional[List[dict]]) -> Dict[str, Any]:
+        user_text = next((_text(_field(m, "content")) for m in messages if _field(m, "role") == "user"), "")
+        has_tool_result = any(_field(m, "role") == "tool" for m in messages)
+
+        if user_text.startswith("Source:"):
+            return {"role": "assistant", "content": f"```json\n{json.dumps(self._chunks(user_text))}\n```"}
+
+        if user_text.startswith("Categorize:"):
+            passages = re.findall(r"^\[(\d+)\]", user_text, re.MULTILINE)
+            assigned = {n: self.categories[int(n) % len(self.categories)] for n in passages}
+            return {"role": "assistant", "content": json.dumps(assigned)}
+
+        if user_text.startswith("Extract facts:"):
+            header, _, segment = user_text.partition("\n\n")
+            sections = json.loads(header.partition("sections:")[2])
+            fact = " ".join(segment.split()[:20])
+            return {"role": "assistant", "content": json.dumps({name: [fact] for name in sections})}
+
+        if user_text.startswith("scope_document:"):
+            return {"role": "assistant", "content": f"```json\n{json.dumps(self._draft(user_text))}\n```"}
+
+        collections = self._mapped_collections(user_text)
+        if tools and collections and not has_tool_result:
+            arguments = {"query": " ".join(user_text.split()[:12]), "collections": collections}
+            return {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{next(self._tool_call_ids)}",
+                    "type": "function",
+                    "function": {"name": "query_collections", "arguments": json.dumps(arguments)},
+                }],
+            }
+
+        section_names = re.findall(r'"section_name":\s*"([^"]+)"', user_text)
+        if section_names:
+            per_section = max(1, self.completion_tokens // len(section_names))
+            html = "".join(f"<h2>{name}</h2><p>{_filler(per_section, name)}</p>" for name in section_names)
+        else:
+            html = f"<p>{_filler(self.completion_tokens, user_text[:64])}</p>"
+        return {"role": "assistant", "content": html}
+
+    def _chunks(self, prompt: str) -> List[Dict[str, Any]]:
+        header, _, body = prompt.partition("\n\n")
+        source = header[len("Source:"):].strip()
+        paragraphs = [p.strip() for p in body.split("\n\n") if p.strip()] or [body.strip()]
+        return [
+            {"collection": self.categories[i % len(self.categories)], "content": paragraph, "metadata": {"source": source}}
+            for i, paragraph in enumerate(paragraphs)
+        ]
+
+    def _draft(self, prompt: str) -> Dict[str, str]:
+        match = re.search(r"sections:\s*(\[.*\])\s*$", prompt, re.DOTALL)
+        sections = ast.literal_eval(match.group(1)) if match else []
+        per_section = max(1, self.completion_tokens // max(1, len(sections)))
+        return {name: _filler(per_section, name) for name in sections}
+
+    @staticmethod
+    def _mapped_collections(prompt: str) -> List[str]:
+        collections: List[str] = []
+        blocks = re.findall(r'"collection_mappings":\s*(\[.*?\])', prompt, re.DOTALL)
+        blocks += re.findall(r"Collection Mappings:\s*(\[.*?\])", prompt, re.DOTALL)
+        for block in blocks:
+            try:
+                collections.extend(c for c in json.loads(block) if c not in collections)
+            except json.JSONDecodeError:
+                continue
+        return collections
+
+
+class FakeEmbeddingProvider:
+    """Stand-in for ``litellm.embedding`` / ``litellm.aembedding``.
+
+    Vectors come from a signed hashing trick over lower-cased words, so texts that
+    share vocabulary have a positive cosine similarity and identical texts map to
+    identical vectors.
+    """
+
+    def __init__(self, latency: float = 0.01, dimensions: int = 1536):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = 0
+
+    def embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in _WORD_RE.findall(text.lower()):
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def _response(self, model: str, input: List[str]) -> "litellm.EmbeddingResponse":
+        import litellm
+
+        self.calls += 1
+        data = [{"object": "embedding", "index": i, "embedding": self.embed(text)} for i, text in enumerate(input)]
+        return litellm.EmbeddingResponse(model=model, data=data)
+
+    def embedding(self, model: str, input: List[str], **kwargs) -> "litellm.EmbeddingResponse":
+        time.sleep(self.latency)
+        return self._response(model, input)
+
+    async def aembedding(self, model: str, input: List[str], **kwargs) -> "litellm.EmbeddingResponse":
+        await asyncio.sleep(self.latency)
+        return self._response(model, input)
+
+
+def _resolve(row: Dict[str, Any], column: str) -> Any:
+    """Resolves PostgREST column paths such as ``metadata->>source``."""
+    parts = re.split(r"->>?", column)
+    value: Any = row.get(parts[0])
+    for part in parts[1:]:
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+class _TableQuery:
+    def __init__(self, client: "InMemorySupabase", table: str):
+        self._client = client
+        self._table = table
+        self._action = "select"
+        self._columns: List[str] = []
+        self._count: Optional[str] = None
+        self._rows: List[Dict[str, Any]] = []
+        self._filters: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._order: Optional[tuple] = None
+
+    def select(self, *columns: str, count: Optional[str] = None) -> "_TableQuery":
+        self._action = "select"
+        self._columns = [c for column in columns for c in column.split(",") if c.strip() and c.strip() != "*"]
+        self._count = count
+        return self
+
+    def insert(self, rows: Any) -> "_TableQuery":
+        self._action = "insert"
+        self._rows = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def delete(self) -> "_TableQuery":
+        self._action = "delete"
+        return self
+
+    def eq(self, column: str, value: Any) -> "_TableQuery":
+        self._filters.append((column, value, operator.eq))
+        return self
+
+    def gt(self, column: str, value: Any) -> "_TableQuery":
+        self._filters.append((column, value, operator.gt))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "_TableQuery":
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count: int) -> "_TableQuery":
+        self._limit = count
+        return self
+
+    def _matches(self, row: Dict[str, Any]) -> bool:
+        return all(compare(_resolve(row, column), value) for column, value, compare in self._filters)
+
+    def execute(self) -> SimpleNamespace:
+        self._client._simulate_latency()
+        rows = self._client.tables[self._table]
+
+        if self._action == "insert":
+            inserted = []
+            for row in self._rows:
+                stored = {"id": next(self._client._ids), **row}
+                rows.append(stored)
+                inserted.append(dict(stored))
+            return SimpleNamespace(data=inserted, count=None)
+
+        matched = [row for row in rows if self._matches(row)]
+        if self._action == "delete":
+            self._client.tables[self._table] = [row for row in rows if not self._matches(row)]
+            return SimpleNamespace(data=matched, count=None)
+
+        count = len(matched) if self._count else None
+        if self._order is not None:
+            column, desc = self._order
+            matched = sorted(matched, key=lambda row: _resolve(row, column), reverse=desc)
+        if self._limit is not None:
+            matched = matched[:self._limit]
+        if self._client.max_rows is not None:
+            matched = matched[:self._client.max_rows]
+        data = [{c.strip(): row.get(c.strip()) for c in self._columns} if self._columns else dict(row) for row in matched]
+        return SimpleNamespace(data=data, count=count)
+
+
+class _RpcCall:
+    def __init__(self, client: "InMemorySupabase", function: str, params: Dict[str, Any]):
+        self._client = client
+        self._function = function
+        self._params = params
+
+    def execute(self) -> SimpleNamespace:
+        self._client._simulate_latency()
+        handler = getattr(self._client, f"_rpc_{self._function}", None)
+        if handler is None:
+            raise ValueError(f"Unknown RPC function: {self._function}")
+        return SimpleNamespace(data=handler(**self._params), count=None)
+
+
+class InMemorySupabase:
+    """In-memory stand-in for the ``supabase_rag`` client.
+
+    Implements the subset of the PostgREST query builder the routers use
+    (``select``/``insert``/``delete`` with ``eq`` and ``gt`` filters, ``order`` and
+    ``limit``) and the
+    ``match_documents`` RPC from ``supabase_script.md`` using exact cosine
+    similarity. ``max_rows`` caps every select like PostgREST's ``max-rows``
+    setting (1000 on Supabase).
+    """
+
+    def __init__(self, latency: float = 0.005, max_rows: Optional[int] = None):
+        self.latency = latency
+        self.max_rows = max_rows
+        self.tables: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        self._ids = itertools.count(1)
+
+    def _simulate_latency(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name: str) -> _TableQuery:
+        return _TableQuery(self, name)
+
+    def rpc(self, function: str, params: Dict[str, Any]) -> _RpcCall:
+        return _RpcCall(self, function, params)
+
+    def _rpc_match_documents(self, query_embedding: List[float], match_threshold: float, match_count: int, collection_filter: List[str],
+                             ef_search: Optional[int] = None, probes: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Exact search; ef_search/probes only tune the approximate index in Postgres
+        query_norm = math.sqrt(sum(v * v for v in query_embedding)) or 1.0
+        scored = []
+        for row in self.tables["documents"]:
+            if row.get("collection") not in collection_filter:
+                continue
+            embedding = row.get("embedding") or []
+            norm = math.sqrt(sum(v * v for v in embedding)) or 1.0
+            scored.append((sum(a * b for a, b in zip(query_embedding, embedding)) / (query_norm * norm), row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        # Like the SQL function: nearest match_count first, then the threshold
+        return [
+            {"id": row["id"], "collection": row["collection"], "content": row["content"], "metadata": row["metadata"], "similarity": similarity}
+            for similarity, row in scored[:match_count]
+            if similarity > match_threshold
+        ]
@@ -0,0 +1,390 @@
+"""Offline load harness that drives the real FastAPI routers against local fakes."""
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .fakes import FakeCompletionProvider, FakeEmbeddingProvider, InMemorySupabase
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+SCENARIOS = ("upload", "initial_draft", "batch_initial_draft", "regenerate", "final_generation", "listings")
+BATCH_SIZE = 5
+TEMPLATE_SECTIONS = ["Executive Summary", "Functional and Technical Solution", "Company Profile", "Why Us"]
+MAPPED_COLLECTIONS = ["Company Profile", "Case Studies"]
+
+
+@dataclass
+class BenchmarkConfig:
+    requests: int = 20
+    concurrency: int = 4
+    scenarios: Tuple[str, ...] = SCENARIOS
+    llm_latency: float = 0.05
+    tokens_per_second: float = 500.0
+    completion_tokens: int = 200
+    embedding_latency: float = 0.01
+    supabase_latency: float = 0.005
+    document_paragraphs: int = 12
+    workdir: Optional[str] = None
+
+
+@dataclass
+class ScenarioResult:
+    scenario: str
+    requests: int
+    concurrency: int
+    errors: int
+    wall_time: float
+    throughput: float
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    peak_rss_mb: float
+    status_codes: Dict[int, int] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile; returns 0.0 for an empty sample."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _reload_settings(config: Any) -> None:
+    """Re-reads the settings from the environment and drops clients built from the old values."""
+    fresh = config.Settings(_env_file=".env")
+    for name in type(fresh).model_fields:
+        setattr(config.settings, name, getattr(fresh, name))
+    _reset_clients()
+
+
+# Module-level clients built from the settings
+_CLIENTS = (("backend.database", "_engine"), ("backend.storage", "_store"))
+
+
+def _reset_clients() -> None:
+    for module, attribute in _CLIENTS:
+        if module in sys.modules:
+            setattr(sys.modules[module], attribute, None)
+
+
+@contextlib.contextmanager
+def _bootstrap_environment(workdir: Path):
+    """Points the settings at local resources for the duration of the block.
+
+    Settings that were already loaded (e.g. by another test module importing
+    ``backend``) are re-read, and clients built from the old values are dropped.
+    The environment, the settings and those clients are put back afterwards, so
+    a run inside a test process leaves nothing behind for later tests.
+    """
+    defaults = {
+        "DATABASE_URL": f"sqlite+aiosqlite:///{workdir / 'bench.db'}",
+        "STORAGE_BACKEND": "filesystem",
+        "STORAGE_PATH": str(workdir / "blobs"),
+        # Hashed fake embeddings have low absolute similarity, so accept every match
+        "RAG_MATCH_THRESHOLD": "0.0",
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+    }
+    previous_env = {name: os.environ.get(name) for name in defaults}
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+    config = sys.modules.get("backend.config")
+    previous_settings = None
+    if config is not None:
+        previous_settings = {name: getattr(config.settings, name) for name in type(config.settings).model_fields}
+        previous_clients = [(module, attribute, getattr(sys.modules[module], attribute))
+                            for module, attribute in _CLIENTS if module in sys.modules]
+        _reload_settings(config)
+    try:
+        yield
+    finally:
+        for name, value in previous_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        config = sys.modules.get("backend.config")
+        if previous_settings is not None:
+            for name, value in previous_settings.items():
+                setattr(config.settings, name, value)
+            _reset_clients()
+            for module, attribute, client in previous_clients:
+                setattr(sys.modules[module], attribute, client)
+        elif config is not None:
+            # First loaded during the run, from the benchmark's environment
+            _reload_settings(config)
+
+
+@contextlib.contextmanager
+def install_fakes(completion: FakeCompletionProvider, embedding: FakeEmbeddingProvider, supabase: InMemorySupabase):
+    """Swaps litellm and the Supabase client for the given fakes for the duration of the block."""
+    import litellm
+    import google.adk.models.lite_llm as adk_lite_llm
+    from backend import database
+    from backend.embeddings import forget_collection_models
+
+    forget_collection_models()
+    patches = [
+        (litellm, "acompletion", completion.acompletion),
+        (adk_lite_llm, "acompletion", completion.acompletion),
+        (litellm, "aembedding", embedding.aembedding),
+        (litellm, "embedding", embedding.embedding),
+        (database, "_supabase_rag", supabase),
+    ]
+    originals = [(target, name, getattr(target, name)) for target, name, _ in patches]
+    try:
+        for target, name, value in patches:
+            setattr(target, name, value)
+        yield
+    finally:
+        for target, name, value in originals:
+            setattr(target, name, value)
+
+
+def _document(index: int, paragraphs: int) -> bytes:
+    topics = ["delivery methodology", "cloud migration", "case study", "team expertise", "security compliance", "pricing model"]
+    body = "\n\n".join(
+        f"Paragraph {p} of document {index} covers our {topics[p % len(topics)]} with measurable outcomes for enterprise clients."
+        for p in range(paragraphs)
+    )
+    return body.encode("utf-8")
+
+
+async def _run_load(name: str, make_request: Callable[[int], Awaitable[Any]], config: BenchmarkConfig) -> ScenarioResult:
+    semaphore = asyncio.Semaphore(config.concurrency)
+    latencies: List[float] = []
+    status_codes: Dict[int, int] = {}
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(i)
+            latencies.append(time.perf_counter() - start)
+            status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(config.requests)))
+    wall_time = time.perf_counter() - wall_start
+
+    errors = sum(count for status, count in status_codes.items() if status >= 400)
+    return ScenarioResult(
+        scenario=name,
+        requests=config.requests,
+        concurrency=config.concurrency,
+        errors=errors,
+        wall_time=wall_time,
+        throughput=config.requests / wall_time if wall_time else 0.0,
+        mean=sum(latencies) / len(latencies) if latencies else 0.0,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        peak_rss_mb=peak_rss_mb(),
+        status_codes=status_codes,
+    )
+
+
+class _Fixtures:
+    """Creates the proposals, templates and drafts the timed scenarios operate on."""
+
+    def __init__(self, client, config: BenchmarkConfig):
+        self.client = client
+        self.config = config
+        self.template_id: Optional[int] = None
+
+    async def template(self) -> int:
+        if self.template_id is None:
+            response = await self.client.post("/templates/", json={"name": "Benchmark", "description": "Benchmark template", "sections": TEMPLATE_SECTIONS})
+            response.raise_for_status()
+            self.template_id = response.json()["id"]
+        return self.template_id
+
+    async def proposal(self, index: int, document: Optional[int] = None) -> int:
+        template_id = await self.template()
+        document = index if document is None else document
+        response = await self.client.post(
+            "/proposals/",
+            data={"name": f"Benchmark {index}", "description": "Benchmark proposal", "client_name": "Benchmark Client", "template_id": str(template_id)},
+            files={"file": (f"scope_{document}.txt", _document(document, self.config.document_paragraphs), "text/plain")},
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def drafted_proposal(self, index: int) -> int:
+        from backend.database import get_session
+        from backend.models import ProposalSection
+        from sqlmodel import select
+
+        proposal_id = await self.proposal(index)
+        response = await self.client.post("/generation/generate_initial_draft", json={"proposal_id": proposal_id})
+        response.raise_for_status()
+
+        # There is no API for collection mappings yet, so set them directly
+        async for session in get_session():
+            result = await session.exec(select(ProposalSection).where(ProposalSection.proposal_id == proposal_id))
+            for section in result.all():
+                section.collection_mappings = MAPPED_COLLECTIONS
+                section.custom_prompt = "Make this more persuasive."
+                session.add(section)
+            await session.commit()
+        return proposal_id
+
+    async def sections(self, proposal_id: int) -> List[dict]:
+        response = await self.client.get(f"/proposals/{proposal_id}/sections")
+        response.raise_for_status()
+        return response.json()
+
+    async def seed_knowledge_base(self) -> None:
+        for i in range(3):
+            response = await self.client.post(
+                "/collections/upload",
+                files={"file": (f"seed_{i}.txt", _document(i, self.config.document_paragraphs), "text/plain")},
+            )
+            response.raise_for_status()
+
+
+async def _scenario_requests(name: str, client, fixtures: _Fixtures, config: BenchmarkConfig) -> Callable[[int], Awaitable[Any]]:
+    """Prepares untimed state for a scenario and returns its per-request coroutine."""
+    if name == "upload":
+        run_id = time.time_ns()
+        # Unique content too: uploads of content already in the knowledge base are refused
+        return lambda i: client.post(
+            "/collections/upload",
+            files={"file": (f"bench_{run_id}_{i}.txt", _document(i, config.document_paragraphs) + f"\n\nRun {run_id}.".encode(), "text/plain")},
+        )
+
+    if name == "initial_draft":
+        proposal_ids = [await fixtures.proposal(i) for i in range(config.requests)]
+        return lambda i: client.post("/generation/generate_initial_draft", json={"proposal_id": proposal_ids[i]})
+
+    if name == "batch_initial_draft":
+        # Each request drafts BATCH_SIZE proposals that share one scope document
+        batches = [[await fixtures.proposal(1000 + i * BATCH_SIZE + j, document=i) for j in range(BATCH_SIZE)] for i in range(config.requests)]
+
+        async def run_batch(i: int):
+            response = await client.post("/generation/initial_drafts", json={"proposal_ids": batches[i]})
+            while response.status_code < 400 and response.json()["status"] != "completed":
+                await asyncio.sleep(0.01)
+                response = await client.get(f"/generation/initial_drafts/{response.json()['id']}")
+            if response.status_code < 400 and response.json()["counts"].get("failed"):
+                return SimpleNamespace(status_code=500)
+            return response
+
+        return run_batch
+
+    if name == "regenerate":
+        proposal_id = await fixtures.drafted_proposal(0)
+        sections = await fixtures.sections(proposal_id)
+        return lambda i: client.post(
+            f"/generation/section/{sections[i % len(sections)]['id']}/regenerate",
+            json={"source_content": sections[i % len(sections)]["versions"][0]["content"]},
+        )
+
+    if name == "final_generation":
+        proposal_id = await fixtures.drafted_proposal(1)
+        sections = await fixtures.sections(proposal_id)
+        selected = {section["id"]: section["versions"][-1]["content"] for section in sections}
+        return lambda i: client.post("/generation/generate_final_proposal", json={"proposal_id": proposal_id, "selected_versions": selected})
+
+    if name == "listings":
+        proposal_id = await fixtures.drafted_proposal(2)
+        paths = ["/templates/", "/sections/", "/proposals/", f"/proposals/{proposal_id}", "/collections"]
+        return lambda i: client.get(paths[i % len(paths)])
+
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+async def _run(config: BenchmarkConfig) -> List[ScenarioResult]:
+    import httpx
+    from backend.main import app
+    from backend.migrate import migrate
+    from backend.agent.ingestion_agent import CATEGORIES
+
+    completion = FakeCompletionProvider(
+        latency=config.llm_latency,
+        tokens_per_second=config.tokens_per_second,
+        completion_tokens=config.completion_tokens,
+        categories=CATEGORIES,
+    )
+    embedding = FakeEmbeddingProvider(latency=config.embedding_latency)
+    supabase = InMemorySupabase(latency=config.supabase_latency)
+
+    results = []
+    with install_fakes(completion, embedding, supabase):
+        await migrate()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            fixtures = _Fixtures(client, config)
+            await fixtures.seed_knowledge_base()
+            for name in config.scenarios:
+                make_request = await _scenario_requests(name, client, fixtures, config)
+                result = await _run_load(name, make_request, config)
+                logger.info(f"[BENCH] {name}: p50={result.p50:.4f}s p95={result.p95:.4f}s errors={result.errors}")
+                results.append(result)
+    return results
+
+
+def run_benchmark(config: BenchmarkConfig) -> List[ScenarioResult]:
+    """Runs the configured scenarios and returns one result per scenario.
+
+    The database and blob store live in ``config.workdir`` (a temporary directory
+    by default). The working directory is switched to the project root for the
+    duration of the run so relative settings resolve as they do under uvicorn.
+    """
+    unknown = set(config.scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with contextlib.ExitStack() as stack:
+        workdir = Path(config.workdir) if config.workdir else Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="rfpgenie-bench-")))
+        stack.enter_context(_bootstrap_environment(workdir))
+        stack.callback(os.chdir, os.getcwd())
+        os.chdir(PROJECT_ROOT)
+        return asyncio.run(_run(config))
+
+
+def format_report(results: List[ScenarioResult]) -> str:
+    out = io.StringIO()
+    header = f"{'scenario':<21}{'reqs':>6}{'conc':>6}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MiB':>10}"
+    out.write(header + "\n" + "-" * len(header) + "\n")
+    for r in results:
+        out.write(
+            f"{r.scenario:<21}{r.requests:>6}{r.concurrency:>6}{r.errors:>8}{r.throughput:>10.2f}"
+            f"{r.p50 * 1000:>10.1f}{r.p95 * 1000:>10.1f}{r.p99 * 1000:>10.1f}{r.peak_rss_mb:>10.1f}\n"
+        )
+    return out.getvalue()
+
+
+def compare_to_baseline(results: List[ScenarioResult], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Returns a message for every scenario whose p95 regressed beyond ``tolerance`` (a fraction)."""
+    regressions = []
+    for r in results:
+        previous = baseline.get(r.scenario)
+        if not previous or not previous.get("p95"):
+            continue
+        if r.p95 > previous["p95"] * (1 + tolerance):
+            regressions.append(f"{r.scenario}: p95 {r.p95 * 1000:.1f} ms vs baseline {previous['p95'] * 1000:.1f} ms")
+    return regressions
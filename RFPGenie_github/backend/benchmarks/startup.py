@@ -0,0 +1,59 @@
+"""Cold-start benchmark: how long a fresh interpreter takes to import the app."""
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+from .harness import PROJECT_ROOT, percentile
+
+# Modules that must not be imported just to build the app
+HEAVY_MODULES = ("litellm", "google.adk", "google.genai", "supabase")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import backend.main
+elapsed = time.perf_counter() - start
+heavy = [m for m in %r if m in sys.modules]
+print(json.dumps({"import_seconds": elapsed, "heavy_modules": heavy}))
+""" % (HEAVY_MODULES,)
+
+
+def measure_import(env: Dict[str, str] = None) -> Dict[str, object]:
+    """Imports ``backend.main`` in a fresh interpreter and reports the time and heavy modules loaded."""
+    probe_env = {**os.environ, **(env or {})}
+    # No credentials: importing the app must not need them
+    for key in ("DATABASE_URL", "SUPABASE_RAG_URL", "SUPABASE_RAG_KEY", "OPENAI_API_KEY"):
+        probe_env.pop(key, None)
+    probe_env.setdefault("LOG_FILE", os.devnull)
+    output = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=PROJECT_ROOT, env=probe_env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_startup_benchmark(runs: int = 5) -> Dict[str, object]:
+    samples: List[float] = []
+    heavy: List[str] = []
+    for _ in range(runs):
+        result = measure_import()
+        samples.append(result["import_seconds"])
+        heavy = result["heavy_modules"]
+    return {
+        "runs": runs,
+        "min": min(samples),
+        "p50": percentile(samples, 50),
+        "max": max(samples),
+        "heavy_modules": heavy,
+    }
+
+
+def format_startup_report(result: Dict[str, object]) -> str:
+    heavy = ", ".join(result["heavy_modules"]) or "none"
+    return (
+        f"import backend.main over {result['runs']} runs: "
+        f"min {result['min'] * 1000:.0f} ms, p50 {result['p50'] * 1000:.0f} ms, max {result['max'] * 1000:.0f} ms\n"
+        f"heavy modules loaded at import: {heavy}\n"
+    )
@@ -0,0 +1,81 @@
+"""Request-scoped cancellation for long LLM work.
+
+``cancel_on_disconnect`` runs a handler's model and retrieval work in its own
+task and cancels it as soon as the client goes away. ``LatestOnly`` keeps one
+task per key (e.g. a proposal section) and cancels the older task when a newer
+request for the same key starts.
+
+Cancellation reaches everything the task is awaiting: queued or in-flight
+governor calls, embeddings and knowledge base queries. A Supabase RPC already
+running in a worker thread finishes in the background, but its result is dropped.
+"""
+import asyncio
+import contextlib
+import logging
+import weakref
+from typing import Any, Awaitable, Dict, Hashable, Optional
+from starlette.requests import Request
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client disconnected before the work finished."""
+
+
+class Superseded(Exception):
+    """Raised when a newer request for the same key replaced the work."""
+
+
+class LatestOnly:
+    """Tracks the newest task per key and cancels the ones it replaces."""
+
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._replaced: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+
+    def start(self, key: Hashable, work: Awaitable[Any]) -> asyncio.Task:
+        previous = self._tasks.get(key)
+        if previous is not None:
+            self._replaced.add(previous)
+            if not previous.done():
+                logger.info("Cancelling superseded work for %s.", key)
+                previous.cancel()
+        task = asyncio.ensure_future(work)
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def is_latest(self, task: asyncio.Task) -> bool:
+        """False once a newer task for the same key has started."""
+        return task not in self._replaced
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[Any], poll_interval: Optional[float] = None) -> Any:
+    """Awaits ``work``, cancelling it if the client disconnects first.
+
+    Raises ClientDisconnected after a disconnect and Superseded when the work
+    was cancelled by someone else (see LatestOnly).
+    """
+    poll_interval = settings.DISCONNECT_POLL_SECONDS if poll_interval is None else poll_interval
+    task = asyncio.ensure_future(work)
+    try:
+        while not task.done():
+            await asyncio.wait({task}, timeout=poll_interval)
+            if not task.done() and await request.is_disconnected():
+                task.cancel()
+                # Let the work unwind (release limiter slots, record its checkpoint) before returning
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await task
+                raise ClientDisconnected()
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if task.cancelled():
+        raise Superseded()
+    return task.result()
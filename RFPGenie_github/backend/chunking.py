@@ -0,0 +1,105 @@
+"""Deterministic structural chunking of extracted documents.
+
+Paragraphs are packed into chunks of up to ``max_tokens`` within the section
+they belong to, so a chunk never straddles a heading. Paragraphs longer than
+that are cut into windows of ``max_tokens`` that overlap by ``overlap_tokens``.
+Each chunk starts with its heading path so it can be understood on its own.
+The whole pass is linear in the document length.
+"""
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+from .documents import Block
+
+# Rough tokens per word for English prose with an OpenAI tokenizer
+TOKENS_PER_WORD = 4 / 3
+
+
+def count_tokens(text: str) -> int:
+    return round(len(text.split()) * TOKENS_PER_WORD)
+
+
+@dataclass
+class Chunk:
+    content: str
+    headings: List[str]
+    page_start: Optional[int] = None
+    page_end: Optional[int] = None
+    index: int = 0
+
+    @property
+    def heading(self) -> str:
+        return " > ".join(self.headings)
+
+
+@dataclass
+class _Section:
+    headings: List[str]
+    paragraphs: List[Tuple[str, Optional[int]]] = field(default_factory=list)
+
+
+def _sections(blocks: List[Block]) -> Iterator[_Section]:
+    """Groups paragraphs under the heading path in force where they appear."""
+    stack: List[Tuple[int, str]] = []
+    section = _Section(headings=[])
+    for block in blocks:
+        if block.kind == "heading":
+            if section.paragraphs:
+                yield section
+            while stack and stack[-1][0] >= block.level:
+                stack.pop()
+            stack.append((block.level, block.text))
+            section = _Section(headings=[text for _, text in stack])
+        else:
+            section.paragraphs.append((block.text, block.page))
+    if section.paragraphs:
+        yield section
+
+
+def _windows(words: List[str], size: int, overlap: int) -> Iterator[List[str]]:
+    step = max(1, size - overlap)
+    for start in range(0, len(words), step):
+        yield words[start:start + size]
+        if start + size >= len(words):
+            break
+
+
+def chunk_blocks(blocks: List[Block], max_tokens: int = 400, overlap_tokens: int = 50) -> List[Chunk]:
+    """Splits document blocks into chunks of at most about ``max_tokens`` tokens."""
+    max_words = max(1, int(max_tokens / TOKENS_PER_WORD))
+    overlap_words = min(int(overlap_tokens / TOKENS_PER_WORD), max_words - 1)
+    chunks: List[Chunk] = []
+
+    def emit(section: _Section, texts: List[str], pages: List[Optional[int]]) -> None:
+        body = "\n\n".join(texts)
+        heading = " > ".join(section.headings)
+        known_pages = [p for p in pages if p is not None]
+        chunks.append(Chunk(
+            content=f"{heading}\n\n{body}" if heading else body,
+            headings=list(section.headings),
+            page_start=min(known_pages) if known_pages else None,
+            page_end=max(known_pages) if known_pages else None,
+            index=len(chunks),
+        ))
+
+    for section in _sections(blocks):
+        texts: List[str] = []
+        pages: List[Optional[int]] = []
+        size = 0
+        for text, page in section.paragraphs:
+            words = text.split()
+            if len(words) > max_words:
+                if texts:
+                    emit(section, texts, pages)
+                    texts, pages, size = [], [], 0
+                for window in _windows(words, max_words, overlap_words):
+                    emit(section, [" ".join(window)], [page])
+                continue
+            if size + len(words) > max_words and texts:
+                emit(section, texts, pages)
+                texts, pages, size = [], [], 0
+            texts.append(text)
+            pages.append(page)
+            size += len(words)
+        if texts:
+            emit(section, texts, pages)
+    return chunks
@@ -1,14 +1,124 @@
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
-    DATABASE_URL: str
-    SUPABASE_RAG_URL: str
-    SUPABASE_RAG_KEY: str
-    OPENAI_API_KEY: str
-    GOOGLE_API_KEY: str
-    VITE_TINYMCE_API_KEY: str
+    # Credentials default to empty so the app can be imported without them;
+    # the clients that need them fail on first use instead.
+    DATABASE_URL: str = ""
+    DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800  # seconds; below the server's idle connection timeout
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 500  # asyncpg prepared statements per connection
+    SUPABASE_RAG_URL: str = ""
+    SUPABASE_RAG_KEY: str = ""
+    OPENAI_API_KEY: str = ""
+    GOOGLE_API_KEY: str = ""
+    VITE_TINYMCE_API_KEY: str = ""
     FINAL_GENERATION_MODEL: str = "gpt-4-turbo"
+    INITIAL_DRAFT_MODEL: str = "gpt-4-turbo"
+    FINAL_GENERATION_MAX_TURNS: int = 7  # per attempt; a resumed run gets a fresh budget
+    FINAL_RUN_STALE_SECONDS: int = 600  # a running checkpoint this old is from a worker that died
+    FINAL_RUN_RETENTION_HOURS: int = 24
+    FINAL_INCREMENTAL: bool = True  # only regenerate final sections whose inputs changed
+    # Model routing per task (backend.routing); MODEL_ROUTES as JSON, e.g. {"regenerate": ["gpt-4o-mini", "gpt-4-turbo"]}
+    MODEL_ROUTES: Dict[str, List[str]] = {}
+    ROUTING_FAST_MODEL: str = "gpt-4o-mini"
+    ROUTING_SMALL_INPUT_TOKENS: int = 1500
+    ROUTING_MAX_LIGHT_COMPLEXITY: int = 0  # prompt_complexity score still treated as a light edit
+    PREFETCH_ENABLED: bool = True  # retrieve section context in the background when mappings change
+    PREFETCH_WORKERS: int = 2
+    PREFETCH_QUERY_WORDS: int = 30  # words of the latest version used in a section's likely query
+    PREFETCH_MATCH_MIN_OVERLAP: float = 0.5  # word overlap for a tool query to be answered from prefetched context
+    READ_CACHE_TTL_SECONDS: float = 30  # bounds how long other workers serve a changed template or proposal
+    READ_CACHE_MAX_ENTRIES: int = 1024
+    COMPRESS_MIN_BYTES: int = 1024  # cached responses at least this large are sent compressed
+    # Request profiling (backend.profiling); the token also enables the /admin endpoints
+    PROFILING_ADMIN_TOKEN: str = ""
+    PROFILING_SAMPLE_RATE: float = 0.0  # fraction of requests profiled without the X-Profile header
+    PROFILING_INTERVAL_MS: float = 5.0
+    PROFILING_BLOCK_THRESHOLD_MS: float = 50.0  # event loop wake-ups this late are recorded as stalls
+    PROFILING_BUFFER_SIZE: int = 50
+    PROFILING_MAX_CONCURRENT: int = 1
+    UPLOAD_MAX_BYTES: int = 50 * 1024 * 1024  # knowledge base uploads; larger files are refused mid-stream
+    UPLOAD_MAX_PAGES: int = 500  # PDF pages per knowledge base upload
+    SEARCH_LANGUAGE: str = "english"  # PostgreSQL text search configuration used by the search index
+    DISCONNECT_POLL_SECONDS: float = 0.5  # how often long requests check that the client is still there
     RAG_MATCH_THRESHOLD: float = 0.7
+    RAG_MATCH_COUNT: int = 5
+    RAG_LOCAL_SNAPSHOT: str = ""  # snapshot directory searched in-process instead of match_documents (backend.snapshots)
+    SNAPSHOT_BATCH_SIZE: int = 500  # rows per page on export and per insert on import
+    # Cross-encoder reranking of retrieved chunks (backend.rerank)
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 20  # chunks fetched by similarity for the reranker
+    RERANK_TOP_K: int = 5
+    RERANK_CONTEXT_TOKENS: int = 1200  # context returned per query
+    RERANK_MIN_SENTENCE_SCORE: float = 0.0  # cross-encoder logit; lower-scoring sentences are trimmed
+    RERANK_BATCH_SIZE: int = 32
+    RERANK_BATCH_WAIT_MS: float = 5.0
+    # Direct Postgres connection to the Supabase database, only used by backend.rag_migrations
+    SUPABASE_RAG_DB_URL: str = ""
+    RAG_EMBEDDING_DIMENSIONS: int = 1536
+    RAG_VECTOR_INDEX: str = "hnsw"  # "hnsw" or "ivfflat"
+    RAG_HNSW_M: int = 16
+    RAG_HNSW_EF_CONSTRUCTION: int = 64
+    RAG_IVFFLAT_LISTS: int = 100
+    # Query-time recall/speed trade-off passed to match_documents; 0 keeps the server default
+    RAG_HNSW_EF_SEARCH: int = 0
+    RAG_IVFFLAT_PROBES: int = 0
+    EMBEDDING_PROVIDER: str = "litellm"  # "litellm" or "local"
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    EMBEDDING_DIMENSIONS: int = 1536  # of EMBEDDING_MODEL; must equal RAG_EMBEDDING_DIMENSIONS
+    LOCAL_EMBEDDING_MODEL: str = "sentence-transformers/all-MiniLM-L6-v2"
+    LOCAL_EMBEDDING_DIMENSIONS: int = 384
+    EMBEDDING_BATCH_SIZE: int = 32
+    EMBEDDING_BATCH_WAIT_MS: float = 5.0
+    EMBEDDING_QUEUE_SIZE: int = 1024
+    LOG_FILE: str = "app.log"
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    LOG_QUEUE_SIZE: int = 10000
+    LOG_PAYLOAD_MAX_CHARS: int = 500
+    LOG_PAYLOAD_SAMPLE_RATE: float = 0.05
+    AUTO_MIGRATE: bool = False
+    INGESTION_CHUNKER: str = "local"  # "local" or "agent"
+    CHUNK_MAX_TOKENS: int = 400
+    CHUNK_OVERLAP_TOKENS: int = 50
+    INGESTION_CATEGORIZE: bool = True
+    CATEGORIZE_BATCH_SIZE: int = 16
+    CATEGORIZATION_MODEL: str = "gpt-4-turbo"
+    # Scope documents above this many tokens are drafted map-reduce style; 0 disables it
+    DRAFT_MAP_REDUCE_TOKENS: int = 12000
+    DRAFT_SEGMENT_TOKENS: int = 3000
+    DRAFT_SEGMENT_OVERLAP_TOKENS: int = 150
+    DRAFT_EXTRACTION_MODEL: str = "gpt-4-turbo"
+    DRAFT_FACTS_MAX_TOKENS: int = 8000  # facts passed on to the drafting call
+    DRAFT_SEGMENT_CACHE_SIZE: int = 2048
+    STORAGE_BACKEND: str = "filesystem"  # "filesystem" or "s3"
+    STORAGE_PATH: str = "backend/uploads"
+    S3_BUCKET: str = ""
+    S3_PREFIX: str = "blobs/"
+    S3_ENDPOINT_URL: str = ""
+    S3_REGION: str = ""
+    # Limits applied per model by the LLM governor; 0 disables a rate limit
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_REQUESTS_PER_MINUTE: int = 0
+    LLM_TOKENS_PER_MINUTE: int = 0
+    # Per-model overrides as JSON, e.g. {"gpt-4-turbo": {"concurrency": 4, "rpm": 500, "tpm": 300000}}
+    LLM_MODEL_LIMITS: Dict[str, Dict[str, int]] = {}
+    LLM_EXPECTED_COMPLETION_TOKENS: int = 1000
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 30.0
+    DRAFT_BATCH_WORKERS: int = 4
+    DRAFT_BATCH_MAX_PROPOSALS: int = 100
+    # Unfinished batch jobs whose worker has not sent a heartbeat for this long are queued again
+    DRAFT_JOB_HEARTBEAT_SECONDS: int = 30
+    DRAFT_JOB_STALE_SECONDS: int = 300
+    DRAFT_RECOVER_ON_STARTUP: bool = False
 
     class Config:
         pass
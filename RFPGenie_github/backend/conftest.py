@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel
+
+from backend import database
+from backend.logging_config import shutdown_logging
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _stop_log_listener():
+    """Stops the listener thread started by importing ``backend.main`` before the interpreter exits."""
+    yield
+    shutdown_logging()
+
+
+@pytest.fixture
+def db_engine(tmp_path, monkeypatch):
+    """A SQLite database with every table, used by the app's sessions for the test.
+
+    NullPool: each ``asyncio.run`` and the test client run on their own event
+    loop, and connections can't be shared between loops.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    monkeypatch.setattr(database, "_engine", engine)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(create_tables())
+    yield engine
+    asyncio.run(engine.dispose())
@@ -1,18 +1,102 @@
-from sqlalchemy.ext.asyncio import create_async_engine
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlalchemy.orm import sessionmaker
-from supabase import create_client, Client
 from .config import settings
 
-# Supabase client for RAG database
-supabase_rag: Client = create_client(settings.SUPABASE_RAG_URL, settings.SUPABASE_RAG_KEY)
+if TYPE_CHECKING:
+    from supabase import Client
 
-# SQLModel engine
-engine = create_async_engine(settings.DATABASE_URL, echo=True, future=True)
+# Both clients are created on first use so importing the app needs no credentials
+_supabase_rag: Optional["Client"] = None
+_engine: Optional[AsyncEngine] = None
 
-async def get_session() -> AsyncSession:
-    async_session = sessionmaker(
-        engine, class_=AsyncSession, expire_on_commit=False
+# The one session factory for the process; bound to the engine on first use
+SessionFactory = async_sessionmaker(class_=AsyncSession, expire_on_commit=False)
+
+def get_supabase_rag() -> "Client":
+    """Returns the Supabase client for the RAG database, creating it on first use."""
+    global _supabase_rag
+    if _supabase_rag is None:
+        if not settings.SUPABASE_RAG_URL or not settings.SUPABASE_RAG_KEY:
+            raise RuntimeError("SUPABASE_RAG_URL and SUPABASE_RAG_KEY must be set to use the knowledge base.")
+        from supabase import create_client
+        _supabase_rag = create_client(settings.SUPABASE_RAG_URL, settings.SUPABASE_RAG_KEY)
+    return _supabase_rag
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long checkouts wait for a free connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.wait_stats = {"checkouts": 0, "timeouts": 0, "wait_seconds_total": 0.0, "wait_seconds_max": 0.0}
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.wait_stats["timeouts"] += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.wait_stats["checkouts"] += 1
+            self.wait_stats["wait_seconds_total"] += waited
+            self.wait_stats["wait_seconds_max"] = max(self.wait_stats["wait_seconds_max"], waited)
+        return connection
+
+def engine_options(database_url: str) -> Dict[str, Any]:
+    """create_async_engine arguments for the configured profile."""
+    url = make_url(database_url)
+    options: Dict[str, Any] = {"echo": settings.DB_ECHO, "pool_pre_ping": settings.DB_POOL_PRE_PING}
+    if url.get_backend_name() == "sqlite":
+        # SQLite picks its own pool (a single connection for :memory:)
+        return options
+    options.update(
+        poolclass=TimedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
     )
-    async with async_session() as session:
+    if url.get_driver_name() == "asyncpg":
+        # Cache of prepared statements per connection; set to 0 behind pgbouncer in transaction mode
+        options["connect_args"] = {"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    return options
+
+def get_engine() -> AsyncEngine:
+    """Returns the SQLModel engine, creating it on first use."""
+    global _engine
+    if _engine is None:
+        if not settings.DATABASE_URL:
+            raise RuntimeError("DATABASE_URL must be set to use the database.")
+        _engine = create_async_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL))
+    return _engine
+
+def get_session_factory() -> async_sessionmaker:
+    engine = get_engine()
+    if SessionFactory.kw.get("bind") is not engine:
+        SessionFactory.configure(bind=engine)
+    return SessionFactory
+
+async def get_session() -> AsyncSession:
+    async with get_session_factory()() as session:
         yield session
+
+def pool_stats() -> Dict[str, Any]:
+    """Connection pool usage; empty until the engine has been created."""
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    stats: Dict[str, Any] = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        stats.update(size=pool.size(), checked_out=pool.checkedout(), checked_in=pool.checkedin(), overflow=pool.overflow())
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update(pool.wait_stats)
+    return stats
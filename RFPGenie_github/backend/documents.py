@@ -0,0 +1,137 @@
+"""Text and structure extraction for uploaded .pdf, .docx and .txt documents."""
+import io
+import re
+from dataclasses import dataclass
+from typing import BinaryIO, Iterable, List, Optional
+from .storage import document_extension, open_document
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+
+
+class UnsupportedDocumentType(ValueError):
+    """Raised for file types that cannot be read."""
+
+
+def extract_text(f: BinaryIO, extension: str, text_fallback: bool = False) -> str:
+    """Extracts the text of an open binary file.
+
+    Unknown extensions raise UnsupportedDocumentType, or are decoded as UTF-8
+    text when ``text_fallback`` is set.
+    """
+    extension = extension.lower()
+    if extension == ".pdf":
+        import pypdf
+        reader = pypdf.PdfReader(f)
+        return "".join(page.extract_text() or "" for page in reader.pages)
+    if extension == ".docx":
+        import docx
+        doc = docx.Document(f)
+        return "".join(para.text + "\n" for para in doc.paragraphs)
+    errors = "ignore" if text_fallback else "strict"
+    if extension == ".txt" or text_fallback:
+        return io.TextIOWrapper(f, encoding="utf-8", errors=errors).read()
+    raise UnsupportedDocumentType(f"Unsupported file type: {extension}")
+
+
+def read_document(ref: str, text_fallback: bool = False) -> str:
+    """Reads the text of a stored document given its blob URI or legacy path."""
+    with open_document(ref) as f:
+        return extract_text(f, document_extension(ref), text_fallback=text_fallback)
+
+
+@dataclass(frozen=True)
+class Block:
+    """A heading or paragraph of a document, with the page it starts on (PDF only)."""
+
+    kind: str  # "heading" or "paragraph"
+    text: str
+    level: int = 0  # heading depth, 1 for top-level headings
+    page: Optional[int] = None
+
+
+_MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.+?)\s*#*$")
+_NUMBERED_HEADING = re.compile(r"^(\d+(?:\.\d+)*)\.?\s+\S")
+
+
+def heading_level(line: str) -> int:
+    """Heading depth of a plain-text line, or 0 when it reads like body text.
+
+    Extracted PDF and text files carry no styles, so short lines without
+    closing punctuation that are numbered, upper case or title case are taken
+    as headings.
+    """
+    markdown = _MARKDOWN_HEADING.match(line)
+    if markdown:
+        return len(markdown.group(1))
+    words = line.split()
+    if not 0 < len(words) <= 12 or len(line) > 80 or line[-1] in ".,;:!?":
+        return 0
+    numbered = _NUMBERED_HEADING.match(line)
+    if numbered:
+        return numbered.group(1).count(".") + 1
+    letters = [c for c in line if c.isalpha()]
+    if letters and all(c.isupper() for c in letters):
+        return 1
+    capitalized = sum(1 for word in words if word[0].isupper() or not word[0].isalpha())
+    return 2 if capitalized / len(words) >= 0.6 and words[0][0].isupper() else 0
+
+
+def blocks_from_lines(lines: Iterable[str], page: Optional[int] = None) -> List[Block]:
+    """Splits plain text into headings and paragraphs; blank lines and headings end a paragraph."""
+    blocks: List[Block] = []
+    paragraph: List[str] = []
+
+    def end_paragraph() -> None:
+        if paragraph:
+            blocks.append(Block("paragraph", " ".join(paragraph), page=page))
+            paragraph.clear()
+
+    for raw in lines:
+        line = raw.strip()
+        if not line:
+            end_paragraph()
+            continue
+        level = heading_level(line)
+        if level:
+            end_paragraph()
+            markdown = _MARKDOWN_HEADING.match(line)
+            blocks.append(Block("heading", markdown.group(2) if markdown else line, level=level, page=page))
+        else:
+            paragraph.append(line)
+    end_paragraph()
+    return blocks
+
+
+def extract_blocks(f: BinaryIO, extension: str) -> List[Block]:
+    """Extracts the headings and paragraphs of an open binary file, in document order."""
+    extension = extension.lower()
+    if extension == ".pdf":
+        import pypdf
+        reader = pypdf.PdfReader(f)
+        blocks: List[Block] = []
+        for number, page in enumerate(reader.pages, start=1):
+            blocks.extend(blocks_from_lines((page.extract_text() or "").splitlines(), page=number))
+        return blocks
+    if extension == ".docx":
+        import docx
+        blocks = []
+        for para in docx.Document(f).paragraphs:
+            text = para.text.strip()
+            if not text:
+                continue
+            style = para.style.name if para.style is not None else ""
+            if style == "Title" or style.startswith("Heading"):
+                level = int(style.split()[-1]) if style.split()[-1].isdigit() else 1
+                blocks.append(Block("heading", text, level=level))
+            else:
+                blocks.append(Block("paragraph", text))
+        return blocks
+    if extension == ".txt":
+        return blocks_from_lines(io.TextIOWrapper(f, encoding="utf-8").read().splitlines())
+    raise UnsupportedDocumentType(f"Unsupported file type: {extension}")
+
+
+def read_document_blocks(ref: str) -> List[Block]:
+    """Reads the structure of a stored document given its blob URI or legacy path."""
+    with open_document(ref) as f:
+        return extract_blocks(f, document_extension(ref))
@@ -0,0 +1,487 @@
+"""Initial draft generation, for single proposals and for batches.
+
+Batches are persisted as a ``DraftBatch`` with one ``DraftJob`` per proposal and
+run by a bounded pool of in-process workers (``DRAFT_BATCH_WORKERS``). Jobs of a
+batch share the template sections loaded when the batch was created, and scope
+documents are read once per stored file, so proposals created from the same
+upload are only parsed once. While a job is in a pool its ``heartbeat_at`` is
+touched every ``DRAFT_JOB_HEARTBEAT_SECONDS``; jobs whose heartbeat is older
+than ``DRAFT_JOB_STALE_SECONDS`` were left behind by a process that stopped (a
+restart or a crash) and are queued again by :func:`recover_draft_jobs` when
+their batch is read. A job is claimed atomically, so it runs once even when it
+is queued twice.
+
+Scope documents longer than ``DRAFT_MAP_REDUCE_TOKENS`` do not fit one prompt
+comfortably, so they are drafted in two steps: the document is cut into
+segments of about ``DRAFT_SEGMENT_TOKENS``, the facts relevant to each section
+are extracted from every segment concurrently (map), and the initial draft
+agent writes the sections from those facts (reduce). Extracted facts are
+cached by segment hash, so a retry only pays for the segments that failed.
+"""
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .chunking import chunk_blocks, count_tokens
+from .config import settings
+from .database import get_session
+from .documents import blocks_from_lines, read_document
+from .ingestion import parse_json_response
+from .llm import Priority, get_llm_governor, llm_priority
+from .models import DraftJob, Proposal, ProposalSection, SectionVersion, Template
+from .response_cache import invalidate_proposal
+from .search import index_versions
+from .routing import TASK_INITIAL_DRAFT, choose_route, track_route
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"  # the proposal already had a draft
+FINISHED_JOB_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_SKIPPED)
+
+
+async def _agent_response(prompt: str, model: str) -> str:
+    from google.genai import types
+    from google.adk.models.llm_request import LlmRequest
+    from .agent.main_agent import get_initial_draft_agent
+
+    initial_draft_agent = get_initial_draft_agent(model)
+    llm_request = LlmRequest(
+        contents=[types.Content(role="user", parts=[types.Part(text=prompt)])],
+        config=types.GenerateContentConfig(system_instruction=initial_draft_agent.instruction)
+    )
+    response_generator = initial_draft_agent.model.generate_content_async(llm_request)
+    return "".join([part.content.parts[0].text async for part in response_generator if part.content and part.content.parts])
+
+
+def _draft_problem(response_text: str, sections: List[str]):
+    """The parsed draft and why it is unusable (None when it is fine)."""
+    if not response_text:
+        return None, "empty response"
+    try:
+        draft = parse_json_response(response_text)
+    except json.JSONDecodeError:
+        return None, "invalid JSON"
+    if not isinstance(draft, dict):
+        return None, "not a JSON object"
+    missing = [name for name in sections if not draft.get(name)]
+    return draft, f"missing sections {missing}" if missing else None
+
+
+async def _draft_from_prompt(prompt: str, sections: List[str]) -> Dict[str, str]:
+    """Runs the initial draft agent on the routed model, moving up a model while the draft is unusable."""
+    route = choose_route(TASK_INITIAL_DRAFT, count_tokens(prompt))
+    while True:
+        with track_route(route) as attempt:
+            draft, problem = _draft_problem(await _agent_response(prompt, route.model), sections)
+            attempt.invalid = problem
+        if problem is None:
+            return draft
+        next_route = route.escalate(problem)
+        if next_route is None:
+            if draft is None:
+                raise ValueError(f"Agent returned an unusable response ({problem}).")
+            return draft
+        logger.warning("Initial draft from %s unusable (%s), retrying with %s.", route.model, problem, next_route.model)
+        route = next_route
+
+
+def scope_segments(scope_document: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """Cuts a scope document into consecutive segments of at most about ``max_tokens``.
+
+    Structural chunks are packed greedily, so segments break at headings or
+    paragraphs where possible and mid-paragraph only for very long paragraphs.
+    """
+    chunks = chunk_blocks(blocks_from_lines(scope_document.splitlines()), max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    segments: List[str] = []
+    current: List[str] = []
+    size = 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk.content)
+        if current and size + tokens > max_tokens:
+            segments.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(chunk.content)
+        size += tokens
+    if current:
+        segments.append("\n\n".join(current))
+    return segments
+
+
+class SegmentFactsCache:
+    """Least recently used map from segment key to extracted facts."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, List[str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model: str, sections: List[str], segment: str) -> str:
+        payload = json.dumps([model, sections, segment], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, List[str]]]:
+        facts = self._entries.get(key)
+        if facts is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return facts
+
+    def put(self, key: str, facts: Dict[str, List[str]]) -> None:
+        self._entries[key] = facts
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_segment_cache: Optional[SegmentFactsCache] = None
+
+
+def get_segment_cache() -> SegmentFactsCache:
+    global _segment_cache
+    if _segment_cache is None:
+        _segment_cache = SegmentFactsCache(settings.DRAFT_SEGMENT_CACHE_SIZE)
+    return _segment_cache
+
+
+async def extract_segment_facts(segment: str, sections: List[str]) -> Dict[str, List[str]]:
+    """Facts relevant to each section found in one segment, served from the cache when possible."""
+    from .agent.main_agent import SCOPE_EXTRACTION_INSTRUCTION
+
+    model = settings.DRAFT_EXTRACTION_MODEL
+    cache = get_segment_cache()
+    key = cache.key(model, sections, segment)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    messages = [
+        {"role": "system", "content": SCOPE_EXTRACTION_INSTRUCTION},
+        {"role": "user", "content": f"Extract facts:\nsections: {json.dumps(sections)}\n\n{segment}"},
+    ]
+    response = await get_llm_governor().acompletion(model=model, messages=messages)
+    extracted = parse_json_response(response.choices[0].message.content or "")
+    if not isinstance(extracted, dict):
+        raise ValueError("Fact extraction did not return a JSON object.")
+    facts = {
+        name: [str(fact).strip() for fact in extracted.get(name) or [] if str(fact).strip()]
+        for name in sections
+    }
+    cache.put(key, facts)
+    return facts
+
+
+def merge_facts(segment_facts: List[Dict[str, List[str]]], sections: List[str], max_tokens: int) -> str:
+    """Facts per section in document order, without duplicates and within ``max_tokens`` overall."""
+    budget = max(1, max_tokens // max(1, len(sections)))
+    parts = []
+    for name in sections:
+        seen: Set[str] = set()
+        lines: List[str] = []
+        size = 0
+        for facts in segment_facts:
+            for fact in facts.get(name, []):
+                normalized = " ".join(fact.lower().split())
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+                tokens = count_tokens(fact)
+                if lines and size + tokens > budget:
+                    break
+                lines.append(f"- {fact}")
+                size += tokens
+        parts.append(f"## {name}\n" + ("\n".join(lines) if lines else "- No information in the scope document."))
+    return "\n\n".join(parts)
+
+
+async def build_initial_draft(scope_document: str, sections: List[str]) -> Dict[str, str]:
+    """Asks the initial draft agent for one block of content per template section."""
+    threshold = settings.DRAFT_MAP_REDUCE_TOKENS
+    if threshold <= 0 or count_tokens(scope_document) <= threshold:
+        return await _draft_from_prompt(f"scope_document: {scope_document}\n\nsections: {sections}", sections)
+
+    segments = scope_segments(scope_document, settings.DRAFT_SEGMENT_TOKENS, settings.DRAFT_SEGMENT_OVERLAP_TOKENS)
+    logger.info("Drafting from a %d-segment scope document via fact extraction.", len(segments))
+    segment_facts = await asyncio.gather(*(extract_segment_facts(segment, sections) for segment in segments))
+    facts = merge_facts(segment_facts, sections, settings.DRAFT_FACTS_MAX_TOKENS)
+    summary = f"Facts extracted from each part of a long scope document, grouped by section.\n\n{facts}"
+    return await _draft_from_prompt(f"scope_document: {summary}\n\nsections: {sections}", sections)
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+class DraftAlreadyExists(Exception):
+    """Raised when a proposal already has draft sections."""
+
+
+class DraftInProgress(Exception):
+    """Raised when this process is already generating a draft for the proposal."""
+
+
+# Proposals this process is drafting, so a repeated request does not pay for a
+# second LLM call; the unique index on (proposal_id, section_name) covers other workers
+_in_progress: Set[int] = set()
+
+
+@contextlib.contextmanager
+def claim_proposal(proposal_id: int):
+    if proposal_id in _in_progress:
+        raise DraftInProgress(proposal_id)
+    _in_progress.add(proposal_id)
+    try:
+        yield
+    finally:
+        _in_progress.discard(proposal_id)
+
+
+async def has_initial_draft(session: AsyncSession, proposal_id: int) -> bool:
+    result = await session.exec(select(ProposalSection.id).where(ProposalSection.proposal_id == proposal_id).limit(1))
+    return result.first() is not None
+
+
+async def save_initial_draft(session: AsyncSession, proposal_id: int, draft: Dict[str, str]) -> None:
+    """Stores a draft and commits it together with anything else pending in ``session``.
+
+    All sections go in one multi-row ``INSERT ... RETURNING``, and all first
+    versions and their search entries in one more each, whatever the number
+    of sections. Raises DraftAlreadyExists, with the session rolled back, when
+    another request stored sections for the proposal first.
+    """
+    if not draft:
+        await session.commit()
+        return
+    created_at = _utcnow()
+    try:
+        result = await session.exec(
+            insert(ProposalSection).returning(ProposalSection.id, ProposalSection.section_name),
+            params=[{"proposal_id": proposal_id, "section_name": name, "collection_mappings": [], "custom_prompt": ""} for name in draft],
+        )
+        section_ids = {name: section_id for section_id, name in result.all()}
+        result = await session.exec(
+            insert(SectionVersion).returning(SectionVersion.id, SectionVersion.proposal_section_id),
+            params=[
+                {"proposal_section_id": section_ids[name], "version_number": 1, "content": content, "created_at": created_at}
+                for name, content in draft.items()
+            ],
+        )
+        section_names = {section_id: name for name, section_id in section_ids.items()}
+        await index_versions(session, proposal_id, [
+            (version_id, section_names[section_id], draft[section_names[section_id]]) for version_id, section_id in result.all()
+        ], new=True)
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise DraftAlreadyExists(proposal_id)
+    invalidate_proposal(proposal_id)
+
+
+@dataclass
+class BatchContext:
+    """Work shared by the jobs of one batch."""
+
+    template_sections: Dict[int, List[str]]
+    # proposal id -> (template id, scope document reference)
+    proposals: Dict[int, tuple]
+    _documents: Dict[str, asyncio.Future] = field(default_factory=dict)
+
+    def scope_document(self, ref: str) -> asyncio.Future:
+        """Text of a scope document, read at most once per batch."""
+        if ref not in self._documents:
+            self._documents[ref] = asyncio.ensure_future(asyncio.to_thread(read_document, ref, text_fallback=True))
+        return self._documents[ref]
+
+
+async def load_batch_context(session: AsyncSession, proposal_ids: List[int]) -> BatchContext:
+    """The template sections and scope documents of the proposals; missing proposals are left out."""
+    # Only the columns the jobs need; loading Proposal rows would pull in every section version
+    result = await session.exec(select(Proposal.id, Proposal.template_id, Proposal.scope_document_path).where(Proposal.id.in_(proposal_ids)))
+    proposals = {row[0]: (row[1], row[2]) for row in result.all()}
+    template_ids = {template_id for template_id, _ in proposals.values()}
+    result = await session.exec(select(Template.id, Template.sections).where(Template.id.in_(template_ids)))
+    return BatchContext(template_sections={row[0]: row[1] for row in result.all()}, proposals=proposals)
+
+
+async def _finish_job(session: AsyncSession, job: DraftJob, status: str, error: Optional[str] = None) -> None:
+    job.status = status
+    job.error = error
+    job.sections_written = 0
+    job.finished_at = _utcnow()
+    session.add(job)
+    await session.commit()
+
+
+async def run_draft_job(job_id: int, context: BatchContext) -> None:
+    """Generates and stores the draft for one job, recording its progress."""
+    async for session in get_session():
+        # Claimed in one statement, so a job queued twice (see recover_draft_jobs) runs once
+        now = _utcnow()
+        claimed = await session.exec(
+            update(DraftJob).where(DraftJob.id == job_id, DraftJob.status == JOB_QUEUED).values(status=JOB_RUNNING, started_at=now, heartbeat_at=now)
+        )
+        await session.commit()
+        if not claimed.rowcount:
+            return
+        job = await session.get(DraftJob, job_id)
+        # Kept outside the ORM object, which is expired if the job's work is rolled back
+        proposal_id, batch_id = job.proposal_id, job.batch_id
+
+        try:
+            with claim_proposal(proposal_id):
+                if await has_initial_draft(session, proposal_id):
+                    raise DraftAlreadyExists(proposal_id)
+                if proposal_id not in context.proposals:
+                    raise LookupError("Proposal not found")
+                template_id, scope_document_ref = context.proposals[proposal_id]
+                sections = context.template_sections.get(template_id)
+                if sections is None:
+                    raise LookupError("Template not found")
+                scope_document = await context.scope_document(scope_document_ref)
+                with llm_priority(Priority.BULK):
+                    draft = await build_initial_draft(scope_document, sections)
+                # The draft and the job's completion are committed together
+                job.status = JOB_COMPLETED
+                job.sections_written = len(draft)
+                job.finished_at = _utcnow()
+                session.add(job)
+                await save_initial_draft(session, proposal_id, draft)
+        except (DraftAlreadyExists, DraftInProgress):
+            await _finish_job(session, job, JOB_SKIPPED)
+        except Exception as e:
+            logger.error("[DRAFT_BATCH] Job %s for proposal %s failed: %s", job_id, proposal_id, e, exc_info=True)
+            await session.rollback()
+            await _finish_job(session, job, JOB_FAILED, error=str(e)[:500])
+        logger.info("[DRAFT_BATCH] Job %s for proposal %s %s.", job_id, proposal_id, job.status, extra={"batch_id": batch_id})
+
+
+class DraftWorkerPool:
+    """A fixed number of worker tasks consuming draft jobs from one queue.
+
+    A heartbeat task keeps the jobs in the pool, queued or running, from being
+    taken for orphans by other processes.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Set[int] = set()
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending = set()
+            self._tasks = [loop.create_task(self._worker(), name=f"draft-worker-{i}") for i in range(self.workers)]
+            self._tasks.append(loop.create_task(self._heartbeat(), name="draft-heartbeat"))
+
+    def submit(self, job_ids: List[int], context: BatchContext) -> None:
+        self._ensure_started()
+        for job_id in job_ids:
+            self._pending.add(job_id)
+            self._queue.put_nowait((job_id, context))
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, context = await self._queue.get()
+            try:
+                await run_draft_job(job_id, context)
+            except Exception as e:
+                logger.error("[DRAFT_BATCH] Worker could not run job %s: %s", job_id, e, exc_info=True)
+            finally:
+                self._pending.discard(job_id)
+                self._queue.task_done()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(settings.DRAFT_JOB_HEARTBEAT_SECONDS)
+            if not self._pending:
+                continue
+            try:
+                async for session in get_session():
+                    await session.exec(
+                        update(DraftJob)
+                        .where(DraftJob.id.in_(list(self._pending)), DraftJob.status.in_((JOB_QUEUED, JOB_RUNNING)))
+                        .values(heartbeat_at=_utcnow())
+                    )
+                    await session.commit()
+            except Exception as e:
+                logger.error("[DRAFT_BATCH] Could not record the heartbeat of %d jobs: %s", len(self._pending), e)
+
+    async def join(self) -> None:
+        """Waits until every submitted job has finished."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+_pool: Optional[DraftWorkerPool] = None
+
+
+def get_draft_pool() -> DraftWorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = DraftWorkerPool(settings.DRAFT_BATCH_WORKERS)
+    return _pool
+
+
+def is_orphaned(job: DraftJob) -> bool:
+    """True for an unfinished job whose worker has not sent a heartbeat within ``DRAFT_JOB_STALE_SECONDS``."""
+    stale = _utcnow() - job.heartbeat_at > datetime.timedelta(seconds=settings.DRAFT_JOB_STALE_SECONDS)
+    return job.status in (JOB_QUEUED, JOB_RUNNING) and stale
+
+
+async def recover_draft_jobs(batch_id: Optional[int] = None) -> int:
+    """Queues the orphaned jobs (see :func:`is_orphaned`), of one batch or of all; returns their number.
+
+    Their queue lived in the memory of a process that stopped, so without this
+    their batches would report "running" forever. Running jobs start over. Jobs
+    of live workers keep sending heartbeats and are left alone.
+    """
+    cutoff = _utcnow() - datetime.timedelta(seconds=settings.DRAFT_JOB_STALE_SECONDS)
+    unfinished = (DraftJob.status.in_((JOB_QUEUED, JOB_RUNNING)), DraftJob.heartbeat_at < cutoff)
+    async for session in get_session():
+        query = select(DraftJob.id, DraftJob.proposal_id).where(*unfinished)
+        if batch_id is not None:
+            query = query.where(DraftJob.batch_id == batch_id)
+        candidates = (await session.exec(query)).all()
+        recovered = {}
+        for job_id, proposal_id in candidates:
+            # Conditional, so of two processes recovering at once only one takes each job
+            taken = await session.exec(
+                update(DraftJob).where(DraftJob.id == job_id, *unfinished)
+                .values(status=JOB_QUEUED, started_at=None, heartbeat_at=_utcnow())
+            )
+            if taken.rowcount:
+                recovered[job_id] = proposal_id
+        await session.commit()
+        if not recovered:
+            return 0
+        context = await load_batch_context(session, list(set(recovered.values())))
+    get_draft_pool().submit(list(recovered), context)
+    logger.info("[DRAFT_BATCH] Queued %d jobs left unfinished by a stopped process.", len(recovered))
+    return len(recovered)
@@ -0,0 +1,264 @@
+"""Pluggable embedding providers and the per-collection embedding model registry.
+
+``get_embedding_provider()`` returns the provider selected by ``EMBEDDING_PROVIDER``:
+
+* ``litellm`` (default) sends texts to ``EMBEDDING_MODEL`` through litellm.
+* ``local`` runs ``LOCAL_EMBEDDING_MODEL`` with sentence-transformers on the CPU.
+  Requests from all concurrent callers go through one bounded queue and are
+  encoded together by a dedicated worker thread, so the event loop never runs
+  model inference.
+
+Every stored chunk records the model that embedded it in
+``metadata.embedding_model``. Vectors from different models are not comparable,
+so queries and uploads against a collection built with another model are refused.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+import concurrent.futures
+import logging
+import queue
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+from .config import settings
+from .database import get_supabase_rag
+from .llm import get_llm_governor
+
+logger = logging.getLogger(__name__)
+
+# Model of chunks stored before the model was recorded per chunk
+LEGACY_EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+class EmbeddingQueueFull(RuntimeError):
+    """Raised when the local embedding queue is at capacity."""
+
+
+class EmbeddingModelMismatch(Exception):
+    """Raised when collections were embedded with a different model than the active provider."""
+
+    def __init__(self, mismatched: Dict[str, str], model_id: str):
+        self.mismatched = mismatched
+        self.model_id = model_id
+        details = ", ".join(f"'{c}' ({m})" for c, m in mismatched.items())
+        super().__init__(f"Collections {details} were embedded with a different model than the active one ({model_id}). Re-ingest them or switch EMBEDDING_PROVIDER back.")
+
+
+class EmbeddingProvider(ABC):
+    """Turns texts into vectors of ``dimensions`` floats. ``model_id`` identifies the vector space."""
+
+    model_id: str
+    dimensions: int
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class LiteLLMEmbeddingProvider(EmbeddingProvider):
+    """Remote embeddings through litellm, sent in batches of ``batch_size`` texts per request."""
+
+    def __init__(self, model: str, dimensions: int, batch_size: int = 256):
+        self.model_id = model
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+
+    def _batches(self, texts: List[str]) -> Iterable[List[str]]:
+        for start in range(0, len(texts), self.batch_size):
+            yield texts[start:start + self.batch_size]
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        governor = get_llm_governor()
+        responses = await asyncio.gather(*(governor.aembedding(model=self.model_id, input=batch) for batch in self._batches(texts)))
+        return [item['embedding'] for response in responses for item in response.data]
+
+
+class _EmbeddingRequest:
+    __slots__ = ("texts", "future")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+_STOP = object()
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """sentence-transformers on the CPU with dynamic batching across callers.
+
+    The worker thread blocks for the first queued request, then keeps collecting
+    requests for up to ``max_wait_ms`` or until ``max_batch_size`` texts are
+    waiting, and encodes them in a single forward pass. The model is loaded by
+    the worker on first use.
+    """
+
+    def __init__(self, model_name: str, dimensions: int, max_batch_size: int = 32, max_wait_ms: float = 5.0,
+                 max_queue_size: int = 1024, device: str = "cpu"):
+        self.model_name = model_name
+        self.model_id = f"local:{model_name}"
+        self.dimensions = dimensions
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.device = device
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="local-embedding-worker", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first: _EmbeddingRequest) -> tuple:
+        batch = [first]
+        size = len(first.texts)
+        stop = False
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+            size += len(item.texts)
+        return batch, stop
+
+    def _encode_batch(self, model, batch: List[_EmbeddingRequest]) -> None:
+        texts = [text for item in batch for text in item.texts]
+        try:
+            vectors = model.encode(texts, batch_size=self.max_batch_size, normalize_embeddings=True, convert_to_numpy=True).tolist()
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        offset = 0
+        for item in batch:
+            item.future.set_result(vectors[offset:offset + len(item.texts)])
+            offset += len(item.texts)
+        logger.debug("Encoded %d texts from %d requests in one batch.", len(texts), len(batch))
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_name, device=self.device)
+
+    def _run(self) -> None:
+        model, load_error = None, None
+        try:
+            model = self._load_model()
+            loaded_dimensions = model.get_sentence_embedding_dimension()
+            if loaded_dimensions != self.dimensions:
+                raise ValueError(f"{self.model_name} has {loaded_dimensions} dimensions, not the {self.dimensions} of LOCAL_EMBEDDING_DIMENSIONS.")
+            logger.info("Loaded local embedding model %s on %s.", self.model_name, self.device)
+        except Exception as e:
+            logger.error("Could not load local embedding model %s: %s", self.model_name, e, exc_info=True)
+            load_error = e
+
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect_batch(first)
+            # Skip requests whose callers already gave up
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+
+            if load_error is not None:
+                for item in batch:
+                    item.future.set_exception(load_error)
+            elif batch:
+                self._encode_batch(model, batch)
+
+            if stop:
+                return
+
+    def _submit(self, texts: List[str]) -> concurrent.futures.Future:
+        self._ensure_worker()
+        request = _EmbeddingRequest(list(texts))
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            raise EmbeddingQueueFull(f"Local embedding queue is full ({self._queue.maxsize} requests waiting).")
+        return request.future
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return await asyncio.wrap_future(self._submit(texts))
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+_provider: Optional[EmbeddingProvider] = None
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Returns the configured embedding provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        if settings.EMBEDDING_PROVIDER == "local":
+            provider = LocalEmbeddingProvider(
+                settings.LOCAL_EMBEDDING_MODEL,
+                settings.LOCAL_EMBEDDING_DIMENSIONS,
+                max_batch_size=settings.EMBEDDING_BATCH_SIZE,
+                max_wait_ms=settings.EMBEDDING_BATCH_WAIT_MS,
+                max_queue_size=settings.EMBEDDING_QUEUE_SIZE,
+            )
+        elif settings.EMBEDDING_PROVIDER == "litellm":
+            provider = LiteLLMEmbeddingProvider(settings.EMBEDDING_MODEL, settings.EMBEDDING_DIMENSIONS)
+        else:
+            raise ValueError(f"Unknown EMBEDDING_PROVIDER: {settings.EMBEDDING_PROVIDER}")
+        # Vectors of another size would only be refused by the database, chunk by chunk
+        if provider.dimensions != settings.RAG_EMBEDDING_DIMENSIONS:
+            raise ValueError(
+                f"{provider.model_id} produces {provider.dimensions} dimensions but the knowledge base stores "
+                f"{settings.RAG_EMBEDDING_DIMENSIONS} (RAG_EMBEDDING_DIMENSIONS); migrate it to the new size first."
+            )
+        _provider = provider
+    return _provider
+
+
+# collection -> embedding model of its stored chunks. Collections only change
+# model when they are emptied and re-ingested, so entries are kept until a delete.
+_collection_models: Dict[str, str] = {}
+
+
+def get_collection_models(collections: List[str]) -> Dict[str, str]:
+    """Returns the embedding model of each non-empty collection in ``collections``."""
+    for collection in collections:
+        if collection in _collection_models:
+            continue
+        response = get_supabase_rag().table('documents').select('metadata').eq('collection', collection).limit(1).execute()
+        if response.data:
+            metadata = response.data[0].get('metadata') or {}
+            _collection_models[collection] = metadata.get('embedding_model', LEGACY_EMBEDDING_MODEL)
+    return {c: _collection_models[c] for c in collections if c in _collection_models}
+
+
+def ensure_collection_models(collections: List[str], model_id: str) -> None:
+    """Raises EmbeddingModelMismatch if any collection holds vectors from another model."""
+    mismatched = {c: m for c, m in get_collection_models(collections).items() if m != model_id}
+    if mismatched:
+        raise EmbeddingModelMismatch(mismatched, model_id)
+
+
+def record_collection_models(collections: Iterable[str], model_id: str) -> None:
+    for collection in collections:
+        _collection_models[collection] = model_id
+
+
+def forget_collection_models() -> None:
+    """Drops cached collection models, e.g. after documents were deleted."""
+    _collection_models.clear()
@@ -0,0 +1,290 @@
+"""Final proposal generation as a resumable, checkpointed run.
+
+The final proposal agent works in turns: each model reply either asks for
+``query_collections`` tool calls or gives the finished HTML. A
+``FinalGenerationRun`` stores the conversation and is saved after every model
+turn and every tool result. When a turn fails (a timeout, a 429 that outlived
+the retries, running out of turns), the run is marked failed and can be
+resumed: the stored messages are replayed to the model, tool calls that already
+have a result are not repeated, and only the remaining turns are paid for.
+An answer that leaves out a section it was asked for is sent back to the agent
+once; if the next answer leaves it out too the run fails, with the raw answer
+kept in ``section_outputs``.
+Tool calls are answered from prefetched context where possible (see
+``backend.prefetch``).
+
+Runs that are not resumed are deleted after ``FINAL_RUN_RETENTION_HOURS``.
+"""
+import asyncio
+import datetime
+import json
+import logging
+import re
+from typing import Any, Dict, Iterable, List, Optional, Set
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import flag_modified
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .agent.main_agent import FINAL_PROPOSAL_INSTRUCTION
+from .agent.tools.rag_tool import aquery_collections
+from .assembly import AssemblyPlan, IncompleteAssembly, store_and_assemble
+from .config import settings
+from .llm import estimate_prompt_tokens, get_llm_governor
+from .models import FinalGenerationRun, Proposal, ProposalSection
+from .prefetch import load_warm_context
+from .response_cache import invalidate_proposal
+from .search import index_final
+from .routing import TASK_FINAL_PROPOSAL, choose_route, track_route
+
+logger = logging.getLogger(__name__)
+
+RUN_RUNNING = "running"
+RUN_FAILED = "failed"
+RUN_COMPLETED = "completed"
+
+RAG_TOOL_SCHEMA = {
+    "type": "function",
+    "function": {
+        "name": "query_collections",
+        "description": "Queries one or more collections in the RAG database...",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string"},
+                "collections": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["query", "collections"]
+        }
+    }
+}
+
+
+class RunNotResumable(Exception):
+    """Raised when a run is finished or still being worked on."""
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.utcnow()
+
+
+# Runs this process is advancing; a stale "running" checkpoint not in here is from a worker that died
+_active_runs: Set[int] = set()
+
+
+def final_proposal_prompt(proposal: Proposal, selected_versions: Dict[int, str], section_ids: Optional[Iterable[int]] = None) -> str:
+    """The agent's input; limited to ``section_ids`` when only some sections are regenerated."""
+    if section_ids is not None:
+        wanted = set(section_ids)
+        selected_versions = {section_id: content for section_id, content in selected_versions.items() if section_id in wanted}
+    mappings = [{
+        "section_name": section.section_name,
+        "collection_mappings": section.collection_mappings,
+        "custom_prompt": section.custom_prompt,
+    } for section in proposal.proposal_sections if section_ids is None or section.id in wanted]
+
+    return f"""
+        Proposal Name: {proposal.name}
+        Initial Draft (from user selected versions):
+        {json.dumps(selected_versions, indent=2)}
+
+        Mappings:
+        {json.dumps(mappings, indent=2)}
+        """
+
+
+def _assistant_message(message: Any) -> Dict[str, Any]:
+    """A model reply as a plain dict that can be stored as JSON and sent back to the model."""
+    stored: Dict[str, Any] = {"role": "assistant", "content": message.content}
+    if message.tool_calls:
+        stored["tool_calls"] = [
+            {"id": call.id, "type": "function", "function": {"name": call.function.name, "arguments": call.function.arguments}}
+            for call in message.tool_calls
+        ]
+    return stored
+
+
+def _pending_tool_calls(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Tool calls of the last assistant message that have no result yet."""
+    for index in range(len(messages) - 1, -1, -1):
+        if messages[index]["role"] == "assistant":
+            answered = {m.get("tool_call_id") for m in messages[index + 1:] if m["role"] == "tool"}
+            return [call for call in messages[index].get("tool_calls") or [] if call["id"] not in answered]
+    return []
+
+
+def final_html(response_text: str) -> str:
+    """Extracts the HTML body of the agent's answer, without inline styles."""
+    match = re.search(r"```html\s*(.*?)\s*```", response_text, re.DOTALL)
+    html = match.group(1).strip() if match else response_text
+
+    body_match = re.search(r"<body.*?>(.*?)</body>", html, re.DOTALL)
+    if body_match:
+        html = body_match.group(1).strip()
+
+    return re.sub(r'\s*style="[^"]*"', '', html)
+
+
+def split_sections(html: str) -> Dict[str, str]:
+    """Maps each ``<h2>`` title to the HTML up to the next one; content before the first is under ``""``."""
+    parts = re.split(r"<h2[^>]*>(.*?)</h2>", html, flags=re.DOTALL)
+    sections = {"": parts[0].strip()} if parts[0].strip() else {}
+    sections.update({re.sub(r"<[^>]+>", "", title).strip(): body.strip() for title, body in zip(parts[1::2], parts[2::2])})
+    return sections
+
+
+def missing_sections_prompt(missing: List[str]) -> str:
+    names = ", ".join(json.dumps(name) for name in missing)
+    return (f"Your answer has no content for the sections {names}. Reply with the complete HTML again, "
+            "with every section under an <h2> heading that is exactly its section name.")
+
+
+async def _checkpoint(session: AsyncSession, run: FinalGenerationRun) -> None:
+    flag_modified(run, "messages")
+    run.updated_at = _utcnow()
+    session.add(run)
+    await session.commit()
+
+
+async def collect_abandoned_runs(session: AsyncSession) -> int:
+    """Deletes runs that have not been touched within the retention period."""
+    cutoff = _utcnow() - datetime.timedelta(hours=settings.FINAL_RUN_RETENTION_HOURS)
+    result = await session.exec(delete(FinalGenerationRun).where(FinalGenerationRun.updated_at < cutoff))
+    await session.commit()
+    if result.rowcount:
+        logger.info("[PROPOSAL_GEN] Deleted %d abandoned generation runs.", result.rowcount)
+    return result.rowcount
+
+
+async def start_run(session: AsyncSession, proposal: Proposal, selected_versions: Dict[int, str],
+                    plan: Optional[AssemblyPlan] = None) -> FinalGenerationRun:
+    """Creates a run for a fresh generation, replacing the proposal's unfinished ones.
+
+    With a ``plan`` only its stale sections are sent to the agent, and the
+    document is assembled from the stored sections when the run completes.
+    """
+    await collect_abandoned_runs(session)
+    await session.exec(
+        delete(FinalGenerationRun)
+        .where(FinalGenerationRun.proposal_id == proposal.id, FinalGenerationRun.status == RUN_FAILED)
+    )
+    run = FinalGenerationRun(
+        proposal_id=proposal.id,
+        messages=[
+            {"role": "system", "content": FINAL_PROPOSAL_INSTRUCTION},
+            {"role": "user", "content": final_proposal_prompt(proposal, selected_versions, plan.stale.values() if plan else None)},
+        ],
+        fingerprints=plan.fingerprints if plan else {},
+    )
+    session.add(run)
+    await session.commit()
+    await session.refresh(run)
+    return run
+
+
+def check_resumable(run: FinalGenerationRun) -> None:
+    if run.status == RUN_COMPLETED:
+        raise RunNotResumable("The run has already completed.")
+    if run.status == RUN_RUNNING:
+        stale = _utcnow() - run.updated_at > datetime.timedelta(seconds=settings.FINAL_RUN_STALE_SECONDS)
+        if run.id in _active_runs or not stale:
+            raise RunNotResumable("The run is still in progress.")
+
+
+async def advance_run(session: AsyncSession, run: FinalGenerationRun) -> str:
+    """Continues a run from its last checkpoint and returns the final HTML.
+
+    The proposal's ``final_rfp_json`` is updated in the same commit that marks
+    the run completed. On failure or cancellation the run is saved as failed
+    and the error re-raised.
+    """
+    if run.id in _active_runs:
+        raise RunNotResumable("The run is still in progress.")
+    _active_runs.add(run.id)
+    run_id = run.id
+    try:
+        run.status = RUN_RUNNING
+        run.error = None
+        await _checkpoint(session, run)
+        route = choose_route(TASK_FINAL_PROPOSAL, estimate_prompt_tokens(run.messages))
+        with track_route(route):
+            return await _advance(session, run, route.model)
+    except (Exception, asyncio.CancelledError) as e:
+        # Cancelled runs (the client went away) are resumable straight away too
+        await session.rollback()
+        run = await session.get(FinalGenerationRun, run_id)
+        run.status = RUN_FAILED
+        run.error = str(e)[:500] or type(e).__name__
+        await _checkpoint(session, run)
+        raise
+    finally:
+        _active_runs.discard(run_id)
+
+
+async def _complete(session: AsyncSession, run: FinalGenerationRun, html: str, model: str) -> str:
+    """Stores the result and marks the run completed in one commit; raises IncompleteAssembly without storing."""
+    run_id = run.id
+    outputs = split_sections(html)
+    for attempt in range(2):
+        proposal = await session.get(Proposal, run.proposal_id)
+        if run.fingerprints:
+            proposal.final_rfp_json = await store_and_assemble(session, run.proposal_id, outputs, run.fingerprints, model)
+        else:
+            proposal.final_rfp_json = html
+        session.add(proposal)
+        run.status = RUN_COMPLETED
+        run.section_outputs = outputs
+        try:
+            # Its lookup flushes the stored sections, so it can raise the same conflict
+            await index_final(session, run.proposal_id, proposal.final_rfp_json)
+            await _checkpoint(session, run)
+            invalidate_proposal(run.proposal_id)
+            return proposal.final_rfp_json
+        except IntegrityError:
+            # A concurrent run of the same proposal stored a section first; update it instead
+            await session.rollback()
+            if attempt:
+                raise
+            run = await session.get(FinalGenerationRun, run_id)
+
+
+async def _advance(session: AsyncSession, run: FinalGenerationRun, model: str) -> str:
+    governor = get_llm_governor()
+    messages = run.messages
+    # Tool calls close to a prefetched query are answered without retrieving
+    result = await session.exec(select(ProposalSection.id).where(ProposalSection.proposal_id == run.proposal_id))
+    warm = await load_warm_context(session, result.all())
+    for _ in range(settings.FINAL_GENERATION_MAX_TURNS):
+        for tool_call in _pending_tool_calls(messages):
+            tool_args = json.loads(tool_call["function"]["arguments"])
+            tool_result = warm.lookup(**tool_args) or await aquery_collections(**tool_args)
+            messages.append({"role": "tool", "content": tool_result, "tool_call_id": tool_call["id"]})
+            await _checkpoint(session, run)
+
+        response = await governor.acompletion(model=model, messages=messages, tools=[RAG_TOOL_SCHEMA])
+        response_message = response.choices[0].message
+        messages.append(_assistant_message(response_message))
+        run.turns += 1
+        await _checkpoint(session, run)
+
+        if response_message.tool_calls:
+            continue
+
+        if not response_message.content:
+            raise Exception("Agent returned an empty final response.")
+        html = final_html(response_message.content)
+
+        try:
+            final = await _complete(session, run, html, model)
+        except IncompleteAssembly as e:
+            # The raw answer is kept on the run; the agent is asked once for the sections it left out
+            run.section_outputs = split_sections(html)
+            if messages[-2]["role"] == "user" and messages[-2]["content"] == missing_sections_prompt(e.missing):
+                await _checkpoint(session, run)
+                raise
+            logger.warning("[PROPOSAL_GEN] Run %s left out %s; asking again.", run.id, e.missing, extra={"proposal_id": run.proposal_id})
+            messages.append({"role": "user", "content": missing_sections_prompt(e.missing)})
+            await _checkpoint(session, run)
+            continue
+        logger.info("[PROPOSAL_GEN] Run %s completed after %d turns.", run.id, run.turns, extra={"proposal_id": run.proposal_id})
+        return final
+    raise Exception("Agent exceeded maximum turns.")
@@ -0,0 +1,142 @@
+"""Turns an uploaded document into categorised knowledge base chunks.
+
+``INGESTION_CHUNKER`` selects how documents are split:
+
+* ``local`` (default) splits by headings, paragraphs and overlapping token
+  windows with :mod:`backend.chunking`. The LLM is only asked to pick a
+  collection from ``CATEGORIES`` for each chunk, in parallel batches of
+  ``CATEGORIZE_BATCH_SIZE``; a batch that fails falls back to "General"
+  instead of failing the upload. Set ``INGESTION_CATEGORIZE=false`` to skip
+  the LLM entirely.
+* ``agent`` sends the whole document to the ingestion agent, which chunks and
+  categorises it in one response. Limited by the model's context window.
+"""
+import asyncio
+import json
+import logging
+import re
+from typing import Any, Dict, List
+from .agent.ingestion_agent import CATEGORIES, CATEGORIZATION_INSTRUCTION, get_ingestion_agent
+from .chunking import Chunk, chunk_blocks
+from .config import settings
+from .documents import read_document, read_document_blocks
+from .llm import Priority, get_llm_governor, llm_priority
+from .logging_config import log_payload
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATEGORY = "General"
+# Characters of each chunk shown to the categorisation model
+CATEGORIZE_PREVIEW_CHARS = 600
+
+
+class ChunkingError(Exception):
+    """Raised when the ingestion agent's response cannot be used."""
+
+
+class EmptyDocument(ValueError):
+    """Raised when no text could be extracted from a document."""
+
+
+def parse_json_response(response_text: str) -> Any:
+    """Parses a model's JSON answer, with or without a fenced code block around it."""
+    match = re.search(r"```(?:json)?\s*(.*?)\s*```", response_text, re.DOTALL)
+    return json.loads(match.group(1) if match else response_text.strip())
+
+
+async def agent_chunks(source: str, document_ref: str) -> List[Dict[str, Any]]:
+    """Chunks and categorises a whole document with the ingestion agent."""
+    from google.genai import types
+    from google.adk.models.llm_request import LlmRequest
+
+    document_content = await asyncio.to_thread(read_document, document_ref)
+    if not document_content.strip():
+        raise EmptyDocument("Document is empty or could not be read.")
+    logger.info("Invoking ingestion agent for %d characters.", len(document_content), extra={"source": source})
+
+    ingestion_agent = get_ingestion_agent()
+    llm_request = LlmRequest(
+        contents=[types.Content(role="user", parts=[types.Part(text=f"Source: {source}\n\n{document_content}")])],
+        config=types.GenerateContentConfig(system_instruction=ingestion_agent.instruction),
+    )
+    response_text = ""
+    with llm_priority(Priority.BULK):
+        async for response_part in ingestion_agent.model.generate_content_async(llm_request):
+            if response_part.content and response_part.content.parts:
+                response_text += response_part.content.parts[0].text
+
+    logger.info("Received %d characters from ingestion agent.", len(response_text), extra={"source": source})
+    log_payload(logger, logging.DEBUG, "Raw response from agent: %s", response_text, source=source)
+    try:
+        chunks = parse_json_response(response_text)
+    except json.JSONDecodeError as e:
+        log_payload(logger, logging.ERROR, "Unparseable agent response: %s", response_text, source=source)
+        raise ChunkingError(f"Failed to parse JSON response from chunking agent: {e}")
+    if not isinstance(chunks, list):
+        raise ChunkingError("Chunking agent did not return a JSON array.")
+    return chunks
+
+
+async def _categorize_batch(source: str, batch: List[Chunk]) -> List[str]:
+    passages = "\n\n".join(f"[{i}] {chunk.content[:CATEGORIZE_PREVIEW_CHARS]}" for i, chunk in enumerate(batch, start=1))
+    messages = [
+        {"role": "system", "content": CATEGORIZATION_INSTRUCTION},
+        {"role": "user", "content": f"Categorize: {source}\n\n{passages}"},
+    ]
+    try:
+        response = await get_llm_governor().acompletion(model=settings.CATEGORIZATION_MODEL, messages=messages, priority=Priority.BULK)
+        assigned = parse_json_response(response.choices[0].message.content or "")
+        if not isinstance(assigned, dict):
+            raise ValueError("expected a JSON object")
+    except Exception as e:
+        logger.warning("Could not categorize %d chunks of %s, filing them under %s: %s", len(batch), source, DEFAULT_CATEGORY, e)
+        return [DEFAULT_CATEGORY] * len(batch)
+    categories = []
+    for i in range(1, len(batch) + 1):
+        category = assigned.get(str(i))
+        categories.append(category if category in CATEGORIES else DEFAULT_CATEGORY)
+    return categories
+
+
+async def categorize_chunks(source: str, chunks: List[Chunk]) -> List[str]:
+    """Picks a collection for every chunk, sending the batches concurrently."""
+    if not settings.INGESTION_CATEGORIZE:
+        return [DEFAULT_CATEGORY] * len(chunks)
+    size = max(1, settings.CATEGORIZE_BATCH_SIZE)
+    batches = [chunks[start:start + size] for start in range(0, len(chunks), size)]
+    results = await asyncio.gather(*(_categorize_batch(source, batch) for batch in batches))
+    return [category for batch in results for category in batch]
+
+
+async def local_chunks(source: str, document_ref: str) -> List[Dict[str, Any]]:
+    """Chunks a document by its structure and categorises the chunks."""
+    blocks = await asyncio.to_thread(read_document_blocks, document_ref)
+    chunks = chunk_blocks(blocks, max_tokens=settings.CHUNK_MAX_TOKENS, overlap_tokens=settings.CHUNK_OVERLAP_TOKENS)
+    if not chunks:
+        raise EmptyDocument("Document is empty or could not be read.")
+    logger.info("Split %s into %d chunks from %d blocks.", source, len(chunks), len(blocks))
+
+    categories = await categorize_chunks(source, chunks)
+    return [
+        {
+            "collection": category,
+            "content": chunk.content,
+            "metadata": {
+                "source": source,
+                "chunk_index": chunk.index,
+                "heading": chunk.heading,
+                "page_start": chunk.page_start,
+                "page_end": chunk.page_end,
+            },
+        }
+        for chunk, category in zip(chunks, categories)
+    ]
+
+
+async def build_chunks(source: str, document_ref: str) -> List[Dict[str, Any]]:
+    """Chunks with the configured ``INGESTION_CHUNKER``; each chunk has collection, content and metadata."""
+    if settings.INGESTION_CHUNKER == "agent":
+        return await agent_chunks(source, document_ref)
+    if settings.INGESTION_CHUNKER == "local":
+        return await local_chunks(source, document_ref)
+    raise ValueError(f"Unknown INGESTION_CHUNKER: {settings.INGESTION_CHUNKER}")
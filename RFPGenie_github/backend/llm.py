@@ -0,0 +1,385 @@
+"""Shared scheduler for all model calls (completions and embeddings).
+
+Every call goes through ``get_llm_governor()``, which keeps one limiter per model:
+
+* at most ``concurrency`` calls in flight,
+* a requests-per-minute and a tokens-per-minute token bucket; tokens are
+  estimated from the prompt size plus the expected completion and corrected
+  with the reported usage once the call returns,
+* waiters are served by priority class, then in arrival order, so interactive
+  requests overtake bulk work queued for the same model,
+* rate-limit and transient provider errors are retried with jittered
+  exponential backoff, honouring ``Retry-After``; a 429 pauses the model's
+  limiter so the other waiters back off too.
+
+The priority of a call defaults to the one set with :func:`llm_priority` for
+the current task, so calls made deep inside tools inherit the request's class.
+"""
+import asyncio
+import contextlib
+import contextvars
+import enum
+import heapq
+import itertools
+import logging
+import random
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    INTERACTIVE = 0  # a user is waiting on this one call (section regeneration)
+    STANDARD = 1
+    BULK = 2  # ingestion and background work
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("llm_priority", default=Priority.STANDARD)
+_usage: contextvars.ContextVar[Optional["Usage"]] = contextvars.ContextVar("llm_usage", default=None)
+
+
+@contextlib.contextmanager
+def llm_priority(priority: Priority):
+    """Runs the enclosed model calls with the given priority class."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+@dataclass
+class Usage:
+    """Totals of the completions made while :func:`track_usage` is active."""
+
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    finish_reason: Optional[str] = None  # of the last completion
+
+
+@contextlib.contextmanager
+def track_usage():
+    """Collects tokens and cost of the enclosed completions, including those made by tasks started inside."""
+    usage = Usage()
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+def _completion_cost(response: Any) -> float:
+    import litellm
+
+    try:
+        return float(litellm.completion_cost(completion_response=response))
+    except Exception:
+        # Models missing from litellm's price list
+        return 0.0
+
+
+def _record_usage(response: Any) -> None:
+    usage = _usage.get()
+    if usage is None:
+        return
+    reported = getattr(response, "usage", None)
+    usage.calls += 1
+    usage.prompt_tokens += getattr(reported, "prompt_tokens", 0) or 0
+    usage.completion_tokens += getattr(reported, "completion_tokens", 0) or 0
+    usage.cost += _completion_cost(response)
+    choices = getattr(response, "choices", None) or []
+    if choices:
+        usage.finish_reason = getattr(choices[0], "finish_reason", None)
+
+
+@dataclass(frozen=True)
+class ModelLimits:
+    concurrency: int = 8
+    rpm: int = 0  # 0 disables the limit
+    tpm: int = 0
+
+
+class TokenBucket:
+    """Refills continuously up to ``per_minute`` units per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until ``amount`` can be taken; requests larger than the bucket wait for a full one."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        # May go negative when usage turns out higher than estimated
+        self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ("priority", "tokens", "future", "enqueued")
+
+    def __init__(self, priority: Priority, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class ModelLimiter:
+    """Admission control for one model; see the module docstring."""
+
+    def __init__(self, model: str, limits: ModelLimits):
+        self.model = model
+        self.limits = limits
+        self._requests = TokenBucket(limits.rpm) if limits.rpm > 0 else None
+        self._tokens = TokenBucket(limits.tpm) if limits.tpm > 0 else None
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stats = {"admitted": 0, "completed": 0, "failed": 0, "retries": 0, "rate_limited": 0, "queue_wait_seconds": 0.0, "max_queue_depth": 0}
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Futures and timers belong to one loop; start over on a new one (tests, CLI runs)
+            self._loop, self._heap, self._in_flight, self._timer = loop, [], 0, None
+        return loop
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        loop = self._bind()
+        waiter = _Waiter(priority, tokens, loop.create_future())
+        heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._heap))
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just before the caller was cancelled
+                self.release()
+            raise
+        self.stats["queue_wait_seconds"] += time.monotonic() - waiter.enqueued
+
+    def release(self) -> None:
+        self._in_flight -= 1
+        self._dispatch()
+
+    def record_usage(self, estimated: int, actual: Optional[int]) -> None:
+        if self._tokens is not None and actual is not None:
+            self._tokens.consume(actual - estimated)
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _wait_time(self, waiter: _Waiter, now: float) -> float:
+        wait = self._paused_until - now
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(waiter.tokens, now))
+        return wait
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._heap and self._in_flight < self.limits.concurrency:
+            waiter = self._heap[0][2]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self._wait_time(waiter, now)
+            if wait > 0:
+                self._schedule(wait)
+                return
+            heapq.heappop(self._heap)
+            if self._requests is not None:
+                self._requests.consume(1)
+            if self._tokens is not None:
+                self._tokens.consume(waiter.tokens)
+            self._in_flight += 1
+            self.stats["admitted"] += 1
+            waiter.future.set_result(None)
+
+    def _schedule(self, delay: float) -> None:
+        if self._timer is None:
+            self._timer = self._loop.call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._dispatch()
+
+    def metrics(self) -> Dict[str, Any]:
+        queued = {p.name.lower(): 0 for p in Priority}
+        for priority, _, waiter in self._heap:
+            if not waiter.future.done():
+                queued[Priority(priority).name.lower()] += 1
+        return {
+            "in_flight": self._in_flight,
+            "concurrency": self.limits.concurrency,
+            "queued": queued,
+            "queue_depth": sum(queued.values()),
+            "rpm_available": round(self._requests.tokens, 1) if self._requests else None,
+            "tpm_available": round(self._tokens.tokens, 1) if self._tokens else None,
+            **self.stats,
+        }
+
+
+def _text_length(content: Any) -> int:
+    if content is None:
+        return 0
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(_text_length(part.get("text") if isinstance(part, dict) else getattr(part, "text", None)) for part in content)
+    return len(str(content))
+
+
+def estimate_prompt_tokens(messages: List[Any]) -> int:
+    """About four characters per token, which is close enough for admission control."""
+    chars = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        chars += _text_length(content)
+    return chars // 4 + 4 * len(messages)
+
+
+def _total_tokens(response: Any) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    total = getattr(usage, "total_tokens", None) if usage is not None else None
+    return total if isinstance(total, int) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGovernor:
+    """Routes litellm calls through per-model limiters with retries."""
+
+    def __init__(self, default_limits: ModelLimits, model_limits: Optional[Dict[str, ModelLimits]] = None,
+                 expected_completion_tokens: int = 1000, max_retries: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.default_limits = default_limits
+        self.model_limits = model_limits or {}
+        self.expected_completion_tokens = expected_completion_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._limiters: Dict[str, ModelLimiter] = {}
+
+    def limiter(self, model: str) -> ModelLimiter:
+        if model not in self._limiters:
+            self._limiters[model] = ModelLimiter(model, self.model_limits.get(model, self.default_limits))
+        return self._limiters[model]
+
+    async def acompletion(self, model: str, messages: List[Any], priority: Optional[Priority] = None, **kwargs) -> Any:
+        import litellm
+
+        estimate = estimate_prompt_tokens(messages) + (kwargs.get("max_tokens") or self.expected_completion_tokens)
+        response = await self._call(model, estimate, priority, lambda: litellm.acompletion(model=model, messages=messages, **kwargs))
+        _record_usage(response)
+        return response
+
+    async def aembedding(self, model: str, input: List[str], priority: Optional[Priority] = None, **kwargs) -> Any:
+        import litellm
+
+        estimate = sum(len(text) for text in input) // 4 + 1
+        return await self._call(model, estimate, priority, lambda: litellm.aembedding(model=model, input=input, **kwargs))
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = _retry_after(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    async def _call(self, model: str, estimate: int, priority: Optional[Priority], make_call) -> Any:
+        import litellm
+
+        retryable = (litellm.RateLimitError, litellm.Timeout, litellm.APIConnectionError, litellm.ServiceUnavailableError, litellm.InternalServerError)
+        priority = _priority.get() if priority is None else priority
+        limiter = self.limiter(model)
+
+        for attempt in itertools.count():
+            await limiter.acquire(estimate, priority)
+            try:
+                response = await make_call()
+            except retryable as e:
+                rate_limited = isinstance(e, litellm.RateLimitError)
+                limiter.stats["rate_limited" if rate_limited else "failed"] += 1
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt, e)
+                if rate_limited:
+                    limiter.pause(delay)
+                limiter.stats["retries"] += 1
+                logger.warning("[LLM] %s on %s, retrying in %.2fs (attempt %d/%d).", type(e).__name__, model, delay, attempt + 1, self.max_retries)
+            except Exception:
+                limiter.stats["failed"] += 1
+                raise
+            else:
+                limiter.stats["completed"] += 1
+                limiter.record_usage(estimate, _total_tokens(response))
+                return response
+            finally:
+                limiter.release()
+            await asyncio.sleep(delay)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {model: limiter.metrics() for model, limiter in self._limiters.items()}
+
+
+_governor: Optional[LLMGovernor] = None
+
+
+def get_llm_governor() -> LLMGovernor:
+    """Returns the process-wide governor, creating it from the settings on first use."""
+    global _governor
+    if _governor is None:
+        default = ModelLimits(settings.LLM_MAX_CONCURRENCY, settings.LLM_REQUESTS_PER_MINUTE, settings.LLM_TOKENS_PER_MINUTE)
+        overrides = {
+            model: ModelLimits(
+                int(limits.get("concurrency", default.concurrency)),
+                int(limits.get("rpm", default.rpm)),
+                int(limits.get("tpm", default.tpm)),
+            )
+            for model, limits in settings.LLM_MODEL_LIMITS.items()
+        }
+        _governor = LLMGovernor(
+            default,
+            overrides,
+            expected_completion_tokens=settings.LLM_EXPECTED_COMPLETION_TOKENS,
+            max_retries=settings.LLM_MAX_RETRIES,
+            base_delay=settings.LLM_RETRY_BASE_DELAY,
+            max_delay=settings.LLM_RETRY_MAX_DELAY,
+        )
+    return _governor
+
+
+@lru_cache(maxsize=None)
+def get_adk_llm_client():
+    """An ADK ``LiteLLMClient`` whose completions go through the governor."""
+    from google.adk.models.lite_llm import LiteLLMClient
+
+    class GovernedLiteLLMClient(LiteLLMClient):
+        async def acompletion(self, model, messages, tools, **kwargs):
+            return await get_llm_governor().acompletion(model=model, messages=messages, tools=tools, **kwargs)
+
+    return GovernedLiteLLMClient()
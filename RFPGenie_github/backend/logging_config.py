@@ -0,0 +1,194 @@
+"""Queue-based, structured logging for the backend.
+
+Records are handed to a bounded in-memory queue by the request path and written
+to disk by a background listener thread, so a slow disk never stalls the event
+loop. Messages are formatted when they are logged, so they show the values
+their arguments had at that moment. Large payloads are wrapped in
+:class:`Payload`, which is sampled, truncated and only rendered by the listener;
+don't change a payload's value after logging it.
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import numbers
+import queue
+import random
+from typing import Any, Optional
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_payload_max_chars = 500
+_payload_sample_rate = 1.0
+
+
+class Payload:
+    """Lazily rendered, truncated log argument.
+
+    Use as a ``%s`` argument so nothing is serialised unless the record is
+    actually written::
+
+        logger.debug("Agent response: %s", Payload(response_text))
+    """
+
+    __slots__ = ("value", "max_chars")
+
+    def __init__(self, value: Any, max_chars: Optional[int] = None):
+        self.value = value
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        text = self.value if isinstance(self.value, str) else json.dumps(self.value, default=str)
+        limit = self.max_chars if self.max_chars is not None else _payload_max_chars
+        if limit and len(text) > limit:
+            return f"{text[:limit]}...(+{len(text) - limit} chars)"
+        return text
+
+
+def sample_payload() -> bool:
+    """Returns True for the configured fraction of large-payload log calls."""
+    return _payload_sample_rate >= 1.0 or random.random() < _payload_sample_rate
+
+
+def log_payload(logger: logging.Logger, level: int, msg: str, payload: Any, **fields: Any) -> None:
+    """Logs ``payload`` truncated, subject to level and, below WARNING, payload sampling."""
+    if logger.isEnabledFor(level) and (level >= logging.WARNING or sample_payload()):
+        logger.log(level, msg, Payload(payload), extra=fields)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Snapshot:
+    """An argument's text as it was when logged."""
+
+    __slots__ = ("text", "repr_text")
+
+    def __init__(self, value: Any):
+        self.text = str(value)
+        self.repr_text = repr(value)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return self.repr_text
+
+
+# Arguments that cannot change before the listener formats the record
+_IMMUTABLE_ARGS = (str, bytes, numbers.Number, type(None), Payload)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers rendering payloads to the listener and drops records when the queue is full."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the stock implementation, exceptions and Payload arguments are
+        # rendered by the listener; other arguments are captured now.
+        record = copy.copy(record)
+        if isinstance(record.args, tuple) and any(isinstance(arg, Payload) for arg in record.args):
+            record.args = tuple(arg if isinstance(arg, _IMMUTABLE_ARGS) else _Snapshot(arg) for arg in record.args)
+        elif record.args:
+            record.msg, record.args = record.getMessage(), None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener whose thread survives a handler filter that raises.
+
+    Formatting errors are already reported by the handler; an exception from a
+    filter would end the stock listener's thread, and every record queued
+    after it would be lost.
+    """
+
+    def handle(self, record: logging.LogRecord) -> None:
+        record = self.prepare(record)
+        for handler in self.handlers:
+            if self.respect_handler_level and record.levelno < handler.level:
+                continue
+            try:
+                handler.handle(record)
+            except Exception:
+                handler.handleError(record)
+
+
+def configure_logging(
+    filename: str = "app.log",
+    level: str = "INFO",
+    json_format: bool = True,
+    queue_size: int = 10000,
+    payload_max_chars: int = 500,
+    payload_sample_rate: float = 1.0,
+) -> None:
+    """Routes all logging through a background queue listener writing to ``filename``.
+
+    Safe to call more than once; the previous listener is stopped and replaced.
+    """
+    global _listener, _payload_max_chars, _payload_sample_rate
+    _payload_max_chars = payload_max_chars
+    _payload_sample_rate = payload_sample_rate
+
+    shutdown_logging()
+
+    file_handler = logging.FileHandler(filename)
+    if json_format:
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    root = logging.getLogger()
+    root.addHandler(NonBlockingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = _QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Flushes queued records and stops the listener thread.
+
+    Called when the app shuts down, so the thread is not still handling
+    records while the interpreter tears down the modules they came from.
+    Records logged afterwards go to logging's last-resort handler.
+    """
+    global _listener
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, NonBlockingQueueHandler):
+            root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
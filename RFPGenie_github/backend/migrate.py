@@ -0,0 +1,82 @@
+"""Explicit schema creation and seeding for the application database.
+
+Run once per deployment, before starting the server::
+
+    python -m backend.migrate
+
+Set ``AUTO_MIGRATE=true`` to run it on startup instead (convenient for local
+development, slow for autoscaled containers).
+"""
+import asyncio
+import logging
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+from .database import get_engine, get_session
+from .search import backfill_search_index, postgres_statements
+from . import models
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SECTIONS = [
+    ("Executive Summary", "A brief overview of the entire proposal."),
+    ("Project objectives and background Information", "The goals and context of the project."),
+    ("Functional and Technical Solution", "The proposed solution's functional and technical aspects."),
+    ("Project Deliverables, Timelines and Outcome", "What will be delivered, when, and what the expected outcomes are."),
+    ("Commercials and value proposition", "The pricing and the value offered."),
+    ("Company Profile", "Information about the company."),
+    ("Client Reference and Case Studies", "References and examples of past work."),
+    ("Why Us", "Reasons to choose us."),
+    ("Appendices", "Additional supporting documents."),
+]
+
+async def create_schema():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(models.SQLModel.metadata.create_all)
+
+async def create_indexes():
+    """Adds indexes introduced after a table was first created; create_all skips existing tables."""
+    for table in models.SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                async with get_engine().begin() as conn:
+                    await conn.run_sync(index.create, checkfirst=True)
+            except IntegrityError as e:
+                logger.error("Could not create index %s, existing rows violate it; resolve them and re-run: %s", index.name, e.orig)
+
+async def create_search_index():
+    """Full-text search column and GIN index; other databases are searched without them."""
+    engine = get_engine()
+    if engine.dialect.name != "postgresql":
+        return
+    async with engine.begin() as conn:
+        for statement in postgres_statements():
+            await conn.exec_driver_sql(statement)
+
+async def index_existing_proposals():
+    async for session in get_session():
+        indexed = await backfill_search_index(session)
+        if indexed:
+            logger.info("Indexed %d existing proposals for search.", indexed)
+
+async def seed_sections():
+    async for session in get_session():
+        result = await session.exec(select(models.Section))
+        if not result.first():
+            session.add_all([
+                models.Section(section_name=name, description=description, category="General")
+                for name, description in DEFAULT_SECTIONS
+            ])
+            await session.commit()
+
+async def migrate():
+    logger.info("Creating database schema.")
+    await create_schema()
+    await create_indexes()
+    await create_search_index()
+    logger.info("Seeding default sections.")
+    await seed_sections()
+    await index_existing_proposals()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
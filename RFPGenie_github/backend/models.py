@@ -1,6 +1,7 @@
-from typing import Optional, List
+from typing import Optional, List, Dict
 from sqlmodel import Field, SQLModel, JSON, Column, Relationship
 from pydantic import computed_field
+from sqlalchemy import Index
 import datetime
 
 # Database Models
@@ -28,6 +29,10 @@ class SectionVersion(SQLModel, table=True):
     proposal_section: "ProposalSection" = Relationship(back_populates="versions")
 
 class ProposalSection(SQLModel, table=True):
+    # A proposal has at most one section per name, so repeated or concurrent
+    # draft generation cannot create duplicates
+    __table_args__ = (Index("uq_proposalsection_proposal_section", "proposal_id", "section_name", unique=True),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     proposal_id: int = Field(foreign_key="proposal.id")
     section_name: str
@@ -52,6 +57,78 @@ class Proposal(SQLModel, table=True):
     def draft_rfp_json(self) -> bool:
         return any(section.versions for section in self.proposal_sections)
 
+class DraftBatch(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    jobs: List["DraftJob"] = Relationship(back_populates="batch", sa_relationship_kwargs={"cascade": "all, delete-orphan", "lazy": "selectin"})
+
+class DraftJob(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    batch_id: int = Field(foreign_key="draftbatch.id", index=True)
+    proposal_id: int = Field(foreign_key="proposal.id")
+    status: str = Field(default="queued")  # queued, running, completed, failed, skipped
+    error: Optional[str] = None
+    sections_written: int = 0
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+    # Touched while the job is in a live worker pool; see backend.drafts.recover_draft_jobs
+    heartbeat_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    batch: DraftBatch = Relationship(back_populates="jobs")
+
+class FinalGenerationRun(SQLModel, table=True):
+    """Checkpoint of a final proposal generation, saved after every model turn and tool call."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    proposal_id: int = Field(foreign_key="proposal.id", index=True)
+    status: str = Field(default="running")  # running, failed, completed
+    messages: List[Dict] = Field(sa_column=Column(JSON), default=[])
+    turns: int = 0
+    error: Optional[str] = None
+    section_outputs: Dict[str, str] = Field(sa_column=Column(JSON), default={})
+    # Input fingerprint of every section of the document, in document order
+    fingerprints: Dict[str, str] = Field(sa_column=Column(JSON), default={})
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow, index=True)
+
+class FinalSection(SQLModel, table=True):
+    """Final HTML of one proposal section and the fingerprint of the inputs it was generated from."""
+    __table_args__ = (Index("uq_finalsection_proposal_section", "proposal_id", "section_name", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    proposal_id: int = Field(foreign_key="proposal.id")
+    section_name: str
+    fingerprint: str
+    html: str
+    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+class CollectionRevision(SQLModel, table=True):
+    """Bumped whenever documents are added to or removed from a knowledge base collection."""
+    collection: str = Field(primary_key=True)
+    revision: int = 0
+    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+class PrefetchedContext(SQLModel, table=True):
+    """Knowledge base context retrieved ahead of time for one likely query of a proposal section."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    proposal_id: int = Field(foreign_key="proposal.id", index=True)
+    proposal_section_id: int = Field(foreign_key="proposalsection.id", index=True)
+    query: str
+    collections: List[str] = Field(sa_column=Column(JSON), default=[])
+    source_key: str  # collections, their revisions and the embedding model the context was retrieved with
+    context: str
+    created_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
+class SearchEntry(SQLModel, table=True):
+    """Searchable plain text of a proposal, one of its section versions or its final document (backend.search)."""
+    __table_args__ = (Index("uq_searchentry_kind_ref", "kind", "ref_id", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    proposal_id: int = Field(foreign_key="proposal.id", index=True)
+    kind: str  # proposal, version or final
+    ref_id: int  # the proposal id, or the section version id
+    title: str  # proposal or section name; ranks above the text
+    text: str
+    updated_at: datetime.datetime = Field(default_factory=datetime.datetime.utcnow)
+
 # New Approval Model
 class Approval(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -77,3 +154,46 @@ class ProposalSectionResponse(SQLModel):
     collection_mappings: List[str]
     custom_prompt: str
     versions: List[SectionVersionResponse] = []
+
+class DraftJobResponse(SQLModel):
+    id: int
+    proposal_id: int
+    status: str
+    error: Optional[str] = None
+    sections_written: int
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+class FinalGenerationRunResponse(SQLModel):
+    id: int
+    proposal_id: int
+    status: str
+    turns: int
+    error: Optional[str] = None
+    created_at: datetime.datetime
+    updated_at: datetime.datetime
+
+class SearchResultResponse(SQLModel):
+    proposal_id: int
+    proposal_name: str
+    client_name: str
+    kind: str
+    section_name: Optional[str] = None
+    section_version_id: Optional[int] = None
+    rank: float
+    highlight: str  # HTML-escaped excerpt with matches in <mark>
+    updated_at: datetime.datetime
+
+class SearchResponse(SQLModel):
+    query: str
+    total: int
+    limit: int
+    offset: int
+    results: List[SearchResultResponse] = []
+
+class DraftBatchResponse(SQLModel):
+    id: int
+    created_at: datetime.datetime
+    status: str  # running until every job has finished, then completed
+    counts: Dict[str, int]
+    jobs: List[DraftJobResponse] = []
@@ -0,0 +1,217 @@
+"""Knowledge base retrieval ahead of time for proposal sections.
+
+When a section's collection mappings or custom prompt change, or its content is
+edited, a background worker runs the section's likely queries against the
+mapped collections and stores the results as ``PrefetchedContext`` rows. The
+likely queries are the section name, the name with the opening words of the
+latest version, and the name with the custom prompt.
+
+Regeneration puts the prefetched context in the prompt instead of offering the
+retrieval tool, so the request skips the embedding, the RPC and a model round
+trip. Final generation answers the agent's ``query_collections`` calls from the
+prefetched rows when the query shares enough words with a prefetched one.
+
+Each row is stamped with a key over its collections, their revisions and the
+embedding model. Uploads and deletions bump the revisions (see
+``backend.assembly``), so rows retrieved from older sources are ignored until
+``refresh_collections`` has fetched them again.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .agent.tools.rag_tool import CONTEXT_SEPARATOR, ERROR_MESSAGE, NO_MATCHES_MESSAGE, aquery_collections
+from .assembly import collection_revisions
+from .config import settings
+from .database import get_session_factory
+from .embeddings import get_embedding_provider
+from .llm import Priority, llm_priority
+from .models import PrefetchedContext, ProposalSection
+
+logger = logging.getLogger(__name__)
+
+_stats = {"prefetched_queries": 0, "hits": 0, "misses": 0, "stale_rows": 0}
+
+
+def _words(text: str) -> Set[str]:
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def likely_queries(section_name: str, content: str, custom_prompt: str) -> List[str]:
+    queries = [section_name]
+    opening = re.sub(r"<[^>]+>", " ", content or "").split()[:settings.PREFETCH_QUERY_WORDS]
+    if opening:
+        queries.append(f"{section_name}: {' '.join(opening)}")
+    if custom_prompt and custom_prompt.strip():
+        queries.append(f"{section_name}: {custom_prompt.strip()}")
+    return queries
+
+
+def source_key(collections: Iterable[str], revisions: Dict[str, int], model_id: str) -> str:
+    names = sorted(set(collections))
+    payload = json.dumps({"collections": names, "revisions": [revisions.get(name, 0) for name in names], "model": model_id})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def prefetch_section(section_id: int) -> int:
+    """Replaces the section's prefetched context; returns the number of rows stored."""
+    async with get_session_factory()() as session:
+        section = await session.get(ProposalSection, section_id)
+        if section is None:
+            return 0
+        collections = sorted(set(section.collection_mappings or []))
+        latest = max(section.versions, key=lambda version: version.version_number, default=None)
+        queries = likely_queries(section.section_name, latest.content if latest else "", section.custom_prompt)
+        proposal_id = section.proposal_id
+        # Read before retrieving: a bump while the queries run leaves the rows stale, not wrongly current
+        key = source_key(collections, await collection_revisions(session, collections), get_embedding_provider().model_id) if collections else ""
+
+    contexts: List[str] = []
+    if collections:
+        with llm_priority(Priority.BULK):
+            contexts = await asyncio.gather(*(aquery_collections(query, collections) for query in queries))
+
+    rows = [
+        PrefetchedContext(proposal_id=proposal_id, proposal_section_id=section_id, query=query,
+                          collections=collections, source_key=key, context=context)
+        for query, context in zip(queries, contexts) if context != ERROR_MESSAGE
+    ]
+    async with get_session_factory()() as session:
+        await session.exec(delete(PrefetchedContext).where(PrefetchedContext.proposal_section_id == section_id))
+        session.add_all(rows)
+        await session.commit()
+    _stats["prefetched_queries"] += len(rows)
+    logger.info("[PREFETCH] Stored %d of %d queries for section %s.", len(rows), len(queries) if collections else 0, section_id)
+    return len(rows)
+
+
+@dataclass
+class WarmContext:
+    """The current prefetched rows of some sections."""
+
+    rows: List[PrefetchedContext]
+
+    def _matching(self, collections: Iterable[str]) -> List[PrefetchedContext]:
+        names = sorted(set(collections or []))
+        return [row for row in self.rows if sorted(row.collections) == names]
+
+    def context_for(self, collections: Iterable[str]) -> Optional[str]:
+        """All prefetched context for exactly these collections, or None when there is none."""
+        rows = self._matching(collections)
+        if not rows:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        chunks = dict.fromkeys(
+            chunk for row in rows if row.context != NO_MATCHES_MESSAGE for chunk in row.context.split(CONTEXT_SEPARATOR)
+        )
+        return CONTEXT_SEPARATOR.join(chunks) if chunks else NO_MATCHES_MESSAGE
+
+    def lookup(self, query: str, collections: Iterable[str]) -> Optional[str]:
+        """The prefetched result of the closest query, if close enough to stand in for ``query``."""
+        words = _words(query)
+        best, best_overlap = None, 0.0
+        for row in self._matching(collections):
+            row_words = _words(row.query)
+            overlap = len(words & row_words) / len(words | row_words) if words | row_words else 0.0
+            if overlap > best_overlap:
+                best, best_overlap = row, overlap
+        if best is None or best_overlap < settings.PREFETCH_MATCH_MIN_OVERLAP:
+            _stats["misses"] += 1
+            return None
+        _stats["hits"] += 1
+        return best.context
+
+
+async def load_warm_context(session: AsyncSession, section_ids: Iterable[int]) -> WarmContext:
+    """The prefetched rows of the sections that were retrieved from the current sources."""
+    ids = list(section_ids)
+    if not settings.PREFETCH_ENABLED or not ids:
+        return WarmContext([])
+    result = await session.exec(select(PrefetchedContext).where(PrefetchedContext.proposal_section_id.in_(ids)))
+    rows = result.all()
+    if not rows:
+        return WarmContext([])
+    revisions = await collection_revisions(session, (collection for row in rows for collection in row.collections))
+    model_id = get_embedding_provider().model_id
+    current = [row for row in rows if row.source_key == source_key(row.collections, revisions, model_id)]
+    _stats["stale_rows"] += len(rows) - len(current)
+    return WarmContext(current)
+
+
+class PrefetchWorkerPool:
+    """Worker tasks prefetching sections from one queue; a section is queued at most once."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[int] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._pending = set()
+            self._tasks = [loop.create_task(self._worker(), name=f"prefetch-worker-{i}") for i in range(self.workers)]
+
+    def submit(self, section_ids: Iterable[int]) -> None:
+        if not settings.PREFETCH_ENABLED:
+            return
+        self._ensure_started()
+        for section_id in section_ids:
+            if section_id not in self._pending:
+                self._pending.add(section_id)
+                self._queue.put_nowait(section_id)
+
+    async def _worker(self) -> None:
+        while True:
+            section_id = await self._queue.get()
+            # A change made while this section is being fetched queues it again
+            self._pending.discard(section_id)
+            try:
+                await prefetch_section(section_id)
+            except Exception as e:
+                logger.error("[PREFETCH] Could not prefetch section %s: %s", section_id, e, exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """Waits until every submitted section has been prefetched."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+
+_pool: Optional[PrefetchWorkerPool] = None
+
+
+def get_prefetcher() -> PrefetchWorkerPool:
+    global _pool
+    if _pool is None:
+        _pool = PrefetchWorkerPool(settings.PREFETCH_WORKERS)
+    return _pool
+
+
+async def refresh_collections(collections: Iterable[str]) -> None:
+    """Queues the sections with prefetched context from any of the collections; called after they change."""
+    names = set(collections)
+    if not settings.PREFETCH_ENABLED or not names:
+        return
+    async with get_session_factory()() as session:
+        result = await session.exec(select(PrefetchedContext.proposal_section_id, PrefetchedContext.collections))
+        section_ids = {section_id for section_id, mapped in result.all() if names & set(mapped or [])}
+    get_prefetcher().submit(sorted(section_ids))
+
+
+def prefetch_metrics() -> Dict[str, int]:
+    return {"queued_sections": get_prefetcher().queue_depth(), **_stats}
@@ -0,0 +1,268 @@
+"""Opt-in sampling profiler for single requests.
+
+A request is profiled when it sends ``X-Profile: 1`` together with the admin
+token (``X-Admin-Token``), or at random for ``PROFILING_SAMPLE_RATE`` of
+requests. While it runs, a background thread samples the Python stacks of
+every busy thread each ``PROFILING_INTERVAL_MS``: the event loop thread and the
+worker threads that ``asyncio.to_thread`` work such as pypdf and the Supabase
+client runs in. The overhead is one stack walk per interval; nothing is traced.
+
+A heartbeat on the event loop measures how late it wakes up. A wake-up later
+than ``PROFILING_BLOCK_THRESHOLD_MS`` means a blocking call held the loop; it
+is recorded together with the loop thread's stack, sampled while the loop was
+blocked. The profile also records wall time against the CPU time of the loop
+thread and of the whole process over the request.
+
+Samples cover the whole process, so on a busy worker concurrent requests
+appear too. Finished profiles are kept in a ring buffer of
+``PROFILING_BUFFER_SIZE`` and served by ``backend.routers.admin``. Stacks
+download in the folded format of flamegraph.pl and speedscope.
+"""
+import asyncio
+import collections
+import datetime
+import itertools
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Counter, Deque, Dict, List, Optional
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+TOKEN_HEADER = "x-admin-token"
+
+# Leaf frames of threads that are waiting rather than working
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+# Frames kept per sampled stack, innermost first
+MAX_STACK_DEPTH = 64
+
+
+@dataclass
+class Profile:
+    id: int
+    method: str
+    path: str
+    started_at: datetime.datetime
+    trigger: str  # "header" or "sample"
+    status: Optional[int] = None
+    wall_seconds: float = 0.0
+    loop_cpu_seconds: float = 0.0
+    process_cpu_seconds: float = 0.0
+    samples: int = 0
+    idle_loop_samples: int = 0
+    stacks: Counter[str] = field(default_factory=collections.Counter)
+    # Event loop stalls: {"duration_ms": ..., "stack": ...}
+    blocks: List[Dict[str, Any]] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at.isoformat(),
+            "trigger": self.trigger,
+            "status": self.status,
+            "wall_seconds": round(self.wall_seconds, 4),
+            "loop_cpu_seconds": round(self.loop_cpu_seconds, 4),
+            "process_cpu_seconds": round(self.process_cpu_seconds, 4),
+            "samples": self.samples,
+            "loop_blocked_ms": round(sum(block["duration_ms"] for block in self.blocks), 1),
+        }
+
+    def details(self, top: int = 25) -> Dict[str, Any]:
+        """The summary with the functions seen most often on top of a stack and the loop stalls."""
+        leaves: Counter[str] = collections.Counter()
+        for stack, count in self.stacks.items():
+            thread, _, frames = stack.partition(";")
+            leaves[f"{thread}: {frames.rsplit(';', 1)[-1]}"] += count
+        return {
+            **self.summary(),
+            "idle_loop_samples": self.idle_loop_samples,
+            "top_frames": [{"frame": frame, "samples": count} for frame, count in leaves.most_common(top)],
+            "blocks": sorted(self.blocks, key=lambda block: -block["duration_ms"]),
+        }
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _stack(frame) -> List[Any]:
+    frames = []
+    while frame is not None and len(frames) < MAX_STACK_DEPTH:
+        frames.append(frame)
+        frame = frame.f_back
+    return frames
+
+
+def _is_idle(frames: List[Any]) -> bool:
+    leaf = frames[0].f_code
+    return (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_FRAMES
+
+
+def _folded(thread_name: str, frames: List[Any]) -> str:
+    return ";".join([thread_name.replace(";", ",")] + [_frame_label(frame) for frame in reversed(frames)])
+
+
+class _Sampler(threading.Thread):
+    """Samples thread stacks into a profile and notes the loop's stack while it is blocked."""
+
+    def __init__(self, profile: Profile, loop_thread_id: int):
+        super().__init__(name=f"profiler-{profile.id}", daemon=True)
+        self.profile = profile
+        self.loop_thread_id = loop_thread_id
+        self.interval = settings.PROFILING_INTERVAL_MS / 1000
+        self.block_threshold = settings.PROFILING_BLOCK_THRESHOLD_MS / 1000
+        # perf_counter of the loop heartbeat's next wake-up; written by the loop thread
+        self.next_beat = time.perf_counter() + self.interval
+        self.blocked_stack: Optional[str] = None
+        self._stopped = threading.Event()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or names.get(thread_id, "").startswith("profiler-"):
+                    continue
+                frames = _stack(frame)
+                if not frames:
+                    continue
+                is_loop = thread_id == self.loop_thread_id
+                if _is_idle(frames):
+                    if is_loop:
+                        self.profile.idle_loop_samples += 1
+                    continue
+                folded = _folded("event-loop" if is_loop else names.get(thread_id, str(thread_id)), frames)
+                self.profile.stacks[folded] += 1
+                self.profile.samples += 1
+                late = time.perf_counter() - self.next_beat
+                if is_loop and self.blocked_stack is None and late > self.block_threshold:
+                    self.blocked_stack = folded
+
+
+def _note_stall(sampler: "_Sampler", now: float) -> None:
+    late = now - sampler.next_beat
+    if late > sampler.block_threshold:
+        sampler.profile.blocks.append({
+            "duration_ms": round(late * 1000, 1),
+            "stack": sampler.blocked_stack or "not sampled",
+        })
+    sampler.blocked_stack = None
+
+
+async def _heartbeat(sampler: "_Sampler") -> None:
+    """Records every wake-up of the loop that came later than the block threshold."""
+    while True:
+        sampler.next_beat = time.perf_counter() + sampler.interval
+        await asyncio.sleep(sampler.interval)
+        _note_stall(sampler, time.perf_counter())
+
+
+class ProfileStore:
+    """Finished profiles, newest last, in a ring buffer."""
+
+    def __init__(self, size: int):
+        self._profiles: Deque[Profile] = collections.deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self.active = 0
+
+    def new_id(self) -> int:
+        return next(self._ids)
+
+    def add(self, profile: Profile) -> None:
+        self._profiles.append(profile)
+
+    def list(self) -> List[Profile]:
+        return list(reversed(self._profiles))
+
+    def get(self, profile_id: int) -> Optional[Profile]:
+        return next((profile for profile in self._profiles if profile.id == profile_id), None)
+
+
+_store: Optional[ProfileStore] = None
+
+
+def get_profile_store() -> ProfileStore:
+    global _store
+    if _store is None:
+        _store = ProfileStore(settings.PROFILING_BUFFER_SIZE)
+    return _store
+
+
+def _trigger(scope: Dict[str, Any]) -> Optional[str]:
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+    token = settings.PROFILING_ADMIN_TOKEN
+    if headers.get(PROFILE_HEADER) == "1" and token and headers.get(TOKEN_HEADER) == token:
+        return "header"
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return "sample"
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the requests picked by ``_trigger``; adds ``X-Profile-Id`` to their response."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trigger = _trigger(scope)
+        store = get_profile_store()
+        if trigger is None or store.active >= settings.PROFILING_MAX_CONCURRENT:
+            return await self.app(scope, receive, send)
+
+        profile = Profile(id=store.new_id(), method=scope["method"], path=scope["path"],
+                          started_at=datetime.datetime.utcnow(), trigger=trigger)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", str(profile.id).encode())]}
+            await send(message)
+
+        store.active += 1
+        sampler = _Sampler(profile, threading.get_ident())
+        wall, loop_cpu, process_cpu = time.perf_counter(), time.thread_time(), time.process_time()
+        sampler.start()
+        heartbeat = asyncio.ensure_future(_heartbeat(sampler))
+        try:
+            # Let the heartbeat start before the request can block the loop
+            await asyncio.sleep(0)
+            await self.app(scope, receive, send_with_id)
+        finally:
+            heartbeat.cancel()
+            # A stall at the end of the request is over before the heartbeat could wake up
+            _note_stall(sampler, time.perf_counter())
+            profile.wall_seconds = time.perf_counter() - wall
+            profile.loop_cpu_seconds = time.thread_time() - loop_cpu
+            profile.process_cpu_seconds = time.process_time() - process_cpu
+            # The sampler stops within one interval; joining it off the loop keeps the response prompt
+            await asyncio.to_thread(sampler.stop)
+            store.active -= 1
+            store.add(profile)
+            logger.info(
+                "Profiled %s %s: %.3fs wall, %.3fs loop CPU, %d samples, %d loop stalls.",
+                profile.method, profile.path, profile.wall_seconds, profile.loop_cpu_seconds, profile.samples, len(profile.blocks),
+            )
@@ -0,0 +1,187 @@
+"""Versioned schema migrations for the Supabase knowledge base (``documents`` table).
+
+The app talks to Supabase through PostgREST, which cannot run DDL, so these
+migrations connect to the Supabase Postgres directly with
+``SUPABASE_RAG_DB_URL`` (``postgresql+asyncpg://...``). Run them once per
+deployment, before starting the server::
+
+    python -m backend.rag_migrations
+
+Applied versions are recorded in ``rag_schema_migrations``; a database created
+from the original ``supabase_script.md`` is brought up to date in place.
+Index builds take a lock on ``documents``; run them outside peak hours on a
+large corpus.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Set
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+# Serializes concurrent runs (e.g. several pods starting at once)
+ADVISORY_LOCK_ID = 7203541
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    statements: Callable[[], List[str]]
+
+
+def _documents_table() -> List[str]:
+    return [
+        "create extension if not exists vector with schema extensions",
+        f"""
+        create table if not exists documents (
+          id bigint generated by default as identity primary key,
+          collection text,
+          content text,
+          metadata jsonb,
+          embedding vector({settings.RAG_EMBEDDING_DIMENSIONS})
+        )
+        """,
+    ]
+
+
+def _vector_index() -> str:
+    if settings.RAG_VECTOR_INDEX == "hnsw":
+        return (
+            "create index if not exists documents_embedding_idx on documents using hnsw (embedding vector_cosine_ops) "
+            f"with (m = {settings.RAG_HNSW_M}, ef_construction = {settings.RAG_HNSW_EF_CONSTRUCTION})"
+        )
+    if settings.RAG_VECTOR_INDEX == "ivfflat":
+        # IVFFlat centroids come from the rows present at build time; build it after the initial load
+        return (
+            "create index if not exists documents_embedding_idx on documents using ivfflat (embedding vector_cosine_ops) "
+            f"with (lists = {settings.RAG_IVFFLAT_LISTS})"
+        )
+    raise ValueError(f"Unknown RAG_VECTOR_INDEX: {settings.RAG_VECTOR_INDEX}")
+
+
+def _lookup_indexes() -> List[str]:
+    return [
+        _vector_index(),
+        "create index if not exists documents_source_idx on documents ((metadata->>'source'))",
+        "create index if not exists documents_collection_idx on documents (collection)",
+    ]
+
+
+def _content_hash_index() -> List[str]:
+    # Looked up for every upload of content that is already stored (backend.uploads)
+    return ["create index if not exists documents_content_sha256_idx on documents ((metadata->>'content_sha256'))"]
+
+
+def _match_documents() -> List[str]:
+    dimensions = settings.RAG_EMBEDDING_DIMENSIONS
+    return [
+        # The new signature adds parameters; drop the old one so PostgREST sees a single function
+        "drop function if exists match_documents(vector, float, int, text[])",
+        f"""
+        create or replace function match_documents (
+          query_embedding vector({dimensions}),
+          match_threshold float,
+          match_count int,
+          collection_filter text[],
+          ef_search int default null,
+          probes int default null
+        )
+        returns table (
+          id bigint,
+          collection text,
+          content text,
+          metadata jsonb,
+          similarity float
+        )
+        language plpgsql
+        as $$
+        begin
+          if ef_search is not null then
+            perform set_config('hnsw.ef_search', ef_search::text, true);
+          end if;
+          if probes is not null then
+            perform set_config('ivfflat.probes', probes::text, true);
+          end if;
+
+          -- The inner query is a plain nearest-neighbour scan the vector index can
+          -- serve; the threshold only filters the match_count rows it returns.
+          return query
+          select nearest.id, nearest.collection, nearest.content, nearest.metadata, nearest.similarity
+          from (
+            select
+              documents.id,
+              documents.collection,
+              documents.content,
+              documents.metadata,
+              1 - (documents.embedding <=> query_embedding) as similarity
+            from documents
+            where documents.collection = any(collection_filter)
+            order by documents.embedding <=> query_embedding
+            limit match_count
+          ) as nearest
+          where nearest.similarity > match_threshold
+          order by nearest.similarity desc;
+        end;
+        $$
+        """,
+    ]
+
+
+MIGRATIONS = [
+    Migration(1, "documents table", _documents_table),
+    Migration(2, "vector, source and collection indexes", _lookup_indexes),
+    Migration(3, "match_documents with index-ordered search and tuning parameters", _match_documents),
+    Migration(4, "content hash index", _content_hash_index),
+]
+
+
+def pending_migrations(applied: Iterable[int]) -> List[Migration]:
+    applied_versions: Set[int] = set(applied)
+    return [migration for migration in MIGRATIONS if migration.version not in applied_versions]
+
+
+async def migrate_rag() -> List[int]:
+    """Applies pending migrations, each in its own transaction, and returns their versions."""
+    if not settings.SUPABASE_RAG_DB_URL:
+        raise RuntimeError("SUPABASE_RAG_DB_URL must be set to migrate the knowledge base schema.")
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    engine = create_async_engine(settings.SUPABASE_RAG_DB_URL, poolclass=NullPool)
+    applied_now = []
+    try:
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql(f"select pg_advisory_lock({ADVISORY_LOCK_ID})")
+            await conn.exec_driver_sql(
+                "create table if not exists rag_schema_migrations "
+                "(version int primary key, name text not null, applied_at timestamptz not null default now())"
+            )
+            await conn.commit()
+
+            result = await conn.exec_driver_sql("select version from rag_schema_migrations")
+            for migration in pending_migrations(row[0] for row in result.all()):
+                logger.info("Applying knowledge base migration %d: %s.", migration.version, migration.name)
+                for statement in migration.statements():
+                    await conn.exec_driver_sql(statement)
+                await conn.execute(
+                    text("insert into rag_schema_migrations (version, name) values (:version, :name)"),
+                    {"version": migration.version, "name": migration.name},
+                )
+                await conn.commit()
+                applied_now.append(migration.version)
+
+            await conn.exec_driver_sql(f"select pg_advisory_unlock({ADVISORY_LOCK_ID})")
+            await conn.commit()
+    finally:
+        await engine.dispose()
+
+    logger.info("Knowledge base schema is up to date (%d migrations applied).", len(applied_now))
+    return applied_now
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate_rag())
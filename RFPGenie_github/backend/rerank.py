@@ -0,0 +1,247 @@
+"""Cross-encoder reranking of retrieved chunks.
+
+With ``RERANK_ENABLED`` the knowledge base query over-fetches
+``RERANK_CANDIDATES`` chunks by vector similarity, and a local cross-encoder
+(``RERANK_MODEL``, sentence-transformers on the CPU) scores each of them against
+the query. The best chunks are then cut down to their relevant sentences: every
+sentence of a kept chunk is scored too, and those below
+``RERANK_MIN_SENTENCE_SCORE`` are dropped (the best one always stays).
+Chunks are added best first until ``RERANK_CONTEXT_TOKENS`` is reached, so a
+tool call returns a few tight passages instead of five full chunks.
+
+Scoring requests from concurrent queries go through one queue and are scored
+together by a worker thread, like the local embedding provider's. If the model
+cannot be loaded, the chunks are returned by similarity, untrimmed.
+"""
+import asyncio
+from abc import ABC, abstractmethod
+import concurrent.futures
+import logging
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from .chunking import count_tokens
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+Pair = Tuple[str, str]
+
+
+def split_sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+
+class Reranker(ABC):
+    """Scores (query, passage) pairs; higher is more relevant."""
+
+    @abstractmethod
+    def score_sync(self, pairs: List[Pair]) -> List[float]:
+        ...
+
+    async def score(self, pairs: List[Pair]) -> List[float]:
+        return await asyncio.to_thread(self.score_sync, pairs)
+
+    def close(self) -> None:
+        pass
+
+    async def rerank(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ranked = self._rank(candidates, await self.score([(query, item["content"]) for item in candidates]))
+        sentences = [split_sentences(item["content"]) for item, _ in ranked]
+        return self._select(ranked, sentences, await self.score([(query, s) for passage in sentences for s in passage]))
+
+    def rerank_sync(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        ranked = self._rank(candidates, self.score_sync([(query, item["content"]) for item in candidates]))
+        sentences = [split_sentences(item["content"]) for item, _ in ranked]
+        return self._select(ranked, sentences, self.score_sync([(query, s) for passage in sentences for s in passage]))
+
+    @staticmethod
+    def _rank(candidates: List[Dict[str, Any]], scores: List[float]) -> List[Tuple[Dict[str, Any], float]]:
+        return sorted(zip(candidates, scores), key=lambda pair: -pair[1])[:settings.RERANK_TOP_K]
+
+    @staticmethod
+    def _select(ranked: List[Tuple[Dict[str, Any], float]], sentences: List[List[str]], sentence_scores: List[float]) -> List[Dict[str, Any]]:
+        """Trims the ranked chunks to their relevant sentences and keeps the best within the token budget."""
+        selected: List[Dict[str, Any]] = []
+        budget = settings.RERANK_CONTEXT_TOKENS
+        offset = 0
+        for (item, passage_score), passage in zip(ranked, sentences):
+            scores = sentence_scores[offset:offset + len(passage)]
+            offset += len(passage)
+            if not passage:
+                continue
+            best = max(range(len(passage)), key=lambda i: scores[i])
+            # Original order, so the passage still reads naturally
+            kept = [sentence for i, sentence in enumerate(passage) if i == best or scores[i] >= settings.RERANK_MIN_SENTENCE_SCORE]
+            content = " ".join(kept)
+            tokens = count_tokens(content)
+            if selected and tokens > budget:
+                continue
+            selected.append({**item, "content": content, "rerank_score": passage_score})
+            budget -= tokens
+            if budget <= 0:
+                break
+        return selected
+
+
+class _ScoreRequest:
+    __slots__ = ("pairs", "future")
+
+    def __init__(self, pairs: List[Pair]):
+        self.pairs = pairs
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+
+
+_STOP = object()
+
+
+class CrossEncoderReranker(Reranker):
+    """sentence-transformers CrossEncoder on the CPU, batching pairs across callers.
+
+    The worker thread takes the first queued request, collects more for up to
+    ``max_wait_ms`` or until ``max_batch_size`` pairs are waiting, and scores
+    them in one forward pass. The model is loaded by the worker on first use.
+    """
+
+    def __init__(self, model_name: str, max_batch_size: int = 32, max_wait_ms: float = 5.0, max_queue_size: int = 1024, device: str = "cpu"):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.device = device
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="rerank-worker", daemon=True)
+                self._thread.start()
+
+    def _collect_batch(self, first: _ScoreRequest) -> tuple:
+        batch = [first]
+        size = len(first.pairs)
+        stop = False
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+            size += len(item.pairs)
+        return batch, stop
+
+    def _score_batch(self, model, batch: List[_ScoreRequest]) -> None:
+        pairs = [pair for item in batch for pair in item.pairs]
+        try:
+            scores = model.predict(pairs, batch_size=self.max_batch_size, convert_to_numpy=True).tolist()
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+            return
+        offset = 0
+        for item in batch:
+            item.future.set_result(scores[offset:offset + len(item.pairs)])
+            offset += len(item.pairs)
+        logger.debug("Scored %d pairs from %d requests in one batch.", len(pairs), len(batch))
+
+    def _run(self) -> None:
+        model, load_error = None, None
+        try:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(self.model_name, device=self.device)
+            logger.info("Loaded reranking model %s on %s.", self.model_name, self.device)
+        except Exception as e:
+            logger.error("Could not load reranking model %s: %s", self.model_name, e, exc_info=True)
+            load_error = e
+
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect_batch(first)
+            batch = [item for item in batch if item.future.set_running_or_notify_cancel()]
+
+            if load_error is not None:
+                for item in batch:
+                    item.future.set_exception(load_error)
+            elif batch:
+                self._score_batch(model, batch)
+
+            if stop:
+                return
+
+    def _submit(self, pairs: List[Pair]) -> concurrent.futures.Future:
+        self._ensure_worker()
+        request = _ScoreRequest(list(pairs))
+        self._queue.put_nowait(request)
+        return request.future
+
+    async def score(self, pairs: List[Pair]) -> List[float]:
+        if not pairs:
+            return []
+        return await asyncio.wrap_future(self._submit(pairs))
+
+    def score_sync(self, pairs: List[Pair]) -> List[float]:
+        if not pairs:
+            return []
+        return self._submit(pairs).result()
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+
+_reranker: Optional[Reranker] = None
+
+
+def get_reranker() -> Reranker:
+    """The configured reranker, created on first use."""
+    global _reranker
+    if _reranker is None:
+        _reranker = CrossEncoderReranker(
+            settings.RERANK_MODEL,
+            max_batch_size=settings.RERANK_BATCH_SIZE,
+            max_wait_ms=settings.RERANK_BATCH_WAIT_MS,
+        )
+    return _reranker
+
+
+def match_count() -> int:
+    """Chunks to fetch from the vector index for one query."""
+    return settings.RERANK_CANDIDATES if settings.RERANK_ENABLED else settings.RAG_MATCH_COUNT
+
+
+def _fallback(candidates: List[Dict[str, Any]], error: Exception) -> List[Dict[str, Any]]:
+    logger.warning("Reranking failed, using the chunks by similarity: %s", error)
+    return candidates[:settings.RAG_MATCH_COUNT]
+
+
+async def arerank(query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not settings.RERANK_ENABLED or not candidates:
+        return candidates
+    try:
+        return await get_reranker().rerank(query, candidates)
+    except Exception as e:
+        return _fallback(candidates, e)
+
+
+def rerank(query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    if not settings.RERANK_ENABLED or not candidates:
+        return candidates
+    try:
+        return get_reranker().rerank_sync(query, candidates)
+    except Exception as e:
+        return _fallback(candidates, e)
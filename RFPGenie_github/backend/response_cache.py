@@ -0,0 +1,200 @@
+"""Read-through cache of serialized responses for rarely changing entities.
+
+Templates, the section library and proposals are polled by the editor far more
+often than they change. Their GET handlers serve the JSON body from this
+in-process cache and only query the database on a miss. The handlers that
+change them invalidate the affected keys; ``READ_CACHE_TTL_SECONDS`` bounds how
+long another worker process can serve a body that was changed elsewhere.
+
+Cached responses carry a strong ``ETag`` over the body and a ``Last-Modified``
+of when the body last changed, and conditional requests that match get
+``304 Not Modified``. Bodies above ``COMPRESS_MIN_BYTES`` are sent gzip-encoded
+(brotli when the ``brotli`` package is installed and the client accepts it);
+the encoded variants are cached alongside the body.
+"""
+import asyncio
+import email.utils
+import gzip
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+from pydantic import TypeAdapter
+from starlette.requests import Request
+from starlette.responses import Response
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+KIND_TEMPLATES = "templates"
+KIND_SECTIONS = "sections"
+KIND_PROPOSAL = "proposal"
+KIND_PROPOSAL_SECTIONS = "proposal_sections"
+
+
+@dataclass
+class CachedBody:
+    body: bytes
+    etag: str
+    last_modified: float
+    stored_at: float
+    _encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    def encoded(self, encoding: str) -> bytes:
+        if encoding not in self._encoded:
+            if encoding == "br":
+                self._encoded[encoding] = brotli.compress(self.body)
+            else:
+                self._encoded[encoding] = gzip.compress(self.body, compresslevel=6)
+        return self._encoded[encoding]
+
+
+class ResponseCache:
+    """Serialized bodies by key, e.g. ``("proposal", 7)``; concurrent misses for a key share one load."""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, ...], CachedBody]" = OrderedDict()
+        # Bumped on invalidation, so a load that raced with a write is not stored
+        self._versions: Dict[Tuple[Hashable, ...], int] = {}
+        self._loading: Dict[Tuple[Hashable, ...], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_or_load(self, key: Tuple[Hashable, ...], load: Callable[[], Awaitable[bytes]]) -> CachedBody:
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None and now - entry.stored_at < self.ttl:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        pending = self._loading.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        version = self._versions.get(key, 0)
+        try:
+            body = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Only the waiters should see the error; nobody may be waiting
+            future.exception()
+            raise
+        finally:
+            del self._loading[key]
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        # An expired body that did not change keeps its Last-Modified
+        last_modified = entry.last_modified if entry is not None and entry.etag == etag else now
+        fresh = CachedBody(body=body, etag=etag, last_modified=last_modified, stored_at=now)
+        if self._versions.get(key, 0) == version:
+            self._entries[key] = fresh
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(fresh)
+        return fresh
+
+    def invalidate(self, *keys: Tuple[Hashable, ...]) -> None:
+        for key in keys:
+            self._entries.pop(key, None)
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def invalidate_kind(self, kind: str) -> None:
+        """Drops every key of one kind, e.g. all proposals."""
+        keys = {key for key in self._entries if key[0] == kind} | {key for key in self._loading if key[0] == kind}
+        self.invalidate(*keys)
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache(settings.READ_CACHE_TTL_SECONDS, settings.READ_CACHE_MAX_ENTRIES)
+    return _cache
+
+
+def invalidate_proposal(proposal_id: int) -> None:
+    get_response_cache().invalidate((KIND_PROPOSAL, proposal_id), (KIND_PROPOSAL_SECTIONS, proposal_id))
+
+
+@lru_cache(maxsize=None)
+def _adapter(response_type: Any) -> TypeAdapter:
+    return TypeAdapter(response_type)
+
+
+def _not_modified(request: Request, entry: CachedBody) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or entry.etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have whole seconds
+        return int(entry.last_modified) <= since
+    return False
+
+
+def _encoding(request: Request) -> Optional[str]:
+    accepted = {part.split(";")[0].strip().lower() for part in request.headers.get("accept-encoding", "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+async def cached_response(request: Request, key: Tuple[Hashable, ...], load: Callable[[], Awaitable[Any]], response_type: Any) -> Response:
+    """Serves ``load()`` serialized as ``response_type`` through the cache, with conditional GET and compression."""
+    async def load_body() -> bytes:
+        return _adapter(response_type).dump_json(await load())
+
+    cache = get_response_cache()
+    entry = await cache.get_or_load(key, load_body)
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": email.utils.formatdate(entry.last_modified, usegmt=True),
+        # Clients may keep the body but must revalidate it; revalidation is cheap
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, entry):
+        cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+
+    body = entry.body
+    encoding = _encoding(request) if len(body) >= settings.COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = entry.encoded(encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def cache_metrics() -> Dict[str, int]:
+    cache = get_response_cache()
+    return {"entries": len(cache), "hits": cache.hits, "misses": cache.misses, "not_modified": cache.not_modified}
@@ -0,0 +1,46 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from backend.config import settings
+from backend.profiling import get_profile_store
+import logging
+
+logger = logging.getLogger(__name__)
+
+def require_admin_token(x_admin_token: Optional[str] = Header(default=None)):
+    # Without a configured token the admin endpoints do not exist
+    if not settings.PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_admin_token != settings.PROFILING_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"],
+    dependencies=[Depends(require_admin_token)],
+)
+
+@router.get("/profiles")
+async def list_profiles():
+    """Captured request profiles, newest first."""
+    return [profile.summary() for profile in get_profile_store().list()]
+
+@router.get("/profiles/{profile_id}")
+async def read_profile(profile_id: int):
+    """A profile's hottest frames and event loop stalls."""
+    profile = get_profile_store().get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile.details()
+
+@router.get("/profiles/{profile_id}/folded", response_class=PlainTextResponse)
+async def download_profile(profile_id: int):
+    """The sampled stacks in folded format, for flamegraph.pl or speedscope."""
+    profile = get_profile_store().get(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    logger.info(f"Downloading profile {profile_id} ({profile.samples} samples).")
+    return PlainTextResponse(
+        profile.folded(),
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.folded"'},
+    )
@@ -1,48 +1,39 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-import shutil
-from pathlib import Path
-import pypdf
-import docx
-import json
-import litellm
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request
+import asyncio
 import logging
-from ..agent.ingestion_agent import ingestion_agent, CATEGORIES
-from ..database import supabase_rag
-from google.adk.models.llm_request import LlmRequest
-from google.genai import types
+import os
+from typing import AsyncIterator
+from ..agent.ingestion_agent import CATEGORIES
+from ..assembly import bump_collection_revisions
+from ..prefetch import refresh_collections
+from ..database import get_supabase_rag
+from ..embeddings import (
+    EmbeddingModelMismatch,
+    EmbeddingQueueFull,
+    ensure_collection_models,
+    forget_collection_models,
+    get_embedding_provider,
+    record_collection_models,
+)
+from ..documents import SUPPORTED_EXTENSIONS, UnsupportedDocumentType
+from ..ingestion import ChunkingError, EmptyDocument, build_chunks
+from ..llm import Priority, llm_priority
+from ..logging_config import Payload
+from ..storage import CHUNK_SIZE, blob_uri
+from ..uploads import (
+    DuplicateContent,
+    TooManyPages,
+    UploadTooLarge,
+    check_declared_size,
+    check_new_content,
+    claim_content,
+    store_upload,
+)
 
 router = APIRouter()
 
-UPLOAD_DIR = Path("backend/uploads")
-UPLOAD_DIR.mkdir(exist_ok=True)
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def read_document(file_path: Path) -> str:
-    """Reads content from .pdf, .docx, or .txt file."""
-    extension = file_path.suffix.lower()
-    content = ""
-    try:
-        if extension == ".pdf":
-            with file_path.open("rb") as f:
-                reader = pypdf.PdfReader(f)
-                for page in reader.pages:
-                    content += page.extract_text() or ""
-        elif extension == ".docx":
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                content += para.text + "\n"
-        elif extension == ".txt":
-            with file_path.open("r", encoding="utf-8") as f:
-                content = f.read()
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {extension}")
-        return content
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to read file {file_path.name}: {e}")
-
 @router.post("/collections/upload")
 async def upload_document(file: UploadFile = File(...)):
     """
@@ -51,117 +42,138 @@ async def upload_document(file: UploadFile = File(...)):
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file name provided.")
+    try:
+        check_declared_size(file.size)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
-    file_path = UPLOAD_DIR / file.filename
-    logger.info(f"Receiving file: {file.filename}")
+    async def chunks():
+        while chunk := await file.read(CHUNK_SIZE):
+            yield chunk
+
+    try:
+        return await _ingest_upload(file.filename, chunks())
+    finally:
+        await file.close()
+
+@router.post("/collections/upload_stream")
+async def upload_document_stream(request: Request, filename: str):
+    """
+    Uploads a document sent as the raw request body, e.g. with
+    ``curl --data-binary @file.pdf``. The body is stored as it arrives
+    instead of being received in full first.
+    """
+    length = request.headers.get("content-length")
+    try:
+        check_declared_size(int(length) if length and length.isdigit() else None)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return await _ingest_upload(filename, request.stream())
+
+async def _ingest_upload(filename: str, chunks: AsyncIterator[bytes]):
+    """Stores an upload, refuses duplicates and files over the limits, then chunks, embeds and stores it."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {extension}")
+    logger.info("Receiving file: %s", filename)
 
     # Check if a document with this name already exists
-    existing_docs_response = supabase_rag.table('documents').select('id', count='exact').eq('metadata->>source', file.filename).execute()
+    existing_docs_response = get_supabase_rag().table('documents').select('id', count='exact').eq('metadata->>source', filename).execute()
     if existing_docs_response.count > 0:
-        raise HTTPException(status_code=409, detail=f"A document named '{file.filename}' already exists in the knowledge base.")
+        raise HTTPException(status_code=409, detail=f"A document named '{filename}' already exists in the knowledge base.")
 
     try:
-        logger.info(f"Saving file to: {file_path}")
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info("File saved successfully.")
+        stored = await store_upload(chunks, extension)
+        document_ref = blob_uri(stored.key, extension)
+        logger.info("Stored file as %s (%d bytes, new: %s).", document_ref, stored.size, stored.created)
+    except (UploadTooLarge, TooManyPages) as e:
+        logger.warning("Refused upload %s: %s", filename, e)
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
-        logger.error(f"Could not save file: {e}", exc_info=True)
+        logger.error("Could not save file: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
-    finally:
-        file.file.close()
 
     try:
-        # 1. Read document content
-        logger.info("Reading document content.")
-        document_content = read_document(file_path)
-        if not document_content.strip():
-            logger.warning("Document is empty or could not be read.")
-            raise HTTPException(status_code=400, detail="Document is empty or could not be read.")
-        logger.info(f"Document content read, length: {len(document_content)} characters.")
-
-        # 2. Invoke Ingestion Agent for agentic chunking
-        logger.info("Invoking ingestion agent for chunking.")
-        prompt = f"Source: {file.filename}\n\n{document_content}"
-        llm_request = LlmRequest(
-            contents=[types.Content(role="user", parts=[types.Part(text=prompt)])],
-            config=types.GenerateContentConfig(
-                system_instruction=ingestion_agent.instruction
-            )
-        )
-        
-        response_generator = ingestion_agent.model.generate_content_async(llm_request)
-        
-        response_text = ""
-        async for response_part in response_generator:
-            if response_part.content and response_part.content.parts:
-                response_text += response_part.content.parts[0].text
-
-        logger.info(f"Raw response from agent: {response_text}")
-
-        # Clean up the response to get valid JSON
-        json_response_str = response_text.strip()
-        if json_response_str.startswith("```json"):
-            json_response_str = json_response_str[7:]
-        if json_response_str.endswith("```"):
-            json_response_str = json_response_str[:-3]
-        
-        logger.info(f"Cleaned JSON string: {json_response_str}")
-
+        with claim_content(stored.key):
+            await check_new_content(stored, document_ref, extension)
+            return await _ingest_document(filename, document_ref, stored.key)
+    except DuplicateContent as e:
+        logger.info("Refused upload %s: %s", filename, e)
+        raise HTTPException(status_code=409, detail=str(e))
+    except TooManyPages as e:
+        logger.warning("Refused upload %s: %s", filename, e)
+        raise HTTPException(status_code=413, detail=str(e))
+
+async def _ingest_document(filename: str, document_ref: str, content_key: str):
+    supabase_rag = get_supabase_rag()
+    try:
+        # 1. Read and chunk the document
         try:
-            chunks = json.loads(json_response_str)
-            logger.info(f"Successfully parsed {len(chunks)} chunks from agent response.")
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse JSON response from chunking agent: {e}", exc_info=True)
-            raise HTTPException(status_code=500, detail="Failed to parse JSON response from chunking agent.")
-
-        # 3. Create embeddings and prepare for storage
-        logger.info("Creating embeddings for chunks.")
-        documents_to_store = []
+            chunks = await build_chunks(filename, document_ref)
+        except UnsupportedDocumentType as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except EmptyDocument as e:
+            logger.warning("Document %s is empty or could not be read.", filename)
+            raise HTTPException(status_code=400, detail=str(e))
+        except ChunkingError as e:
+            logger.error("Chunking %s failed: %s", filename, e)
+            raise HTTPException(status_code=500, detail=str(e))
+        logger.info("Document %s produced %d chunks.", filename, len(chunks))
+
+        # 2. Create embeddings and prepare for storage
+        valid_chunks = []
         for i, chunk in enumerate(chunks):
             if not all(k in chunk for k in ['collection', 'content', 'metadata']):
-                logger.warning(f"Skipping malformed chunk {i+1}: {chunk}")
+                logger.warning("Skipping malformed chunk %d: %s", i + 1, Payload(chunk, max_chars=200))
                 continue
+            valid_chunks.append(chunk)
 
-            logger.info(f"Generating embedding for chunk {i+1}/{len(chunks)}.")
-            logger.info(f"  Collection: {chunk.get('collection')}")
-            logger.info(f"  Content: {chunk.get('content')[:100]}...") # Log first 100 chars
-            embedding_response = await litellm.aembedding(
-                model="text-embedding-3-small",
-                input=[chunk['content']]
-            )
-            embedding = embedding_response.data[0]['embedding']
+        provider = get_embedding_provider()
+        target_collections = sorted({chunk['collection'] for chunk in valid_chunks})
+        try:
+            # Looks collections up in Supabase on first use
+            await asyncio.to_thread(ensure_collection_models, target_collections, provider.model_id)
+        except EmbeddingModelMismatch as e:
+            raise HTTPException(status_code=409, detail=str(e))
 
-            documents_to_store.append({
+        logger.info("Creating embeddings for %d chunks with %s.", len(valid_chunks), provider.model_id)
+        try:
+            with llm_priority(Priority.BULK):
+                embeddings = await provider.embed([chunk['content'] for chunk in valid_chunks])
+        except EmbeddingQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+        documents_to_store = [
+            {
                 'collection': chunk['collection'],
                 'content': chunk['content'],
-                'metadata': chunk['metadata'],
+                'metadata': {**chunk['metadata'], 'embedding_model': provider.model_id, 'content_sha256': content_key},
                 'embedding': embedding,
-            })
+            }
+            for chunk, embedding in zip(valid_chunks, embeddings)
+        ]
 
-        # 4. Store in Supabase
+        # 3. Store in Supabase
         if documents_to_store:
-            logger.info(f"Storing {len(documents_to_store)} documents in Supabase.")
+            logger.info("Storing %d documents in Supabase.", len(documents_to_store))
             response = supabase_rag.table('documents').insert(documents_to_store).execute()
             if getattr(response, 'error', None):
-                logger.error(f"Failed to store documents in Supabase: {response.error}", exc_info=True)
+                logger.error("Failed to store documents in Supabase: %s", response.error, exc_info=True)
                 raise HTTPException(status_code=500, detail=f"Failed to store documents in Supabase: {response.error}")
+            record_collection_models(target_collections, provider.model_id)
+            await bump_collection_revisions(target_collections)
+            await refresh_collections(target_collections)
             logger.info("Successfully stored documents in Supabase.")
         else:
             logger.warning("No documents to store.")
 
-        return {"message": f"Successfully ingested {len(documents_to_store)} chunks from '{file.filename}'."}
+        return {"message": f"Successfully ingested {len(documents_to_store)} chunks from '{filename}'."}
 
     except Exception as e:
-        logger.error(f"An error occurred during ingestion: {e}", exc_info=True)
+        logger.error("An error occurred during ingestion: %s", e, exc_info=True)
         if isinstance(e, HTTPException):
             raise e
         raise HTTPException(status_code=500, detail=f"An error occurred during ingestion: {str(e)}")
-    finally:
-        # 5. Clean up the temporary file
-        if file_path.exists():
-            logger.info(f"Cleaning up temporary file: {file_path}")
-            file_path.unlink()
 
 @router.get("/collections")
 async def get_collections_by_source():
@@ -170,7 +182,7 @@ async def get_collections_by_source():
     """
     try:
         logger.info("Fetching documents grouped by source.")
-        response = supabase_rag.table('documents').select('collection', 'metadata').execute()
+        response = get_supabase_rag().table('documents').select('collection', 'metadata').execute()
 
         if not response.data:
             logger.info("No documents found.")
@@ -211,7 +223,7 @@ async def delete_source(source: str):
     """
     try:
         logger.info(f"Attempting to delete all documents from source: {source}")
-        response = supabase_rag.table('documents').delete().eq('metadata->>source', source).execute()
+        response = get_supabase_rag().table('documents').delete().eq('metadata->>source', source).execute()
 
         # The response from delete() might not include a count of deleted rows.
         # We can check the status code or for an error.
@@ -219,6 +231,12 @@ async def delete_source(source: str):
             logger.error(f"Error deleting source {source}: {response.error}")
             raise HTTPException(status_code=500, detail=f"Failed to delete source: {response.error}")
 
+        forget_collection_models()
+        # Deleted rows are returned, so the affected collections are known without another query
+        deleted_from = {row.get('collection') for row in response.data or []}
+        await bump_collection_revisions(deleted_from)
+        await refresh_collections(deleted_from)
+
         # To give a more accurate response, we can't easily get the number of deleted rows
         # without another query. We'll just return a success message.
         logger.info(f"Successfully initiated deletion for source: {source}")
@@ -235,7 +253,7 @@ async def get_chunks(source: str, collection: str):
     """
     try:
         logger.info(f"Fetching chunks for source: {source}, collection: {collection}")
-        response = supabase_rag.table('documents').select('content').eq('metadata->>source', source).eq('collection', collection).execute()
+        response = get_supabase_rag().table('documents').select('content').eq('metadata->>source', source).eq('collection', collection).execute()
 
         if not response.data:
             logger.info("No chunks found.")
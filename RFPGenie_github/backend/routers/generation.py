@@ -1,20 +1,44 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel.ext.asyncio.session import AsyncSession
 from backend.database import get_session
-from backend.models import Proposal, Template, ProposalSection, SectionVersion
-from backend.agent.main_agent import initial_draft_agent, final_proposal_agent
-from backend.agent.regeneration_agent import regeneration_agent
+from backend.models import (
+    Proposal, Template, ProposalSection, SectionVersion, DraftBatch, DraftJob, DraftBatchResponse, DraftJobResponse,
+    FinalGenerationRun, FinalGenerationRunResponse,
+)
+from backend.agent.regeneration_agent import REGENERATION_INSTRUCTION
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import List, Dict, Optional
 import logging
 import json
-import re
-import os
-from pypdf import PdfReader
-from docx import Document
-from backend.agent.tools.rag_tool import query_collection_tool
+import asyncio
+from backend.agent.tools.rag_tool import aquery_collections
+from backend.assembly import plan_final_sections, store_and_assemble
+from backend.cancellation import ClientDisconnected, LatestOnly, Superseded, cancel_on_disconnect
+from backend.chunking import count_tokens
 from backend.config import settings
-import litellm
+from backend.documents import read_document
+from backend.drafts import (
+    JOB_QUEUED,
+    JOB_SKIPPED,
+    FINISHED_JOB_STATUSES,
+    DraftAlreadyExists,
+    DraftInProgress,
+    build_initial_draft,
+    claim_proposal,
+    get_draft_pool,
+    has_initial_draft,
+    is_orphaned,
+    load_batch_context,
+    recover_draft_jobs,
+    save_initial_draft,
+)
+from backend.final_generation import RAG_TOOL_SCHEMA, RunNotResumable, advance_run, check_resumable, start_run
+from backend.prefetch import get_prefetcher, load_warm_context
+from backend.response_cache import invalidate_proposal
+from backend.search import index_final, index_versions
+from backend.llm import Priority, get_llm_governor, llm_priority
+from backend.routing import TASK_REGENERATE, Route, choose_route, track_route, validate_section_html
+from backend.logging_config import log_payload
 from sqlmodel import select, func
 from sqlalchemy.orm import selectinload
 
@@ -25,9 +49,18 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+# Only the newest regeneration request per section is worked on
+_regenerations = LatestOnly()
+
+# Nginx's status for a request the client abandoned; nobody reads the response
+CLIENT_CLOSED_REQUEST = 499
+
 class InitialDraftRequest(BaseModel):
     proposal_id: int
 
+class BatchInitialDraftRequest(BaseModel):
+    proposal_ids: List[int]
+
 class FinalProposalRequest(BaseModel):
     proposal_id: int
     selected_versions: Dict[int, str]
@@ -52,9 +85,18 @@ async def update_section_version_content(
 
     section_version.content = request.content
     session.add(section_version)
+    proposal_section = await session.get(ProposalSection, section_version.proposal_section_id)
+    if proposal_section:
+        await index_versions(session, proposal_section.proposal_id, [(version_id, proposal_section.section_name, request.content)])
     await session.commit()
     await session.refresh(section_version)
 
+    # The section's likely knowledge base queries include its content
+    if proposal_section:
+        invalidate_proposal(proposal_section.proposal_id)
+        if proposal_section.collection_mappings:
+            get_prefetcher().submit([proposal_section.id])
+
     logger.info(f"Successfully updated content for version ID: {version_id}")
     return section_version
 
@@ -71,64 +113,127 @@ async def generate_initial_draft(request: InitialDraftRequest, session: AsyncSes
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
 
-    try:
-        _, extension = os.path.splitext(proposal.scope_document_path)
-        scope_document = ""
-        if extension.lower() == ".pdf":
-            reader = PdfReader(proposal.scope_document_path)
-            for page in reader.pages:
-                scope_document += page.extract_text()
-        elif extension.lower() == ".docx":
-            doc = Document(proposal.scope_document_path)
-            for para in doc.paragraphs:
-                scope_document += para.text + "\n"
-        else:
-            with open(proposal.scope_document_path, 'r', encoding='utf-8', errors='ignore') as f:
-                scope_document = f.read()
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error reading scope document: {e}")
+    if await has_initial_draft(session, proposal.id):
+        logger.info(f"Proposal {proposal.id} already has an initial draft; nothing to do.")
+        return {"message": "Initial draft already exists."}
 
     try:
-        from google.genai import types
-        from google.adk.models.llm_request import LlmRequest
-
-        prompt = f"scope_document: {scope_document}\n\nsections: {template.sections}"
-        llm_request = LlmRequest(
-            contents=[types.Content(role="user", parts=[types.Part(text=prompt)])],
-            config=types.GenerateContentConfig(system_instruction=initial_draft_agent.instruction)
-        )
-        response_generator = initial_draft_agent.model.generate_content_async(llm_request)
-        full_response_text = "".join([part.content.parts[0].text async for part in response_generator if part.content and part.content.parts])
-
-        if not full_response_text:
-            raise Exception("Agent returned an empty response.")
-
-        match = re.search(r"```json\s*(.*?)\s*```", full_response_text, re.DOTALL)
-        json_string = match.group(1).strip() if match else full_response_text
-        
-        initial_draft = json.loads(json_string)
-
-        for section_name, content in initial_draft.items():
-            proposal_section = ProposalSection(proposal_id=proposal.id, section_name=section_name)
-            session.add(proposal_section)
-            await session.flush() # Flush to get the ID for the proposal_section
-            
-            section_version = SectionVersion(
-                proposal_section_id=proposal_section.id,
-                version_number=1,
-                content=content
-            )
-            session.add(section_version)
-        
-        await session.commit()
-        return {"message": "Initial draft generated successfully."}
-
-    except Exception as e:
-        logger.error(f"Error during initial draft generation: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Failed to generate initial draft.")
+        with claim_proposal(proposal.id):
+            try:
+                scope_document = await asyncio.to_thread(read_document, proposal.scope_document_path, text_fallback=True)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error reading scope document: {e}")
+
+            try:
+                initial_draft = await build_initial_draft(scope_document, template.sections)
+                await save_initial_draft(session, proposal.id, initial_draft)
+            except DraftAlreadyExists:
+                logger.info(f"Initial draft for proposal {proposal.id} was stored by a concurrent request.")
+                return {"message": "Initial draft already exists."}
+            except Exception as e:
+                logger.error(f"Error during initial draft generation: {e}", exc_info=True)
+                raise HTTPException(status_code=500, detail="Failed to generate initial draft.")
+    except DraftInProgress:
+        raise HTTPException(status_code=409, detail="Initial draft generation is already in progress for this proposal.")
+
+    return {"message": "Initial draft generated successfully."}
+
+def _batch_response(batch: DraftBatch) -> DraftBatchResponse:
+    counts: Dict[str, int] = {}
+    for job in batch.jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    finished = all(job.status in FINISHED_JOB_STATUSES for job in batch.jobs)
+    return DraftBatchResponse(
+        id=batch.id,
+        created_at=batch.created_at,
+        status="completed" if finished else "running",
+        counts=counts,
+        jobs=[DraftJobResponse.model_validate(job, from_attributes=True) for job in sorted(batch.jobs, key=lambda job: job.id)],
+    )
+
+@router.post("/initial_drafts", response_model=DraftBatchResponse, status_code=202)
+async def create_initial_draft_batch(request: BatchInitialDraftRequest, session: AsyncSession = Depends(get_session)):
+    """Queues initial draft generation for many proposals; poll the returned batch for progress."""
+    proposal_ids = list(dict.fromkeys(request.proposal_ids))
+    if not proposal_ids:
+        raise HTTPException(status_code=400, detail="No proposal ids provided.")
+    if len(proposal_ids) > settings.DRAFT_BATCH_MAX_PROPOSALS:
+        raise HTTPException(status_code=400, detail=f"A batch can contain at most {settings.DRAFT_BATCH_MAX_PROPOSALS} proposals.")
+    logger.info("[DRAFT_BATCH] Request for %d proposals.", len(proposal_ids))
+
+    context = await load_batch_context(session, proposal_ids)
+    missing = [proposal_id for proposal_id in proposal_ids if proposal_id not in context.proposals]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Proposals not found: {missing}")
+
+    result = await session.exec(select(ProposalSection.proposal_id).where(ProposalSection.proposal_id.in_(proposal_ids)).distinct())
+    drafted = set(result.all())
+
+    batch = DraftBatch(jobs=[
+        DraftJob(proposal_id=proposal_id, status=JOB_SKIPPED if proposal_id in drafted else JOB_QUEUED)
+        for proposal_id in proposal_ids
+    ])
+    session.add(batch)
+    await session.commit()
+    await session.refresh(batch)
+
+    queued = [job.id for job in batch.jobs if job.status == JOB_QUEUED]
+    get_draft_pool().submit(queued, context)
+    logger.info("[DRAFT_BATCH] Batch %s queued %d jobs, skipped %d already drafted.", batch.id, len(queued), len(drafted))
+    return _batch_response(batch)
+
+@router.get("/initial_drafts/{batch_id}", response_model=DraftBatchResponse)
+async def read_initial_draft_batch(batch_id: int, session: AsyncSession = Depends(get_session)):
+    batch = await session.get(DraftBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if any(is_orphaned(job) for job in batch.jobs):
+        # Left behind by a process that stopped; their statuses change in recover_draft_jobs' session
+        await recover_draft_jobs(batch_id)
+        result = await session.exec(select(DraftBatch).where(DraftBatch.id == batch_id).execution_options(populate_existing=True))
+        batch = result.one()
+    return _batch_response(batch)
+
+async def _regenerate_text(messages: List[dict], rag_tool_schema: Optional[dict], model: str):
+    """Runs the tool loop on one model; returns the answer and its finish reason.
+
+    Without a tool schema (the context is already in the prompt) it is a single call.
+    """
+    governor = get_llm_governor()
+    tools = {"tools": [rag_tool_schema]} if rag_tool_schema else {}
+    for _ in range(3): # Max 3 turns
+        response = await governor.acompletion(model=model, messages=messages, **tools)
+        response_message = response.choices[0].message
+        messages.append(response_message)
+
+        if response_message.tool_calls:
+            for tool_call in response_message.tool_calls:
+                tool_args = json.loads(tool_call.function.arguments)
+                tool_result = await aquery_collections(**tool_args)
+                messages.append({"role": "tool", "content": tool_result, "tool_call_id": tool_call.id})
+            continue
+
+        return response_message.content, response.choices[0].finish_reason
+    return "", None
+
+async def _regenerate_routed(messages: List[dict], rag_tool_schema: Optional[dict], route: Route) -> str:
+    # Simplified loop for single-section regeneration; a user is waiting on it,
+    # so its model and embedding calls jump the queue
+    with llm_priority(Priority.INTERACTIVE):
+        while True:
+            with track_route(route) as attempt:
+                text, finish_reason = await _regenerate_text(list(messages), rag_tool_schema, route.model)
+                attempt.invalid = validate_section_html(text, finish_reason)
+            if attempt.invalid is None:
+                return text
+            next_route = route.escalate(attempt.invalid)
+            if next_route is None:
+                return text
+            logger.warning(f"[REGEN_SECTION] Output of {route.model} rejected ({attempt.invalid}); retrying with {next_route.model}.")
+            route = next_route
 
 @router.post("/section/{section_id}/regenerate", response_model=SectionVersion)
-async def regenerate_section(section_id: int, request: RegenerateSectionRequest, session: AsyncSession = Depends(get_session)):
+async def regenerate_section(section_id: int, request: RegenerateSectionRequest, http_request: Request, session: AsyncSession = Depends(get_session)):
     logger.info(f"[REGEN_SECTION] Request for section ID: {section_id}")
 
     proposal_section = await session.get(ProposalSection, section_id)
@@ -147,43 +252,32 @@ async def regenerate_section(section_id: int, request: RegenerateSectionRequest,
         {proposal_section.custom_prompt}
         """
 
-        rag_tool_schema = {
-            "type": "function",
-            "function": {
-                "name": "query_collections",
-                "description": "Queries one or more collections in the RAG database...",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string"},
-                        "collections": {"type": "array", "items": {"type": "string"}}
-                    },
-                    "required": ["query", "collections"]
-                }
-            }
-        }
-        
+        prefetched = None
+        if proposal_section.collection_mappings:
+            warm = await load_warm_context(session, [section_id])
+            prefetched = warm.context_for(proposal_section.collection_mappings)
+        if prefetched is not None:
+            logger.info(f"[REGEN_SECTION] Using prefetched knowledge base context for section {section_id}.")
+            prompt += f"""
+        Knowledge Base Context:
+        {prefetched}
+        """
+
         messages = [
-            {"role": "system", "content": regeneration_agent.instruction},
+            {"role": "system", "content": REGENERATION_INSTRUCTION},
             {"role": "user", "content": prompt},
         ]
 
-        full_response_text = ""
-        # Simplified loop for single-section regeneration
-        for _ in range(3): # Max 3 turns
-            response = await litellm.acompletion(model=settings.FINAL_GENERATION_MODEL, messages=messages, tools=[rag_tool_schema])
-            response_message = response.choices[0].message
-            messages.append(response_message)
-
-            if response_message.tool_calls:
-                for tool_call in response_message.tool_calls:
-                    tool_args = json.loads(tool_call.function.arguments)
-                    tool_result = query_collection_tool.func(**tool_args)
-                    messages.append({"role": "tool", "content": tool_result, "tool_call_id": tool_call.id})
-                continue
-            
-            full_response_text = response_message.content
-            break
+        route = choose_route(TASK_REGENERATE, count_tokens(request.source_content), proposal_section.custom_prompt)
+        logger.info(f"[REGEN_SECTION] Routing section {section_id} to {route.model} ({route.reason}).")
+
+        # A newer request for this section cancels this one's model and retrieval calls
+        # With prefetched context the model has nothing to retrieve, so the tool is not offered
+        schema = None if prefetched is not None else RAG_TOOL_SCHEMA
+        work = _regenerations.start(section_id, _regenerate_routed(messages, schema, route))
+        full_response_text = await cancel_on_disconnect(http_request, work)
+        if not _regenerations.is_latest(work):
+            raise Superseded()
         
         if not full_response_text:
             raise Exception("Regeneration Agent returned an empty response.")
@@ -201,18 +295,34 @@ async def regenerate_section(section_id: int, request: RegenerateSectionRequest,
             content=full_response_text
         )
         session.add(new_version)
+        await session.flush()
+        await index_versions(session, proposal_section.proposal_id, [(new_version.id, proposal_section.section_name, new_version.content)], new=True)
         await session.commit()
         await session.refresh(new_version)
+        invalidate_proposal(proposal_section.proposal_id)
 
         return new_version
 
+    except ClientDisconnected:
+        logger.info(f"[REGEN_SECTION] Client disconnected; regeneration of section {section_id} cancelled.")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed the request.")
+    except Superseded:
+        logger.info(f"[REGEN_SECTION] Regeneration of section {section_id} superseded by a newer request.")
+        raise HTTPException(status_code=409, detail="Superseded by a newer regeneration request for this section.")
     except Exception as e:
         logger.error(f"[REGEN_SECTION] An error occurred: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail="Failed to regenerate section.")
 
 
+def _run_failed(run_id: int) -> HTTPException:
+    return HTTPException(
+        status_code=500,
+        detail=f"Failed to generate final proposal. Resume it with POST /generation/final_proposal_runs/{run_id}/resume.",
+        headers={"X-Generation-Run-Id": str(run_id)},
+    )
+
 @router.post("/generate_final_proposal")
-async def generate_final_proposal(request: FinalProposalRequest, session: AsyncSession = Depends(get_session)):
+async def generate_final_proposal(request: FinalProposalRequest, http_request: Request, session: AsyncSession = Depends(get_session)):
     logger.info(f"[PROPOSAL_GEN] Final proposal generation request for proposal ID: {request.proposal_id}.")
     
     result = await session.exec(select(Proposal).options(selectinload(Proposal.proposal_sections)).where(Proposal.id == request.proposal_id))
@@ -221,82 +331,62 @@ async def generate_final_proposal(request: FinalProposalRequest, session: AsyncS
     if not proposal:
         raise HTTPException(status_code=404, detail="Proposal not found")
 
+    # Use the user-selected versions from the request body
+    initial_draft_dict = request.selected_versions
+    logger.info("[PROPOSAL_GEN] Using %d user-selected versions for generation.", len(initial_draft_dict), extra={"proposal_id": request.proposal_id})
+    log_payload(logger, logging.DEBUG, "[PROPOSAL_GEN] Selected versions: %s", initial_draft_dict, proposal_id=request.proposal_id)
+
+    plan = None
+    if settings.FINAL_INCREMENTAL:
+        plan = await plan_final_sections(session, proposal, initial_draft_dict)
+        if plan.fingerprints and not plan.stale:
+            logger.info("[PROPOSAL_GEN] No section changed since the last generation; reassembling.", extra={"proposal_id": request.proposal_id})
+            proposal.final_rfp_json = await store_and_assemble(session, proposal.id, {}, plan.fingerprints)
+            session.add(proposal)
+            await index_final(session, proposal.id, proposal.final_rfp_json)
+            await session.commit()
+            invalidate_proposal(proposal.id)
+            return {"rfp_content": proposal.final_rfp_json, "run_id": None, "regenerated_sections": []}
+        logger.info("[PROPOSAL_GEN] Regenerating %d of %d sections.", len(plan.stale), len(plan.fingerprints), extra={"proposal_id": request.proposal_id})
+
+    run = await start_run(session, proposal, initial_draft_dict, plan)
+    run_id = run.id
     try:
-        # Use the user-selected versions from the request body
-        initial_draft_dict = request.selected_versions
-        logger.info(f"[PROPOSAL_GEN] Using the following user-selected versions for generation: {json.dumps(initial_draft_dict, indent=2)}")
-        
-        mappings = [{
-            "section_name": section.section_name,
-            "collection_mappings": section.collection_mappings,
-            "custom_prompt": section.custom_prompt,
-        } for section in proposal.proposal_sections]
-
-        prompt = f"""
-        Proposal Name: {proposal.name}
-        Initial Draft (from user selected versions):
-        {json.dumps(initial_draft_dict, indent=2)}
-
-        Mappings:
-        {json.dumps(mappings, indent=2)}
-        """
-
-        rag_tool_schema = {
-            "type": "function",
-            "function": {
-                "name": "query_collections",
-                "description": "Queries one or more collections in the RAG database...",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string"},
-                        "collections": {"type": "array", "items": {"type": "string"}}
-                    },
-                    "required": ["query", "collections"]
-                }
-            }
-        }
-
-        messages = [
-            {"role": "system", "content": final_proposal_agent.instruction},
-            {"role": "user", "content": prompt},
-        ]
-
-        full_response_text = ""
-        for i in range(7):
-            response = await litellm.acompletion(model=settings.FINAL_GENERATION_MODEL, messages=messages, tools=[rag_tool_schema])
-            response_message = response.choices[0].message
-            messages.append(response_message)
-
-            if response_message.tool_calls:
-                for tool_call in response_message.tool_calls:
-                    tool_args = json.loads(tool_call.function.arguments)
-                    tool_result = query_collection_tool.func(**tool_args)
-                    messages.append({"role": "tool", "content": tool_result, "tool_call_id": tool_call.id})
-                continue
-            
-            full_response_text = response_message.content
-            break
-        else:
-            raise Exception("Agent exceeded maximum turns.")
-
-        if not full_response_text:
-            raise Exception("Agent returned an empty final response.")
-
-        match = re.search(r"```html\s*(.*?)\s*```", full_response_text, re.DOTALL)
-        final_html = match.group(1).strip() if match else full_response_text
-
-        body_match = re.search(r"<body.*?>(.*?)</body>", final_html, re.DOTALL)
-        if body_match:
-            final_html = body_match.group(1).strip()
+        final_html = await cancel_on_disconnect(http_request, advance_run(session, run))
+    except ClientDisconnected:
+        logger.info(f"[PROPOSAL_GEN] Client disconnected; run {run_id} stopped and can be resumed.")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed the request.")
+    except Exception as e:
+        logger.error(f"[PROPOSAL_GEN] Run {run_id} failed: {e}", exc_info=True)
+        raise _run_failed(run_id)
+
+    regenerated = list(plan.stale) if plan else [section.section_name for section in proposal.proposal_sections]
+    return {"rfp_content": final_html, "run_id": run_id, "regenerated_sections": regenerated}
+
+@router.post("/final_proposal_runs/{run_id}/resume")
+async def resume_final_proposal(run_id: int, http_request: Request, session: AsyncSession = Depends(get_session)):
+    """Continues a failed final proposal generation from its last checkpoint."""
+    run = await session.get(FinalGenerationRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Generation run not found")
+    try:
+        check_resumable(run)
+        logger.info(f"[PROPOSAL_GEN] Resuming run {run_id} after {run.turns} turns.")
+        final_html = await cancel_on_disconnect(http_request, advance_run(session, run))
+    except RunNotResumable as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except ClientDisconnected:
+        logger.info(f"[PROPOSAL_GEN] Client disconnected; run {run_id} stopped again.")
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed the request.")
+    except Exception as e:
+        logger.error(f"[PROPOSAL_GEN] Run {run_id} failed again: {e}", exc_info=True)
+        raise _run_failed(run_id)
 
-        final_html = re.sub(r'\s*style="[^"]*"', '', final_html)
+    return {"rfp_content": final_html, "run_id": run_id}
 
-        proposal.final_rfp_json = final_html
-        session.add(proposal)
-        await session.commit()
-        
-        return {"rfp_content": final_html}
-    except Exception as e:
-        logger.error(f"[PROPOSAL_GEN] An error occurred: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Failed to generate final proposal.")
\ No newline at end of file
+@router.get("/final_proposal_runs/{run_id}", response_model=FinalGenerationRunResponse)
+async def read_final_proposal_run(run_id: int, session: AsyncSession = Depends(get_session)):
+    run = await session.get(FinalGenerationRun, run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Generation run not found")
+    return run
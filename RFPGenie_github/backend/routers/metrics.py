@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from backend.database import pool_stats
+from backend.drafts import get_draft_pool, get_segment_cache
+from backend.llm import get_llm_governor
+from backend.prefetch import prefetch_metrics
+from backend.response_cache import cache_metrics
+from backend.routing import routing_metrics
+from backend.uploads import upload_metrics
+
+router = APIRouter(
+    prefix="/metrics",
+    tags=["metrics"],
+)
+
+@router.get("/")
+async def read_metrics():
+    """Runtime metrics: LLM queues and rate limits, latency and cost per model route, draft batch backlog, retrieval prefetch, response cache, upload rejections and database pool usage."""
+    cache = get_segment_cache()
+    return {
+        "llm": get_llm_governor().metrics(),
+        "routing": routing_metrics(),
+        "database": pool_stats(),
+        "draft_batches": {"queued_jobs": get_draft_pool().queue_depth()},
+        "draft_segment_cache": {"entries": len(cache), "hits": cache.hits, "misses": cache.misses},
+        "retrieval_prefetch": prefetch_metrics(),
+        "response_cache": cache_metrics(),
+        "uploads": upload_metrics(),
+    }
@@ -1,13 +1,16 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, Form
 from pydantic import BaseModel
-from sqlmodel import select
+from sqlmodel import delete, select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from backend.database import get_session
-from backend.models import Proposal, ProposalSection, Approval
-import shutil
+from backend.models import Proposal, ProposalSection, Approval, DraftJob, FinalGenerationRun, FinalSection, PrefetchedContext, SearchEntry
+from backend.prefetch import get_prefetcher
+from backend.response_cache import KIND_PROPOSAL, KIND_PROPOSAL_SECTIONS, cached_response, invalidate_proposal
+from backend.search import index_final, index_proposal
+from backend.storage import blob_uri, get_blob_store
+import asyncio
 import logging
-import uuid
 import os
 
 router = APIRouter(
@@ -17,6 +20,13 @@ router = APIRouter(
 
 logger = logging.getLogger(__name__)
 
+async def delete_proposal_records(session: AsyncSession, proposal_ids: List[int]) -> None:
+    """Deletes the generation bookkeeping and search entries that reference the proposals; not committed."""
+    if not proposal_ids:
+        return
+    for model in (FinalSection, FinalGenerationRun, DraftJob, PrefetchedContext, SearchEntry):
+        await session.exec(delete(model).where(model.proposal_id.in_(proposal_ids)))
+
 @router.post("/", response_model=Proposal)
 async def create_proposal(
     name: str = Form(...),
@@ -30,14 +40,11 @@ async def create_proposal(
     logger.info(f"Client: {client_name}, Template ID: {template_id}")
 
     _, extension = os.path.splitext(file.filename)
-    secure_filename = f"{uuid.uuid4()}{extension}"
-    file_path = f"backend/uploads/{secure_filename}"
-    logger.info(f"Generated secure filename: {secure_filename}")
 
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        logger.info(f"Successfully saved uploaded file to: {file_path}")
+        stored = await asyncio.to_thread(get_blob_store().put, file.file)
+        scope_document_ref = blob_uri(stored.key, extension)
+        logger.info(f"Stored scope document as {scope_document_ref} ({stored.size} bytes, new: {stored.created})")
     except Exception as e:
         logger.error(f"Error saving uploaded file: {e}")
         raise HTTPException(status_code=500, detail="Could not save file.")
@@ -47,11 +54,13 @@ async def create_proposal(
         description=description,
         client_name=client_name,
         template_id=template_id,
-        scope_document_path=file_path
+        scope_document_path=scope_document_ref
     )
     logger.info("Proposal object created. Adding to session.")
 
     session.add(proposal)
+    await session.flush()
+    await index_proposal(session, proposal)
     await session.commit()
     logger.info("Proposal committed to database.")
     await session.refresh(proposal)
@@ -68,17 +77,21 @@ async def read_proposals(session: AsyncSession = Depends(get_session)):
 from sqlalchemy.orm import selectinload
 
 @router.get("/{proposal_id}", response_model=Proposal)
-async def read_proposal(proposal_id: int, session: AsyncSession = Depends(get_session)):
+async def read_proposal(proposal_id: int, request: Request, session: AsyncSession = Depends(get_session)):
     logger.info(f"Fetching proposal {proposal_id}.")
-    result = await session.exec(
-        select(Proposal)
-        .options(selectinload(Proposal.proposal_sections).selectinload(ProposalSection.versions))
-        .where(Proposal.id == proposal_id)
-    )
-    proposal = result.first()
-    if not proposal:
-        raise HTTPException(status_code=404, detail="Proposal not found")
-    return proposal
+
+    async def load():
+        result = await session.exec(
+            select(Proposal)
+            .options(selectinload(Proposal.proposal_sections).selectinload(ProposalSection.versions))
+            .where(Proposal.id == proposal_id)
+        )
+        proposal = result.first()
+        if not proposal:
+            raise HTTPException(status_code=404, detail="Proposal not found")
+        return proposal
+
+    return await cached_response(request, (KIND_PROPOSAL, proposal_id), load, Proposal)
 
 @router.put("/{proposal_id}", response_model=Proposal)
 async def update_proposal(proposal_id: int, proposal: Proposal, session: AsyncSession = Depends(get_session)):
@@ -86,12 +99,17 @@ async def update_proposal(proposal_id: int, proposal: Proposal, session: AsyncSe
     db_proposal = await session.get(Proposal, proposal_id)
     if not db_proposal:
         raise HTTPException(status_code=404, detail="Proposal not found")
-    proposal_data = proposal.dict(exclude_unset=True)
+    # draft_rfp_json is computed from the sections and cannot be set
+    proposal_data = proposal.dict(exclude_unset=True, exclude={"draft_rfp_json"})
     for key, value in proposal_data.items():
         setattr(db_proposal, key, value)
     session.add(db_proposal)
+    await index_proposal(session, db_proposal)
+    if "final_rfp_json" in proposal_data:
+        await index_final(session, proposal_id, db_proposal.final_rfp_json)
     await session.commit()
     await session.refresh(db_proposal)
+    invalidate_proposal(proposal_id)
     logger.info(f"Proposal {proposal_id} updated successfully.")
     return db_proposal
 
@@ -101,8 +119,10 @@ async def delete_proposal(proposal_id: int, session: AsyncSession = Depends(get_
     proposal = await session.get(Proposal, proposal_id)
     if not proposal:
         raise HTTPException(status_code=404, detail="Proposal not found")
+    await delete_proposal_records(session, [proposal_id])
     await session.delete(proposal)
     await session.commit()
+    invalidate_proposal(proposal_id)
     logger.info(f"Proposal {proposal_id} deleted successfully.")
     return {"ok": True}
 
@@ -110,15 +130,40 @@ from backend.models import Proposal, ProposalSection, ProposalSectionResponse
 from sqlalchemy.orm import selectinload
 
 @router.get("/{proposal_id}/sections", response_model=List[ProposalSectionResponse])
-async def read_proposal_sections_with_versions(proposal_id: int, session: AsyncSession = Depends(get_session)):
+async def read_proposal_sections_with_versions(proposal_id: int, request: Request, session: AsyncSession = Depends(get_session)):
     logger.info(f"Fetching proposal sections with versions for proposal {proposal_id}.")
-    result = await session.exec(
-        select(ProposalSection)
-        .options(selectinload(ProposalSection.versions))
-        .where(ProposalSection.proposal_id == proposal_id)
-    )
-    sections = result.all()
-    return sections
+
+    async def load():
+        result = await session.exec(
+            select(ProposalSection)
+            .options(selectinload(ProposalSection.versions))
+            .where(ProposalSection.proposal_id == proposal_id)
+        )
+        return result.all()
+
+    return await cached_response(request, (KIND_PROPOSAL_SECTIONS, proposal_id), load, List[ProposalSectionResponse])
+
+class ProposalSectionUpdateRequest(BaseModel):
+    collection_mappings: Optional[List[str]] = None
+    custom_prompt: Optional[str] = None
+
+@router.put("/sections/{section_id}", response_model=ProposalSectionResponse)
+async def update_proposal_section(section_id: int, request: ProposalSectionUpdateRequest, session: AsyncSession = Depends(get_session)):
+    """Sets a section's knowledge base collections and custom prompt; its context is prefetched in the background."""
+    logger.info(f"Updating mappings of proposal section {section_id}.")
+    section = await session.get(ProposalSection, section_id)
+    if not section:
+        raise HTTPException(status_code=404, detail="ProposalSection not found")
+    if request.collection_mappings is not None:
+        section.collection_mappings = list(dict.fromkeys(request.collection_mappings))
+    if request.custom_prompt is not None:
+        section.custom_prompt = request.custom_prompt
+    session.add(section)
+    await session.commit()
+    await session.refresh(section)
+    invalidate_proposal(section.proposal_id)
+    get_prefetcher().submit([section.id])
+    return section
 
 # --- Approval Endpoints ---
 class ApprovalCreateRequest(BaseModel):
@@ -0,0 +1,29 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel.ext.asyncio.session import AsyncSession
+from backend.database import get_session
+from backend.models import SearchResponse
+from backend.search import KINDS, search
+import logging
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"],
+)
+
+logger = logging.getLogger(__name__)
+
+@router.get("/", response_model=SearchResponse)
+async def search_proposals(
+    q: str = Query(..., min_length=1, max_length=500),
+    kind: Optional[str] = Query(None, description="proposal, version or final"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_session),
+):
+    """Searches proposal names, clients and descriptions, section versions and final documents; best matches first."""
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=400, detail=f"Unknown kind: {kind}")
+    total, results = await search(session, q, limit=limit, offset=offset, kind=kind)
+    logger.info("Search for %r matched %d entries.", q, total)
+    return SearchResponse(query=q, total=total, limit=limit, offset=offset, results=results)
@@ -1,9 +1,10 @@
 from typing import List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from backend.database import get_session
 from backend.models import Section
+from backend.response_cache import KIND_SECTIONS, cached_response, get_response_cache
 
 router = APIRouter(
     prefix="/sections",
@@ -11,14 +12,17 @@ router = APIRouter(
 )
 
 @router.get("/", response_model=List[Section])
-async def read_sections(session: AsyncSession = Depends(get_session)):
-    result = await session.exec(select(Section))
-    sections = result.all()
-    return sections
+async def read_sections(request: Request, session: AsyncSession = Depends(get_session)):
+    async def load():
+        result = await session.exec(select(Section))
+        return result.all()
+
+    return await cached_response(request, (KIND_SECTIONS,), load, List[Section])
 
 @router.post("/", response_model=Section)
 async def create_section(section: Section, session: AsyncSession = Depends(get_session)):
     session.add(section)
     await session.commit()
     await session.refresh(section)
+    get_response_cache().invalidate((KIND_SECTIONS,))
     return section
@@ -1,9 +1,11 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import select
 from sqlmodel.ext.asyncio.session import AsyncSession
 from backend.database import get_session
 from backend.models import Template, Proposal
+from backend.response_cache import KIND_PROPOSAL, KIND_PROPOSAL_SECTIONS, KIND_TEMPLATES, cached_response, get_response_cache
+from backend.routers.proposals import delete_proposal_records
 import logging
 
 router = APIRouter(
@@ -19,15 +21,19 @@ async def create_template(template: Template, session: AsyncSession = Depends(ge
     session.add(template)
     await session.commit()
     await session.refresh(template)
+    get_response_cache().invalidate((KIND_TEMPLATES,))
     logger.info(f"Template {template.name} created successfully.")
     return template
 
 @router.get("/", response_model=List[Template])
-async def read_templates(session: AsyncSession = Depends(get_session)):
+async def read_templates(request: Request, session: AsyncSession = Depends(get_session)):
     logger.info(f"Fetching templates.")
-    result = await session.exec(select(Template))
-    templates = result.all()
-    return templates
+
+    async def load():
+        result = await session.exec(select(Template))
+        return result.all()
+
+    return await cached_response(request, (KIND_TEMPLATES,), load, List[Template])
 
 @router.get("/{template_id}", response_model=Template)
 async def read_template(template_id: int, session: AsyncSession = Depends(get_session)):
@@ -49,6 +55,7 @@ async def update_template(template_id: int, template: Template, session: AsyncSe
     session.add(db_template)
     await session.commit()
     await session.refresh(db_template)
+    get_response_cache().invalidate((KIND_TEMPLATES,))
     logger.info(f"Template {template_id} updated successfully.")
     return db_template
 
@@ -71,7 +78,14 @@ async def delete_template(template_id: int, session: AsyncSession = Depends(get_
             detail=f"Template cannot be deleted as proposal(s) '{proposal_names}' are in a draft state and are using this template.",
         )
 
+    # The ORM cascade deletes the proposals, but not the rows that reference them
+    await delete_proposal_records(session, [p.id for p in proposals])
     await session.delete(template)
     await session.commit()
+    # The template's proposals are deleted with it
+    cache = get_response_cache()
+    cache.invalidate((KIND_TEMPLATES,))
+    cache.invalidate_kind(KIND_PROPOSAL)
+    cache.invalidate_kind(KIND_PROPOSAL_SECTIONS)
     logger.info(f"Template {template_id} deleted successfully.")
     return {"ok": True}
\ No newline at end of file
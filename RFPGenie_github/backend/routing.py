@@ -0,0 +1,163 @@
+"""Picks the model for each generation task.
+
+Every task has a ladder of models, cheapest and fastest first (``MODEL_ROUTES``
+overrides the defaults below). A call starts on the first rung when the task's
+input is small and the custom prompt asks for a light edit ("shorten", "make it
+formal"), and on the second rung otherwise. When the output fails validation
+(empty, cut off, not in the expected format) the call is retried one rung up.
+
+Latency, tokens and cost of every attempt are recorded per task and model and
+reported by ``GET /metrics/``.
+"""
+import contextlib
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from .config import settings
+from .llm import Usage, track_usage
+
+TASK_REGENERATE = "regenerate"
+TASK_INITIAL_DRAFT = "initial_draft"
+TASK_FINAL_PROPOSAL = "final_proposal"
+
+# Custom prompt words that ask for new material or restructuring rather than a light edit
+HEAVY_PROMPT_WORDS = {
+    "expand", "elaborate", "detail", "detailed", "comprehensive", "add", "include", "research",
+    "compare", "comparison", "analyse", "analyze", "table", "technical", "architecture", "restructure", "rewrite",
+}
+# Recent attempts kept per route for the latency percentiles
+LATENCY_WINDOW = 500
+
+
+def model_ladder(task: str) -> List[str]:
+    override = settings.MODEL_ROUTES.get(task)
+    if override:
+        return list(override)
+    defaults = {
+        TASK_REGENERATE: [settings.ROUTING_FAST_MODEL, settings.FINAL_GENERATION_MODEL],
+        TASK_INITIAL_DRAFT: [settings.INITIAL_DRAFT_MODEL],
+        TASK_FINAL_PROPOSAL: [settings.FINAL_GENERATION_MODEL],
+    }
+    ladder = defaults[task]
+    # Drop duplicates, e.g. when FINAL_GENERATION_MODEL is the fast model
+    return list(dict.fromkeys(ladder))
+
+
+def prompt_complexity(custom_prompt: str) -> int:
+    """0 for no prompt or a short light edit; one point per heavy word and per 40 words."""
+    words = re.findall(r"[a-z]+", (custom_prompt or "").lower())
+    return sum(word in HEAVY_PROMPT_WORDS for word in words) + len(words) // 40
+
+
+@dataclass(frozen=True)
+class Route:
+    task: str
+    models: Tuple[str, ...]
+    tier: int
+    reason: str
+
+    @property
+    def model(self) -> str:
+        return self.models[self.tier]
+
+    def escalate(self, reason: str) -> Optional["Route"]:
+        """The next model up the ladder, or None when this is the strongest."""
+        if self.tier + 1 >= len(self.models):
+            return None
+        return Route(self.task, self.models, self.tier + 1, f"escalated: {reason}")
+
+
+def choose_route(task: str, input_tokens: int, custom_prompt: str = "") -> Route:
+    models = tuple(model_ladder(task))
+    complexity = prompt_complexity(custom_prompt)
+    if input_tokens <= settings.ROUTING_SMALL_INPUT_TOKENS and complexity <= settings.ROUTING_MAX_LIGHT_COMPLEXITY:
+        return Route(task, models, 0, "small input")
+    reason = "large input" if input_tokens > settings.ROUTING_SMALL_INPUT_TOKENS else "complex prompt"
+    return Route(task, models, min(1, len(models) - 1), reason)
+
+
+def validate_section_html(text: Optional[str], finish_reason: Optional[str]) -> Optional[str]:
+    """Why a regenerated section is unusable, or None."""
+    if not text or not text.strip():
+        return "empty output"
+    if finish_reason == "length":
+        return "output cut off"
+    if not re.search(r"<(p|ul|ol|li|h[1-6]|table|strong|div)\b", text, re.IGNORECASE):
+        return "not HTML"
+    if re.search(r"<(html|body)\b", text, re.IGNORECASE):
+        return "full HTML document"
+    return None
+
+
+@dataclass
+class RouteStats:
+    attempts: int = 0
+    errors: int = 0
+    invalid: int = 0
+    escalations: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def metrics(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 3) if ordered else None
+
+        return {
+            "attempts": self.attempts,
+            "errors": self.errors,
+            "invalid": self.invalid,
+            "escalations": self.escalations,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost, 6),
+            "cost_per_attempt_usd": round(self.cost / self.attempts, 6) if self.attempts else None,
+        }
+
+
+_stats: Dict[Tuple[str, str], RouteStats] = {}
+
+
+@dataclass
+class Attempt:
+    route: Route
+    usage: Usage
+    invalid: Optional[str] = None  # set by the caller when the output fails validation
+
+
+@contextlib.contextmanager
+def track_route(route: Route):
+    """Records latency, tokens, cost and outcome of one attempt on a route."""
+    stats = _stats.setdefault((route.task, route.model), RouteStats())
+    start = time.perf_counter()
+    with track_usage() as usage:
+        attempt = Attempt(route, usage)
+        try:
+            yield attempt
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            stats.attempts += 1
+            stats.latencies.append(time.perf_counter() - start)
+            stats.prompt_tokens += usage.prompt_tokens
+            stats.completion_tokens += usage.completion_tokens
+            stats.cost += usage.cost
+            if route.tier > 0 and route.reason.startswith("escalated"):
+                stats.escalations += 1
+    if attempt.invalid:
+        stats.invalid += 1
+
+
+def routing_metrics() -> Dict[str, Dict[str, Any]]:
+    metrics: Dict[str, Dict[str, Any]] = {}
+    for (task, model), stats in _stats.items():
+        metrics.setdefault(task, {})[model] = stats.metrics()
+    return metrics
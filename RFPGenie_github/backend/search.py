@@ -0,0 +1,204 @@
+"""Full-text search over proposals, their section versions and final documents.
+
+Every searchable text is kept as plain text in a ``SearchEntry`` row. There is
+one row for each proposal (its name, client and description), one for each
+section version and one for each final document. The handlers that write
+these texts update the rows in the same transaction, so search never lags
+behind an edit.
+
+On PostgreSQL, ``python -m backend.migrate`` adds a generated ``tsvector``
+column with a GIN index, built from the title (weighted above the text) and
+the text in ``SEARCH_LANGUAGE``. Queries use ``websearch_to_tsquery`` syntax
+(``"exact phrase"``, ``or``, ``-excluded``). Matches are ranked with
+``ts_rank_cd`` and excerpted with ``ts_headline``, and only the requested page
+is excerpted. Other databases (SQLite in tests and local development) are
+matched by word prefix and ranked by term frequency in Python.
+"""
+import datetime
+import html
+import logging
+import math
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import or_, text
+from sqlalchemy.orm import selectinload
+from sqlmodel import insert, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from .config import settings
+from .models import Proposal, ProposalSection, SearchEntry
+
+logger = logging.getLogger(__name__)
+
+KIND_PROPOSAL = "proposal"
+KIND_VERSION = "version"
+KIND_FINAL = "final"
+KINDS = (KIND_PROPOSAL, KIND_VERSION, KIND_FINAL)
+
+_TAG = re.compile(r"<[^>]+>")
+_WORD = re.compile(r"\w+")
+# Delimit matches in an excerpt until it is HTML-escaped
+_START, _STOP = "\x02", "\x03"
+EXCERPT_WORDS = 30
+
+
+def html_to_text(content: Optional[str]) -> str:
+    return " ".join(html.unescape(_TAG.sub(" ", content or "")).split())
+
+
+def _entry(proposal_id: int, kind: str, ref_id: int, title: str, content: str) -> Dict[str, Any]:
+    return {"proposal_id": proposal_id, "kind": kind, "ref_id": ref_id, "title": title, "text": html_to_text(content)}
+
+
+async def _upsert(session: AsyncSession, entries: List[Dict[str, Any]], new: bool = False) -> None:
+    """Adds entries, replacing any with the same kind and reference; committed with the caller's write."""
+    now = datetime.datetime.utcnow()
+    if new:
+        # One executemany however many entries, e.g. for every section of a draft
+        await session.exec(insert(SearchEntry), params=[{**entry, "updated_at": now} for entry in entries])
+        return
+    existing: Dict[Tuple[str, int], SearchEntry] = {}
+    for kind in {entry["kind"] for entry in entries}:
+        refs = [entry["ref_id"] for entry in entries if entry["kind"] == kind]
+        result = await session.exec(select(SearchEntry).where(SearchEntry.kind == kind, SearchEntry.ref_id.in_(refs)))
+        existing.update({(row.kind, row.ref_id): row for row in result.all()})
+    for entry in entries:
+        row = existing.get((entry["kind"], entry["ref_id"]))
+        if row is None:
+            session.add(SearchEntry(**entry, updated_at=now))
+        else:
+            row.title, row.text, row.updated_at = entry["title"], entry["text"], now
+            session.add(row)
+
+
+async def index_proposal(session: AsyncSession, proposal: Proposal) -> None:
+    """Indexes a proposal's name, client and description; the proposal must have an id (flush first)."""
+    await _upsert(session, [_entry(proposal.id, KIND_PROPOSAL, proposal.id, proposal.name, f"{proposal.client_name}\n{proposal.description}")])
+
+
+async def index_versions(session: AsyncSession, proposal_id: int, versions: Iterable[Tuple[int, str, str]], new: bool = False) -> None:
+    """Indexes section versions given as (version id, section name, content); ``new`` skips the lookup of existing entries."""
+    entries = [_entry(proposal_id, KIND_VERSION, version_id, section_name, content) for version_id, section_name, content in versions]
+    if entries:
+        await _upsert(session, entries, new=new)
+
+
+async def index_final(session: AsyncSession, proposal_id: int, final_html: Optional[str]) -> None:
+    await _upsert(session, [_entry(proposal_id, KIND_FINAL, proposal_id, "Final proposal", final_html)])
+
+
+async def backfill_search_index(session: AsyncSession) -> int:
+    """Indexes proposals that have no entries yet, e.g. ones created before search existed; returns their number."""
+    indexed = select(SearchEntry.ref_id).where(SearchEntry.kind == KIND_PROPOSAL)
+    result = await session.exec(
+        select(Proposal)
+        .options(selectinload(Proposal.proposal_sections).selectinload(ProposalSection.versions))
+        .where(Proposal.id.not_in(indexed))
+    )
+    proposals = result.all()
+    for proposal in proposals:
+        await index_proposal(session, proposal)
+        await index_versions(session, proposal.id, [
+            (version.id, section.section_name, version.content)
+            for section in proposal.proposal_sections for version in section.versions
+        ])
+        if proposal.final_rfp_json:
+            await index_final(session, proposal.id, proposal.final_rfp_json)
+    await session.commit()
+    return len(proposals)
+
+
+def postgres_statements() -> List[str]:
+    """DDL of the generated tsvector column and its GIN index."""
+    language = settings.SEARCH_LANGUAGE.replace("'", "")
+    return [
+        "alter table searchentry add column if not exists search_vector tsvector generated always as ("
+        f"setweight(to_tsvector('{language}', coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{language}', coalesce(text, '')), 'B')) stored",
+        "create index if not exists ix_searchentry_search_vector on searchentry using gin (search_vector)",
+    ]
+
+
+def _render(excerpt: str) -> str:
+    return html.escape(excerpt).replace(_START, "<mark>").replace(_STOP, "</mark>")
+
+
+def _result(entry: Any, proposal_name: str, client_name: str, rank: float, excerpt: str) -> Dict[str, Any]:
+    is_version = entry.kind == KIND_VERSION
+    return {
+        "proposal_id": entry.proposal_id,
+        "proposal_name": proposal_name,
+        "client_name": client_name,
+        "kind": entry.kind,
+        "section_name": entry.title if is_version else None,
+        "section_version_id": entry.ref_id if is_version else None,
+        "rank": rank,
+        "highlight": _render(excerpt),
+        "updated_at": entry.updated_at,
+    }
+
+
+_POSTGRES_SEARCH = text("""
+    with query as (select websearch_to_tsquery(cast(:language as regconfig), :q) as q),
+    matches as (
+        select e.id, e.proposal_id, e.kind, e.ref_id, e.title, e.text, e.updated_at,
+               ts_rank_cd(e.search_vector, query.q, 32) as rank, count(*) over () as total
+        from searchentry e, query
+        where e.search_vector @@ query.q and (cast(:kind as text) is null or e.kind = :kind)
+        order by rank desc, e.updated_at desc, e.id
+        limit :limit offset :offset
+    )
+    select m.*, p.name as proposal_name, p.client_name,
+           ts_headline(cast(:language as regconfig), m.text, query.q, :options) as excerpt
+    from matches m join proposal p on p.id = m.proposal_id, query
+    order by m.rank desc, m.updated_at desc, m.id
+""")
+
+
+async def _search_postgres(session: AsyncSession, query: str, limit: int, offset: int, kind: Optional[str]) -> Tuple[int, List[Dict[str, Any]]]:
+    options = f'StartSel={_START}, StopSel={_STOP}, MaxWords={EXCERPT_WORDS}, MinWords=10, MaxFragments=2, FragmentDelimiter=" … "'
+    result = await session.exec(_POSTGRES_SEARCH, params={
+        "language": settings.SEARCH_LANGUAGE, "q": query, "kind": kind, "limit": limit, "offset": offset, "options": options,
+    })
+    rows = result.all()
+    total = rows[0].total if rows else 0
+    return total, [_result(row, row.proposal_name, row.client_name, float(row.rank), row.excerpt) for row in rows]
+
+
+def _excerpt(words: List[str], terms: List[str]) -> str:
+    matches = {i for i, word in enumerate(words) if any(w.startswith(t) for w in _WORD.findall(word.lower()) for t in terms)}
+    start = max(0, min(matches, default=0) - EXCERPT_WORDS // 3)
+    window = words[start:start + EXCERPT_WORDS]
+    marked = [f"{_START}{word}{_STOP}" if start + i in matches else word for i, word in enumerate(window)]
+    return ("… " if start else "") + " ".join(marked) + (" …" if start + EXCERPT_WORDS < len(words) else "")
+
+
+async def _search_scan(session: AsyncSession, query: str, limit: int, offset: int, kind: Optional[str]) -> Tuple[int, List[Dict[str, Any]]]:
+    terms = list(dict.fromkeys(word.lower() for word in _WORD.findall(query)))
+    if not terms:
+        return 0, []
+    statement = select(SearchEntry, Proposal.name, Proposal.client_name).join(Proposal, Proposal.id == SearchEntry.proposal_id)
+    for term in terms:
+        statement = statement.where(or_(SearchEntry.title.ilike(f"%{term}%"), SearchEntry.text.ilike(f"%{term}%")))
+    if kind is not None:
+        statement = statement.where(SearchEntry.kind == kind)
+
+    scored = []
+    for entry, proposal_name, client_name in (await session.exec(statement)).all():
+        title_words = [word.lower() for word in _WORD.findall(entry.title)]
+        words = [word.lower() for word in _WORD.findall(entry.text)]
+        counts = [2 * sum(w.startswith(t) for w in title_words) + sum(w.startswith(t) for w in words) for t in terms]
+        # Every term must start a word; the substring filter above also matched inside words
+        if all(counts):
+            scored.append((sum(counts) / (1 + math.log1p(len(words))), entry, proposal_name, client_name))
+    scored.sort(key=lambda item: (-item[0], -item[1].updated_at.timestamp(), item[1].id))
+    return len(scored), [
+        _result(entry, proposal_name, client_name, round(rank, 4), _excerpt(entry.text.split(), terms))
+        for rank, entry, proposal_name, client_name in scored[offset:offset + limit]
+    ]
+
+
+async def search(session: AsyncSession, query: str, limit: int = 20, offset: int = 0, kind: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+    """The total number of matches and one page of them, best first."""
+    if session.bind.dialect.name == "postgresql":
+        return await _search_postgres(session, query, limit, offset, kind)
+    return await _search_scan(session, query, limit, offset, kind)
@@ -0,0 +1,430 @@
+"""Columnar snapshots of the knowledge base for backup, migration and fast local retrieval.
+
+Export writes the ``documents`` table to a directory, one collection after
+another, so each collection is a contiguous range of rows::
+
+    python -m backend.snapshots export ./kb-snapshot [--dtype int8]
+    python -m backend.snapshots import ./kb-snapshot [--copy]
+
+The directory holds:
+
+* ``manifest.json``: row count, dimensions, dtype, and per collection its row
+  range and embedding model.
+* ``embeddings.npy``: the rows x dimensions matrix, float32, or int8 with a
+  per-row scale in ``scales.npy`` (a quarter of the size, for local search).
+* ``norms.npy``: the L2 norm of every original embedding.
+* ``rows.jsonl`` and ``offsets.npy``: id, content and metadata of every row,
+  and the byte offset of each line, so single rows are read without parsing
+  the rest.
+
+The ``.npy`` files are plain NumPy arrays (``numpy.load(..., mmap_mode="r")``)
+but are written and read without NumPy too. Import inserts the rows in batches
+of ``SNAPSHOT_BATCH_SIZE`` through Supabase, or with ``--copy`` streams them
+through ``COPY`` over ``SUPABASE_RAG_DB_URL``; the embeddings are not
+recomputed. int8 snapshots are imported with their quantization error.
+
+With ``RAG_LOCAL_SNAPSHOT`` set, knowledge base queries are answered by
+:class:`LocalVectorIndex` from the memory-mapped snapshot instead of the
+``match_documents`` RPC. Opening it reads only the manifest; pages of the
+matrix are loaded by the OS as they are searched. The snapshot is static:
+uploads made afterwards appear after the next export.
+"""
+import argparse
+import ast
+import asyncio
+import contextlib
+import csv
+import datetime
+import functools
+import io
+import json
+import logging
+import math
+import mmap
+import os
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+from .config import settings
+from .database import get_supabase_rag
+from .embeddings import LEGACY_EMBEDDING_MODEL, EmbeddingModelMismatch
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """NumPy when installed; imported on first use to keep app startup light."""
+    try:
+        import numpy
+    except ImportError:  # optional; searches fall back to pure Python
+        return None
+    return numpy
+
+FORMAT_VERSION = 1
+DTYPES = {"float32": ("<f4", "f"), "int8": ("|i1", "b"), "int64": ("<i8", "q")}
+EMBEDDING_DTYPES = ("float32", "int8")
+# Bytes reserved for an .npy header, so the shape can be filled in once the row count is known
+_NPY_HEADER_BYTES = 128
+_NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(descr: str, shape: Tuple[int, ...]) -> bytes:
+    header = repr({"descr": descr, "fortran_order": False, "shape": shape}).encode("latin-1")
+    padding = _NPY_HEADER_BYTES - len(_NPY_MAGIC) - 2 - len(header) - 1
+    return _NPY_MAGIC + (_NPY_HEADER_BYTES - len(_NPY_MAGIC) - 2).to_bytes(2, "little") + header + b" " * padding + b"\n"
+
+
+class _NpyWriter:
+    """Appends rows to an .npy file; the header is written with the final shape on close."""
+
+    def __init__(self, path: Path, dtype: str, width: Optional[int] = None):
+        self.descr, self.typecode = DTYPES[dtype]
+        self.width = width
+        self.rows = 0
+        self._file: BinaryIO = open(path, "wb")
+        self._file.write(b"\0" * _NPY_HEADER_BYTES)
+
+    def append(self, values: List[Any]) -> None:
+        data = array(self.typecode, values)
+        if sys.byteorder == "big":
+            data.byteswap()
+        self._file.write(data.tobytes())
+        self.rows += 1 if self.width is not None else len(values)
+
+    def close(self) -> None:
+        shape = (self.rows, self.width) if self.width is not None else (self.rows,)
+        self._file.seek(0)
+        self._file.write(_npy_header(self.descr, shape))
+        self._file.close()
+
+
+def _open_npy(path: Path) -> Tuple[Any, Tuple[int, ...]]:
+    """Memory-maps an .npy file: a NumPy array when NumPy is installed, else a flat memoryview."""
+    with open(path, "rb") as f:
+        prefix = f.read(10)
+        if prefix[:6] != _NPY_MAGIC[:6]:
+            raise ValueError(f"{path} is not an .npy file.")
+        header = ast.literal_eval(f.read(int.from_bytes(prefix[8:10], "little")).decode("latin-1"))
+        offset = 10 + int.from_bytes(prefix[8:10], "little")
+    shape = tuple(header["shape"])
+    typecode = {descr: code for descr, code in DTYPES.values()}[header["descr"]]
+    size = math.prod(shape)
+    numpy = _numpy()
+    if numpy is not None:
+        # An empty array cannot be memory-mapped
+        return (numpy.load(path, mmap_mode="r") if size else numpy.zeros(shape, dtype=header["descr"])), shape
+    if sys.byteorder == "big" and header["descr"].startswith("<"):
+        raise ValueError("Reading snapshots on big-endian machines needs NumPy.")
+    if size == 0:
+        return memoryview(array(typecode)), shape
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[offset:offset + size * array(typecode).itemsize].cast(typecode), shape
+
+
+def _parse_embedding(value: Any) -> List[float]:
+    # PostgREST returns pgvector columns as their text form, e.g. "[0.1,0.2]"
+    return json.loads(value) if isinstance(value, str) else list(value)
+
+
+def _quantize(vector: List[float]) -> Tuple[List[int], float]:
+    scale = max((abs(x) for x in vector), default=0.0) / 127 or 1.0
+    return [round(x / scale) for x in vector], scale
+
+
+def _fetch_collection(collection: str, page_size: int) -> Iterator[Dict[str, Any]]:
+    last_id = 0
+    while True:
+        page = (
+            get_supabase_rag().table('documents').select('id,collection,content,metadata,embedding')
+            .eq('collection', collection).gt('id', last_id).order('id').limit(page_size).execute()
+        ).data
+        yield from page
+        if len(page) < page_size:
+            return
+        last_id = page[-1]['id']
+
+
+def _collections() -> List[str]:
+    """Distinct collection names, one query per name.
+
+    A plain select of the column would be cut off at PostgREST's max-rows; each
+    query here asks for the first name after the previous one, which the
+    collection index answers without reading the rows in between.
+    """
+    names: List[str] = []
+    while True:
+        query = get_supabase_rag().table('documents').select('collection')
+        if names:
+            query = query.gt('collection', names[-1])
+        page = query.order('collection').limit(1).execute().data
+        if not page or page[0]['collection'] is None:
+            return names
+        names.append(page[0]['collection'])
+
+
+def export_snapshot(path: str, dtype: str = "float32", collections: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Writes the knowledge base, or some of its collections, to a snapshot directory and returns the manifest."""
+    if dtype not in EMBEDDING_DTYPES:
+        raise ValueError(f"Unknown snapshot dtype: {dtype}")
+    if collections is None:
+        collections = _collections()
+    directory = Path(path)
+    directory.mkdir(parents=True, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(directory / "manifest.json")
+
+    dimensions: Optional[int] = None
+    matrix: Optional[_NpyWriter] = None
+    norms = _NpyWriter(directory / "norms.npy", "float32")
+    scales = _NpyWriter(directory / "scales.npy", "float32") if dtype == "int8" else None
+    offsets = _NpyWriter(directory / "offsets.npy", "int64")
+    manifest_collections: Dict[str, Dict[str, Any]] = {}
+    position = 0
+    with open(directory / "rows.jsonl", "wb") as rows_file:
+        for collection in collections:
+            start = norms.rows
+            model = None
+            for row in _fetch_collection(collection, settings.SNAPSHOT_BATCH_SIZE):
+                embedding = _parse_embedding(row['embedding'])
+                if matrix is None:
+                    dimensions = len(embedding)
+                    matrix = _NpyWriter(directory / "embeddings.npy", dtype, width=dimensions)
+                elif len(embedding) != dimensions:
+                    raise ValueError(f"Row {row['id']} has {len(embedding)} dimensions, expected {dimensions}.")
+                if scales is not None:
+                    quantized, scale = _quantize(embedding)
+                    matrix.append(quantized)
+                    scales.append([scale])
+                else:
+                    matrix.append(embedding)
+                norms.append([math.sqrt(sum(x * x for x in embedding))])
+                metadata = row.get('metadata') or {}
+                model = model or metadata.get('embedding_model', LEGACY_EMBEDDING_MODEL)
+                offsets.append([position])
+                line = json.dumps({"id": row['id'], "content": row['content'], "metadata": metadata}).encode("utf-8") + b"\n"
+                rows_file.write(line)
+                position += len(line)
+            if norms.rows > start:
+                manifest_collections[collection] = {"start": start, "end": norms.rows, "embedding_model": model}
+    offsets.append([position])
+
+    if matrix is None:
+        dimensions = settings.RAG_EMBEDDING_DIMENSIONS
+        matrix = _NpyWriter(directory / "embeddings.npy", dtype, width=dimensions)
+    for writer in (matrix, norms, offsets) + ((scales,) if scales is not None else ()):
+        writer.close()
+    if scales is None:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(directory / "scales.npy")
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "rows": norms.rows,
+        "dimensions": dimensions,
+        "dtype": dtype,
+        "collections": manifest_collections,
+    }
+    # Written last: a directory without a manifest is an incomplete export
+    with open(directory / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info("Exported %d rows from %d collections to %s (%s).", manifest["rows"], len(manifest_collections), path, dtype)
+    return manifest
+
+
+class SnapshotReader:
+    """Memory-mapped view of a snapshot directory; nothing but the manifest is read up front."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        with open(self.path / "manifest.json") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot format: {self.manifest.get('format')}")
+        self.dimensions: int = self.manifest["dimensions"]
+        self.dtype: str = self.manifest["dtype"]
+        self.collections: Dict[str, Dict[str, Any]] = self.manifest["collections"]
+        self.matrix, _ = _open_npy(self.path / "embeddings.npy")
+        self.norms, _ = _open_npy(self.path / "norms.npy")
+        self.offsets, _ = _open_npy(self.path / "offsets.npy")
+        self.scales = _open_npy(self.path / "scales.npy")[0] if self.dtype == "int8" else None
+        self._rows_file = open(self.path / "rows.jsonl", "rb")
+        self._rows = mmap.mmap(self._rows_file.fileno(), 0, access=mmap.ACCESS_READ) if self.manifest["rows"] else b""
+
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+
+    def close(self) -> None:
+        self._rows_file.close()
+
+    def embedding(self, index: int) -> List[float]:
+        if _numpy() is not None:
+            vector = self.matrix[index].astype("float32")
+            return (vector * self.scales[index] if self.scales is not None else vector).tolist()
+        values = self.matrix[index * self.dimensions:(index + 1) * self.dimensions]
+        if self.scales is None:
+            return list(values)
+        return [x * self.scales[index] for x in values]
+
+    def row(self, index: int) -> Dict[str, Any]:
+        """Id, collection, content and metadata of one row."""
+        record = json.loads(self._rows[int(self.offsets[index]):int(self.offsets[index + 1])])
+        record["collection"] = next(name for name, span in self.collections.items() if span["start"] <= index < span["end"])
+        return record
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        for collection, span in self.collections.items():
+            for index in range(span["start"], span["end"]):
+                record = json.loads(self._rows[int(self.offsets[index]):int(self.offsets[index + 1])])
+                yield {"collection": collection, **record, "embedding": self.embedding(index)}
+
+
+class LocalVectorIndex(SnapshotReader):
+    """Exact cosine search over a snapshot, returning rows shaped like ``match_documents``."""
+
+    def check_models(self, collections: List[str], model_id: str) -> None:
+        mismatched = {
+            c: self.collections[c]["embedding_model"]
+            for c in collections if c in self.collections and self.collections[c]["embedding_model"] != model_id
+        }
+        if mismatched:
+            raise EmbeddingModelMismatch(mismatched, model_id)
+
+    def _scores(self, start: int, end: int, query: List[float]) -> List[Tuple[float, int]]:
+        numpy = _numpy()
+        if numpy is not None:
+            vectors = self.matrix[start:end].astype("float32")
+            dots = vectors @ numpy.asarray(query, dtype="float32")
+            if self.scales is not None:
+                dots = dots * self.scales[start:end]
+            return list(zip(dots.tolist(), range(start, end)))
+        scores = []
+        for index in range(start, end):
+            values = self.matrix[index * self.dimensions:(index + 1) * self.dimensions]
+            dot = sum(x * q for x, q in zip(values, query))
+            scores.append((dot * self.scales[index] if self.scales is not None else dot, index))
+        return scores
+
+    def search(self, query_embedding: List[float], collections: List[str], match_count: int, match_threshold: float) -> List[Dict[str, Any]]:
+        if len(query_embedding) != self.dimensions:
+            raise ValueError(f"Query has {len(query_embedding)} dimensions, the snapshot {self.dimensions}.")
+        query_norm = math.sqrt(sum(x * x for x in query_embedding)) or 1.0
+        scored = []
+        for collection in collections:
+            span = self.collections.get(collection)
+            if span is not None:
+                scored.extend(self._scores(span["start"], span["end"], query_embedding))
+        similarities = [(dot / (float(self.norms[index]) * query_norm or 1.0), index) for dot, index in scored]
+        # Like match_documents: nearest match_count first, then the threshold
+        nearest = sorted(similarities, key=lambda pair: -pair[0])[:match_count]
+        return [{**self.row(index), "similarity": similarity} for similarity, index in nearest if similarity > match_threshold]
+
+
+_local_index: Optional[LocalVectorIndex] = None
+
+
+def get_local_index() -> Optional[LocalVectorIndex]:
+    """The index over ``RAG_LOCAL_SNAPSHOT``, opened on first use; None when it is not set."""
+    global _local_index
+    if not settings.RAG_LOCAL_SNAPSHOT:
+        return None
+    if _local_index is None:
+        _local_index = LocalVectorIndex(settings.RAG_LOCAL_SNAPSHOT)
+        logger.info("Serving knowledge base queries from the snapshot at %s (%d rows).", settings.RAG_LOCAL_SNAPSHOT, len(_local_index))
+    return _local_index
+
+
+def _document_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    # Ids are not kept: the target table assigns its own
+    return {"collection": row["collection"], "content": row["content"], "metadata": row["metadata"], "embedding": row["embedding"]}
+
+
+def _batches(reader: SnapshotReader, size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch = []
+    for row in reader.rows():
+        batch.append(_document_row(row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _csv_batch(batch: List[Dict[str, Any]]) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        writer.writerow([row["collection"], row["content"], json.dumps(row["metadata"]), json.dumps(row["embedding"])])
+    return buffer.getvalue().encode("utf-8")
+
+
+async def _copy_rows(reader: SnapshotReader, batch_size: int) -> None:
+    if not settings.SUPABASE_RAG_DB_URL:
+        raise RuntimeError("SUPABASE_RAG_DB_URL must be set to import with COPY.")
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+
+    async def source():
+        for batch in _batches(reader, batch_size):
+            yield _csv_batch(batch)
+
+    engine = create_async_engine(settings.SUPABASE_RAG_DB_URL, poolclass=NullPool)
+    try:
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_to_table(
+                "documents", source=source(), columns=["collection", "content", "metadata", "embedding"], format="csv",
+            )
+    finally:
+        await engine.dispose()
+
+
+def import_snapshot(path: str, batch_size: Optional[int] = None, copy: bool = False) -> int:
+    """Inserts every row of a snapshot into the ``documents`` table and returns the row count."""
+    reader = SnapshotReader(path)
+    batch_size = batch_size or settings.SNAPSHOT_BATCH_SIZE
+    try:
+        if reader.dimensions != settings.RAG_EMBEDDING_DIMENSIONS:
+            raise ValueError(f"The snapshot has {reader.dimensions} dimensions; RAG_EMBEDDING_DIMENSIONS is {settings.RAG_EMBEDDING_DIMENSIONS}.")
+        if reader.dtype == "int8":
+            logger.warning("Importing an int8 snapshot; the embeddings keep their quantization error.")
+        if copy:
+            asyncio.run(_copy_rows(reader, batch_size))
+        else:
+            for batch in _batches(reader, batch_size):
+                response = get_supabase_rag().table('documents').insert(batch).execute()
+                if getattr(response, 'error', None):
+                    raise RuntimeError(f"Failed to insert snapshot rows: {response.error}")
+    finally:
+        reader.close()
+    logger.info("Imported %d rows from %s.", len(reader), path)
+    return len(reader)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m backend.snapshots", description="Export or import knowledge base snapshots.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Write the documents table to a snapshot directory.")
+    export.add_argument("path")
+    export.add_argument("--dtype", choices=EMBEDDING_DTYPES, default="float32", help="int8 is a quarter of the size, for local search.")
+    export.add_argument("--collections", help="Comma separated collections to export (default: all).")
+    load = commands.add_parser("import", help="Insert the rows of a snapshot into the documents table.")
+    load.add_argument("path")
+    load.add_argument("--batch-size", type=int, help="Rows per insert (default: SNAPSHOT_BATCH_SIZE).")
+    load.add_argument("--copy", action="store_true", help="Stream the rows with COPY over SUPABASE_RAG_DB_URL.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        collections = [c.strip() for c in args.collections.split(",") if c.strip()] if args.collections else None
+        export_snapshot(args.path, dtype=args.dtype, collections=collections)
+    else:
+        import_snapshot(args.path, batch_size=args.batch_size, copy=args.copy)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
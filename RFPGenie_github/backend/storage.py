@@ -0,0 +1,326 @@
+"""Content-addressed blob storage for uploaded documents.
+
+Blobs are keyed by the SHA-256 of their content, so identical uploads are
+stored once and a key is valid on every worker or node that shares the store.
+Two backends are available, selected by ``STORAGE_BACKEND``:
+
+* ``filesystem`` stores blobs under ``STORAGE_PATH``; point it at a shared mount
+  to run several workers or pods.
+* ``s3`` stores blobs in ``S3_BUCKET`` on any S3-compatible service
+  (``S3_ENDPOINT_URL`` for MinIO or other local stand-ins). Requires boto3.
+
+Writes are streamed and hashed in fixed-size chunks, either from a file with
+``put`` or chunk by chunk through a :class:`BlobWriter`. The store API is
+synchronous; call it through ``asyncio.to_thread`` from request handlers.
+
+Database rows reference blobs with ``blob:<sha256><extension>`` URIs, see
+:func:`blob_uri`. Plain paths written before the store existed are still
+readable through :func:`open_document`.
+"""
+import contextlib
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import tempfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+from .config import settings
+
+CHUNK_SIZE = 1024 * 1024
+BLOB_URI_PREFIX = "blob:"
+
+
+class BlobNotFound(FileNotFoundError):
+    """Raised when a blob key is not in the store."""
+
+
+@dataclass(frozen=True)
+class StoredBlob:
+    key: str
+    size: int
+    created: bool  # False when identical content was already stored
+
+
+def copy_hashing(src: BinaryIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE) -> Tuple[str, int]:
+    """Copies ``src`` to ``dst`` chunk by chunk, returning the SHA-256 hex digest and size."""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(chunk_size)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dst.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class BlobWriter(ABC):
+    """Content of one blob written in pieces; its key is the hash of everything written.
+
+    ``commit`` stores the blob, ``abort`` discards what was written.
+    """
+
+    def __init__(self, spool: BinaryIO):
+        self._spool = spool
+        self._digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self._digest.update(chunk)
+        self._spool.write(chunk)
+        self.size += len(chunk)
+
+    @property
+    def key(self) -> str:
+        return self._digest.hexdigest()
+
+    @abstractmethod
+    def commit(self) -> StoredBlob:
+        ...
+
+    def abort(self) -> None:
+        self._spool.close()
+
+
+class BlobStore(ABC):
+    """Interface shared by the storage backends."""
+
+    @abstractmethod
+    def writer(self) -> BlobWriter:
+        ...
+
+    def put(self, fileobj: BinaryIO) -> StoredBlob:
+        writer = self.writer()
+        try:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        ...
+
+    @abstractmethod
+    def open(self, key: str) -> contextlib.AbstractContextManager:
+        """Context manager yielding a seekable binary file with the blob's content."""
+
+    @abstractmethod
+    def read_range(self, key: str, start: int, length: Optional[int] = None) -> bytes:
+        """Reads ``length`` bytes from ``start`` (to the end when ``length`` is None)."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+
+class _FilesystemBlobWriter(BlobWriter):
+    def __init__(self, store: "FilesystemBlobStore"):
+        store._tmp.mkdir(parents=True, exist_ok=True)
+        super().__init__(tempfile.NamedTemporaryFile(dir=store._tmp, delete=False))
+        self._store = store
+
+    def commit(self) -> StoredBlob:
+        self._spool.close()
+        key, tmp_name = self.key, self._spool.name
+        path = self._store._path(key)
+        if path.exists():
+            os.unlink(tmp_name)
+            return StoredBlob(key=key, size=self.size, created=False)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Atomic on a single filesystem; concurrent writers of the same content converge
+        os.replace(tmp_name, path)
+        return StoredBlob(key=key, size=self.size, created=True)
+
+    def abort(self) -> None:
+        self._spool.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self._spool.name)
+
+
+class FilesystemBlobStore(BlobStore):
+    """Blobs as files under ``root``, fanned out as ``ab/cd/<sha256>``."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self._tmp = self.root / ".tmp"
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def writer(self) -> BlobWriter:
+        return _FilesystemBlobWriter(self)
+
+    def exists(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def size(self, key: str) -> int:
+        try:
+            return self._path(key).stat().st_size
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+
+    @contextlib.contextmanager
+    def open(self, key: str) -> Iterator[BinaryIO]:
+        try:
+            f = self._path(key).open("rb")
+        except FileNotFoundError:
+            raise BlobNotFound(key)
+        with f:
+            yield f
+
+    def read_range(self, key: str, start: int, length: Optional[int] = None) -> bytes:
+        with self.open(key) as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
+    def delete(self, key: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            self._path(key).unlink()
+
+
+def _is_not_found(error: Exception) -> bool:
+    code = getattr(error, "response", {}).get("Error", {}).get("Code")
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+class _S3BlobWriter(BlobWriter):
+    def __init__(self, store: "S3BlobStore"):
+        super().__init__(tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE))
+        self._store = store
+
+    def commit(self) -> StoredBlob:
+        key = self.key
+        with self._spool:
+            if self._store._head(key) is not None:
+                return StoredBlob(key=key, size=self.size, created=False)
+            self._spool.seek(0)
+            self._store.client.upload_fileobj(self._spool, self._store.bucket, self._store._object_key(key))
+        return StoredBlob(key=key, size=self.size, created=True)
+
+
+class S3BlobStore(BlobStore):
+    """Blobs as objects under ``prefix`` in an S3-compatible bucket.
+
+    Content is spooled to a temporary file while it is hashed, because the key is
+    only known once the whole upload has been read; uploads then use boto3's
+    managed (multipart) transfer.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "blobs/", client=None, endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3).")
+            client = boto3.client("s3", endpoint_url=endpoint_url or None, region_name=region or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _head(self, key: str) -> Optional[dict]:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except Exception as e:
+            if _is_not_found(e):
+                return None
+            raise
+
+    def writer(self) -> BlobWriter:
+        return _S3BlobWriter(self)
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> int:
+        head = self._head(key)
+        if head is None:
+            raise BlobNotFound(key)
+        return head["ContentLength"]
+
+    @contextlib.contextmanager
+    def open(self, key: str) -> Iterator[BinaryIO]:
+        with tempfile.SpooledTemporaryFile(max_size=8 * CHUNK_SIZE) as spool:
+            try:
+                self.client.download_fileobj(self.bucket, self._object_key(key), spool)
+            except Exception as e:
+                if _is_not_found(e):
+                    raise BlobNotFound(key)
+                raise
+            spool.seek(0)
+            yield spool
+
+    def read_range(self, key: str, start: int, length: Optional[int] = None) -> bytes:
+        byte_range = f"bytes={start}-" if length is None else f"bytes={start}-{start + length - 1}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key), Range=byte_range)
+        except Exception as e:
+            if _is_not_found(e):
+                raise BlobNotFound(key)
+            raise
+        return response["Body"].read()
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+_store: Optional[BlobStore] = None
+
+
+def get_blob_store() -> BlobStore:
+    """Returns the configured blob store, creating it on first use."""
+    global _store
+    if _store is None:
+        if settings.STORAGE_BACKEND == "filesystem":
+            _store = FilesystemBlobStore(settings.STORAGE_PATH)
+        elif settings.STORAGE_BACKEND == "s3":
+            if not settings.S3_BUCKET:
+                raise RuntimeError("S3_BUCKET must be set when STORAGE_BACKEND=s3.")
+            _store = S3BlobStore(settings.S3_BUCKET, prefix=settings.S3_PREFIX, endpoint_url=settings.S3_ENDPOINT_URL, region=settings.S3_REGION)
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {settings.STORAGE_BACKEND}")
+    return _store
+
+
+def blob_uri(key: str, extension: str = "") -> str:
+    """Reference to a blob as stored in the database; the extension selects the parser."""
+    return f"{BLOB_URI_PREFIX}{key}{extension.lower()}"
+
+
+def parse_blob_uri(uri: str) -> Tuple[str, str]:
+    """Splits a blob URI into its key and extension."""
+    ref = uri[len(BLOB_URI_PREFIX):]
+    key, extension = os.path.splitext(ref)
+    return key, extension
+
+
+def document_extension(ref: str) -> str:
+    """File extension of a blob URI or legacy path, lower-cased."""
+    return os.path.splitext(ref)[1].lower()
+
+
+@contextlib.contextmanager
+def open_document(ref: str) -> Iterator[BinaryIO]:
+    """Opens a stored document by blob URI, or by local path for rows written before the blob store."""
+    if ref.startswith(BLOB_URI_PREFIX):
+        key, _ = parse_blob_uri(ref)
+        with get_blob_store().open(key) as f:
+            yield f
+    else:
+        with open(ref, "rb") as f:
+            yield f
+
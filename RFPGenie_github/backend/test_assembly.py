@@ -0,0 +1,147 @@
+import asyncio
+
+import litellm
+import pytest
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import final_generation
+from backend.assembly import IncompleteAssembly, bump_collection_revisions, generated_fingerprint, plan_final_sections
+from backend.benchmarks.fakes import FakeCompletionProvider
+from backend.config import settings
+from backend.final_generation import RUN_FAILED, advance_run, start_run
+from backend.models import FinalGenerationRun, FinalSection, Proposal, ProposalSection, Template
+from backend.routing import TASK_FINAL_PROPOSAL
+
+
+def test_only_changed_sections_are_regenerated(db_engine, monkeypatch):
+    fake = FakeCompletionProvider(latency=0, tokens_per_second=1e9)
+    prompts = []
+
+    async def recording_acompletion(**kwargs):
+        prompts.append(kwargs["messages"][1]["content"])
+        return await fake.acompletion(**kwargs)
+
+    async def fake_query_collections(query, collections):
+        return "Delivered 40 migrations."
+
+    monkeypatch.setattr(litellm, "acompletion", recording_acompletion)
+    monkeypatch.setattr(final_generation, "aquery_collections", fake_query_collections)
+
+    async def generate(session, proposal, selected):
+        plan = await plan_final_sections(session, proposal, selected)
+        if not plan.stale:
+            return plan, None
+        run = await start_run(session, proposal, selected, plan)
+        return plan, await advance_run(session, run)
+
+    async def scenario():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=["Why Us", "Pricing"])
+            proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt", template=template)
+            proposal.proposal_sections = [
+                ProposalSection(section_name="Why Us", collection_mappings=["Case Studies"]),
+                ProposalSection(section_name="Pricing"),
+            ]
+            session.add(proposal)
+            await session.commit()
+            why_us, pricing = (section.id for section in proposal.proposal_sections)
+
+            first_plan, first = await generate(session, proposal, {why_us: "We are good.", pricing: "Fixed fee."})
+            unchanged_plan, _ = await generate(session, proposal, {why_us: "We are good.", pricing: "Fixed fee."})
+            edited_plan, edited = await generate(session, proposal, {why_us: "We are good.", pricing: "Fixed fee of 10k."})
+            edited_prompt = prompts[-1]
+            await bump_collection_revisions(["Case Studies"])
+            refreshed_plan, _ = await generate(session, proposal, {why_us: "We are good.", pricing: "Fixed fee of 10k."})
+        return first_plan, first, unchanged_plan, edited_plan, edited, edited_prompt, refreshed_plan
+
+    first_plan, first, unchanged_plan, edited_plan, edited, edited_prompt, refreshed_plan = asyncio.run(scenario())
+    assert list(first_plan.stale) == ["Why Us", "Pricing"]
+    assert first.index("<h2>Why Us</h2>") < first.index("<h2>Pricing</h2>")
+    assert unchanged_plan.stale == {}
+    assert list(edited_plan.stale) == ["Pricing"]
+    # The edited run only sent Pricing to the agent, and Why Us was reused
+    assert '"Why Us"' not in edited_prompt and '"Pricing"' in edited_prompt
+    assert edited.startswith(first[:first.index("<h2>Pricing</h2>")])
+    # New knowledge base content invalidates the sections mapped to it
+    assert list(refreshed_plan.stale) == ["Why Us"]
+
+
+def _two_section_proposal(session):
+    template = Template(name="T", description="", sections=["Why Us", "Pricing"])
+    proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt", template=template)
+    proposal.proposal_sections = [ProposalSection(section_name="Why Us"), ProposalSection(section_name="Pricing")]
+    session.add(proposal)
+    return proposal
+
+
+def test_loosely_titled_sections_are_assembled_with_the_routed_model(db_engine, monkeypatch):
+    fake = FakeCompletionProvider(latency=0, tokens_per_second=1e9)
+    models = []
+
+    async def numbered_acompletion(**kwargs):
+        models.append(kwargs["model"])
+        response = await fake.acompletion(**kwargs)
+        message = response.choices[0].message
+        # A preamble, a numbered title and a title that only matches by position
+        message.content = "<p>Intro.</p>" + message.content.replace("<h2>Why Us</h2>", "<h2>1. Why&nbsp;us:</h2>").replace("<h2>Pricing</h2>", "<h2>Our fees</h2>")
+        return response
+
+    monkeypatch.setattr(litellm, "acompletion", numbered_acompletion)
+    monkeypatch.setattr(settings, "MODEL_ROUTES", {TASK_FINAL_PROPOSAL: ["small-model", "large-model"]})
+
+    async def scenario():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            proposal = _two_section_proposal(session)
+            await session.commit()
+            selected = {section.id: section.section_name for section in proposal.proposal_sections}
+            plan = await plan_final_sections(session, proposal, selected)
+            final = await advance_run(session, await start_run(session, proposal, selected, plan))
+            stored = {row.section_name: row.fingerprint for row in (await session.exec(select(FinalSection))).all()}
+            unchanged = await plan_final_sections(session, proposal, selected)
+            monkeypatch.setattr(settings, "MODEL_ROUTES", {TASK_FINAL_PROPOSAL: ["large-model"]})
+            new_ladder = await plan_final_sections(session, proposal, selected)
+        return plan, final, stored, unchanged, new_ladder
+
+    plan, final, stored, unchanged, new_ladder = asyncio.run(scenario())
+    assert final.startswith("<h2>Why Us</h2><p>Intro.</p><p>") and "<h2>Pricing</h2><p>" in final
+    # Fingerprinted with the model the run was routed to
+    assert models == ["small-model"]
+    assert stored == {name: generated_fingerprint(inputs, "small-model") for name, inputs in plan.fingerprints.items()}
+    assert unchanged.stale == {}
+    assert list(new_ladder.stale) == ["Why Us", "Pricing"]
+
+
+def test_run_with_a_missing_section_fails_instead_of_completing(db_engine, monkeypatch):
+    fake = FakeCompletionProvider(latency=0, tokens_per_second=1e9)
+    prompts = []
+
+    async def forgetful_acompletion(**kwargs):
+        prompts.append(kwargs["messages"][-1]["content"])
+        response = await fake.acompletion(**kwargs)
+        message = response.choices[0].message
+        message.content = message.content[:message.content.index("<h2>Pricing</h2>")]
+        return response
+
+    monkeypatch.setattr(litellm, "acompletion", forgetful_acompletion)
+
+    async def scenario():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            proposal = _two_section_proposal(session)
+            await session.commit()
+            selected = {section.id: section.section_name for section in proposal.proposal_sections}
+            run = await start_run(session, proposal, selected, await plan_final_sections(session, proposal, selected))
+            with pytest.raises(IncompleteAssembly):
+                await advance_run(session, run)
+        async with AsyncSession(db_engine) as session:
+            run = await session.get(FinalGenerationRun, run.id)
+            proposal = await session.get(Proposal, proposal.id)
+            sections = (await session.exec(select(FinalSection))).all()
+        return run, proposal, sections
+
+    run, proposal, sections = asyncio.run(scenario())
+    # Asked once more for the missing section, then failed with the answer kept
+    assert len(prompts) == 2 and '"Pricing"' in prompts[1]
+    assert run.status == RUN_FAILED and "Pricing" in run.error
+    assert list(run.section_outputs) == ["Why Us"]
+    assert proposal.final_rfp_json is None and sections == []
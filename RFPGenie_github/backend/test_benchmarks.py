@@ -0,0 +1,48 @@
+import os
+
+from backend.config import settings
+from backend.benchmarks import BenchmarkConfig, SCENARIOS, run_benchmark, compare_to_baseline
+from backend.benchmarks.harness import percentile
+from backend.benchmarks.fakes import FakeEmbeddingProvider, InMemorySupabase
+
+def test_percentile_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 95) == 95.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+def test_in_memory_match_documents_ranks_by_similarity():
+    embedder = FakeEmbeddingProvider(latency=0)
+    supabase = InMemorySupabase(latency=0)
+    supabase.table("documents").insert([
+        {"collection": "A", "content": "cloud migration case study", "metadata": {"source": "a.txt"}, "embedding": embedder.embed("cloud migration case study")},
+        {"collection": "A", "content": "pricing model", "metadata": {"source": "b.txt"}, "embedding": embedder.embed("pricing model")},
+        {"collection": "B", "content": "cloud migration", "metadata": {"source": "c.txt"}, "embedding": embedder.embed("cloud migration")},
+    ]).execute()
+
+    rows = supabase.rpc("match_documents", {
+        "query_embedding": embedder.embed("cloud migration"),
+        "match_threshold": 0.1,
+        "match_count": 5,
+        "collection_filter": ["A"],
+    }).execute().data
+
+    assert [row["metadata"]["source"] for row in rows] == ["a.txt"]
+    assert supabase.table("documents").select("id", count="exact").eq("metadata->>source", "b.txt").execute().count == 1
+
+def test_benchmark_runs_all_scenarios_offline():
+    config = BenchmarkConfig(requests=2, concurrency=2, llm_latency=0, tokens_per_second=1e9, embedding_latency=0, supabase_latency=0, document_paragraphs=3)
+    environ, cwd, database_url = dict(os.environ), os.getcwd(), settings.DATABASE_URL
+    results = run_benchmark(config)
+    # Nothing the harness points at its own resources outlives the run
+    assert dict(os.environ) == environ and os.getcwd() == cwd and settings.DATABASE_URL == database_url
+
+    assert [r.scenario for r in results] == list(SCENARIOS)
+    for r in results:
+        assert r.errors == 0, r.status_codes
+        assert 0 < r.p50 <= r.p95 <= r.p99
+        assert r.peak_rss_mb > 0
+
+    baseline = {r.scenario: {"p95": r.p95 / 10} for r in results}
+    assert len(compare_to_baseline(results, baseline, tolerance=0.2)) == len(results)
@@ -0,0 +1,52 @@
+import asyncio
+
+import litellm
+import pytest
+
+from backend.cancellation import ClientDisconnected, LatestOnly, Superseded, cancel_on_disconnect
+from backend.llm import LLMGovernor, ModelLimits
+
+
+class _Request:
+    def __init__(self, disconnect_after: int):
+        self.polls = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self) -> bool:
+        self.polls += 1
+        return self.polls >= self.disconnect_after
+
+
+def test_disconnect_cancels_model_calls_and_frees_the_slot(monkeypatch):
+    started = asyncio.Event()
+
+    async def slow_acompletion(**kwargs):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(litellm, "acompletion", slow_acompletion)
+    governor = LLMGovernor(ModelLimits(concurrency=1))
+
+    async def run():
+        work = governor.acompletion(model="m", messages=[{"role": "user", "content": "hi"}])
+        with pytest.raises(ClientDisconnected):
+            await cancel_on_disconnect(_Request(disconnect_after=2), work, poll_interval=0.01)
+        return started.is_set(), governor.limiter("m").metrics()["in_flight"]
+
+    assert asyncio.run(run()) == (True, 0)
+
+
+def test_newer_request_supersedes_older_one():
+    latest = LatestOnly()
+
+    async def run():
+        first = latest.start(7, asyncio.sleep(10, result="old"))
+        waiting = asyncio.ensure_future(cancel_on_disconnect(_Request(disconnect_after=1000), first, poll_interval=0.01))
+        await asyncio.sleep(0.02)
+        second = latest.start(7, asyncio.sleep(0, result="new"))
+        with pytest.raises(Superseded):
+            await waiting
+        assert await cancel_on_disconnect(_Request(disconnect_after=1000), second, poll_interval=0.01) == "new"
+        return latest.is_latest(first), latest.is_latest(second)
+
+    assert asyncio.run(run()) == (False, True)
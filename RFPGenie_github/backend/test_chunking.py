@@ -0,0 +1,66 @@
+import asyncio
+import io
+
+import litellm
+
+from backend.chunking import Chunk, chunk_blocks, count_tokens
+from backend.documents import Block, blocks_from_lines, extract_blocks, heading_level
+from backend.ingestion import DEFAULT_CATEGORY, _categorize_batch
+
+
+def test_heading_level_heuristics():
+    assert heading_level("## Delivery Approach") == 2
+    assert heading_level("3.2 Security Controls") == 2
+    assert heading_level("CASE STUDIES") == 1
+    assert heading_level("Our Delivery Team") == 2
+    assert heading_level("We deliver projects on time and on budget.") == 0
+    assert heading_level("the team brings proven experience to every engagement") == 0
+
+
+def test_text_blocks_follow_blank_lines_and_headings():
+    text = "# Company\nWe were founded in 2001\nin Berlin.\n\nWe have 300 staff.\n## Case Studies\nA bank migration."
+    blocks = extract_blocks(io.BytesIO(text.encode()), ".txt")
+    assert [(b.kind, b.text) for b in blocks] == [
+        ("heading", "Company"),
+        ("paragraph", "We were founded in 2001 in Berlin."),
+        ("paragraph", "We have 300 staff."),
+        ("heading", "Case Studies"),
+        ("paragraph", "A bank migration."),
+    ]
+
+
+def test_chunks_stay_within_sections_and_carry_heading_path():
+    blocks = blocks_from_lines(["# Company", "Founded in 2001.", "", "## Team", "Three hundred engineers.", "# Pricing", "Fixed fee."])
+    chunks = chunk_blocks(blocks, max_tokens=400)
+    assert [c.heading for c in chunks] == ["Company", "Company > Team", "Pricing"]
+    assert chunks[1].content == "Company > Team\n\nThree hundred engineers."
+    assert [c.index for c in chunks] == [0, 1, 2]
+
+
+def test_long_paragraphs_are_windowed_with_overlap():
+    words = [f"w{i}" for i in range(1000)]
+    blocks = [Block("paragraph", " ".join(words), page=3)]
+    chunks = chunk_blocks(blocks, max_tokens=200, overlap_tokens=40)
+    assert all(count_tokens(c.content) <= 200 for c in chunks)
+    first, second = chunks[0].content.split(), chunks[1].content.split()
+    assert first[-30:] == second[:30]
+    assert second[-1] == "w269"
+    assert chunks[-1].content.split()[-1] == "w999"
+    assert all(c.page_start == c.page_end == 3 for c in chunks)
+
+
+def test_small_paragraphs_are_packed_up_to_the_limit():
+    blocks = [Block("paragraph", " ".join(["word"] * 60), page=p) for p in (1, 1, 2, 2)]
+    chunks = chunk_blocks(blocks, max_tokens=200)
+    assert len(chunks) == 2
+    assert (chunks[0].page_start, chunks[0].page_end) == (1, 1)
+    assert (chunks[1].page_start, chunks[1].page_end) == (2, 2)
+
+
+def test_failed_categorization_falls_back_to_general(monkeypatch):
+    async def broken_acompletion(model, messages, **kwargs):
+        return litellm.ModelResponse(model=model, choices=[{"index": 0, "message": {"role": "assistant", "content": "not json"}}])
+
+    monkeypatch.setattr(litellm, "acompletion", broken_acompletion)
+    batch = [Chunk(content="Our bank migration case study.", headings=[]), Chunk(content="Pricing.", headings=[])]
+    assert asyncio.run(_categorize_batch("doc.txt", batch)) == [DEFAULT_CATEGORY, DEFAULT_CATEGORY]
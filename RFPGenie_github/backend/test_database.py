@@ -0,0 +1,37 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend import database
+from backend.database import TimedQueuePool, engine_options, pool_stats
+
+
+def test_engine_options_for_postgres():
+    options = engine_options("postgresql+asyncpg://user:secret@db/rfpgenie")
+    assert options["echo"] is False
+    assert options["poolclass"] is TimedQueuePool
+    assert options["pool_pre_ping"] is True
+    assert "prepared_statement_cache_size" in options["connect_args"]
+
+
+def test_pool_stats_record_checkouts(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'pool.db'}", poolclass=TimedQueuePool, pool_size=2, max_overflow=0)
+    monkeypatch.setattr(database, "_engine", engine)
+
+    async def scenario():
+        for _ in range(3):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+        stats = pool_stats()
+        await engine.dispose()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["checkouts"] == 3 and stats["checked_out"] == 0
+    assert stats["wait_seconds_max"] >= 0.0
+
+
+def test_session_factory_is_shared(db_engine):
+    assert database.get_session_factory() is database.get_session_factory() is database.SessionFactory
+    assert database.SessionFactory.kw["bind"] is db_engine
@@ -0,0 +1,208 @@
+import asyncio
+import datetime
+
+import httpx
+import litellm
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import drafts
+from backend.benchmarks.fakes import FakeCompletionProvider
+from backend.chunking import count_tokens
+from backend.config import settings
+from backend.drafts import (
+    JOB_COMPLETED, JOB_QUEUED, JOB_RUNNING, DraftAlreadyExists, DraftInProgress, SegmentFactsCache, build_initial_draft,
+    claim_proposal, get_draft_pool, has_initial_draft, merge_facts, recover_draft_jobs, save_initial_draft, scope_segments,
+)
+from backend.models import DraftBatch, DraftJob, Proposal, ProposalSection, SectionVersion, Template
+from backend.routers import generation
+
+DRAFT = {"Executive Summary": "Summary.", "Why Us": "Because.", "Company Profile": "Profile.", "Appendices": "None."}
+
+
+async def _with_proposal(engine, body):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        template = Template(name="T", description="", sections=list(DRAFT))
+        session.add(template)
+        await session.commit()
+        proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt", template_id=template.id)
+        session.add(proposal)
+        await session.commit()
+        proposal_id = proposal.id
+    return await body(engine, proposal_id)
+
+
+def test_draft_is_written_with_one_insert_per_table(db_engine):
+    async def body(engine, proposal_id):
+        inserts = []
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda conn, cursor, statement, *args: inserts.append(statement) if statement.startswith("INSERT") else None)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            await save_initial_draft(session, proposal_id, DRAFT)
+            versions = (await session.exec(select(SectionVersion))).all()
+        return inserts, versions
+
+    inserts, versions = asyncio.run(_with_proposal(db_engine, body))
+    # Sections, versions and their search entries
+    assert len(inserts) == 3
+    assert sorted(v.content for v in versions) == sorted(DRAFT.values())
+
+
+def test_repeated_draft_is_rejected(db_engine):
+    async def body(engine, proposal_id):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            assert not await has_initial_draft(session, proposal_id)
+            await save_initial_draft(session, proposal_id, DRAFT)
+            assert await has_initial_draft(session, proposal_id)
+        # A second writer that checked before the first committed
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            with pytest.raises(DraftAlreadyExists):
+                await save_initial_draft(session, proposal_id, DRAFT)
+            return len((await session.exec(select(ProposalSection))).all())
+
+    assert asyncio.run(_with_proposal(db_engine, body)) == len(DRAFT)
+
+
+def test_claim_proposal_is_exclusive():
+    with claim_proposal(1):
+        with pytest.raises(DraftInProgress):
+            with claim_proposal(1):
+                pass
+    with claim_proposal(1):
+        pass
+
+
+def _long_scope(paragraphs):
+    return "\n\n".join(f"# Part {i}\nRequirement {i} covers the {i}th deliverable of the programme in detail." for i in range(paragraphs))
+
+
+def test_scope_segments_are_bounded_and_cover_the_document():
+    scope = _long_scope(40)
+    segments = scope_segments(scope, max_tokens=60)
+    assert len(segments) > 1
+    assert all(count_tokens(segment) <= 60 for segment in segments)
+    assert all(f"Requirement {i} " in "\n".join(segments) for i in range(40))
+
+
+def test_merge_facts_deduplicates_and_keeps_missing_sections():
+    merged = merge_facts([{"Timeline": ["Go live in May."]}, {"Timeline": ["go live in  may.", "Pilot in March."]}], ["Timeline", "Budget"], 100)
+    assert merged == "## Timeline\n- Go live in May.\n- Pilot in March.\n\n## Budget\n- No information in the scope document."
+
+
+def test_large_scope_is_drafted_map_reduce_with_cached_segments(monkeypatch):
+    fake = FakeCompletionProvider(latency=0, tokens_per_second=1e9)
+    monkeypatch.setattr(litellm, "acompletion", fake.acompletion)
+    monkeypatch.setattr(settings, "DRAFT_MAP_REDUCE_TOKENS", 100)
+    monkeypatch.setattr(settings, "DRAFT_SEGMENT_TOKENS", 60)
+    monkeypatch.setattr(drafts, "_segment_cache", SegmentFactsCache(100))
+    scope, sections = _long_scope(40), ["Executive Summary", "Timeline"]
+    segment_count = len(scope_segments(scope, 60, settings.DRAFT_SEGMENT_OVERLAP_TOKENS))
+
+    draft = asyncio.run(build_initial_draft(scope, sections))
+    assert list(draft) == sections
+    assert fake.calls == segment_count + 1
+
+    # A retry only pays for the drafting call
+    asyncio.run(build_initial_draft(scope, sections))
+    assert fake.calls == segment_count + 2
+
+
+@pytest.fixture
+def batch_env(db_engine, monkeypatch):
+    """A database with three proposals and a draft agent that fails for scope documents mentioning "broken"."""
+    monkeypatch.setattr(drafts, "_pool", None)
+    monkeypatch.setattr(drafts, "read_document", lambda ref, text_fallback=False: ref)
+
+    async def fake_build_initial_draft(scope_document, sections):
+        if "broken" in scope_document:
+            raise ValueError("unusable response")
+        return {name: f"{name} for {scope_document}" for name in sections}
+
+    monkeypatch.setattr(drafts, "build_initial_draft", fake_build_initial_draft)
+
+    async def setup():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=list(DRAFT))
+            proposals = [
+                Proposal(name=name, description="", client_name="C", scope_document_path=ref, template=template)
+                for name, ref in (("New", "blob:new.txt"), ("Drafted", "blob:drafted.txt"), ("Broken", "blob:broken.txt"))
+            ]
+            session.add_all(proposals)
+            await session.commit()
+            await save_initial_draft(session, proposals[1].id, DRAFT)
+            return [proposal.id for proposal in proposals]
+
+    return db_engine, asyncio.run(setup())
+
+
+def test_batch_reports_completed_skipped_and_failed_jobs(batch_env):
+    engine, (new_id, drafted_id, broken_id) = batch_env
+    app = FastAPI()
+    app.include_router(generation.router)
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            created = await client.post("/generation/initial_drafts", json={"proposal_ids": [new_id, drafted_id, broken_id, new_id]})
+            missing = await client.post("/generation/initial_drafts", json={"proposal_ids": [new_id, 999]})
+            await get_draft_pool().join()
+            status = await client.get(f"/generation/initial_drafts/{created.json()['id']}")
+        return created, missing, status
+
+    created, missing, status = asyncio.run(scenario())
+    assert created.status_code == 202 and created.json()["counts"] == {"queued": 2, "skipped": 1}
+    assert missing.status_code == 404
+    batch = status.json()
+    assert batch["status"] == "completed" and batch["counts"] == {"completed": 1, "skipped": 1, "failed": 1}
+    jobs = {job["proposal_id"]: job for job in batch["jobs"]}
+    assert jobs[new_id]["sections_written"] == len(DRAFT)
+    assert "unusable response" in jobs[broken_id]["error"]
+
+
+def test_jobs_left_unfinished_by_a_stopped_process_are_recovered(batch_env):
+    engine, (new_id, drafted_id, _) = batch_env
+    stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.DRAFT_JOB_STALE_SECONDS + 1)
+
+    async def scenario():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            # A worker died mid-job, and the other job never left its queue
+            batch = DraftBatch(jobs=[
+                DraftJob(proposal_id=new_id, status=JOB_RUNNING, heartbeat_at=stale),
+                DraftJob(proposal_id=drafted_id, status=JOB_QUEUED, heartbeat_at=stale),
+            ])
+            session.add(batch)
+            await session.commit()
+        assert await recover_draft_jobs() == 2
+        await get_draft_pool().join()
+        assert await recover_draft_jobs() == 0
+        async with AsyncSession(engine) as session:
+            return sorted(job.status for job in (await session.exec(select(DraftJob))).all())
+
+    assert asyncio.run(scenario()) == [JOB_COMPLETED, "skipped"]
+
+
+def test_jobs_of_live_workers_are_left_alone(batch_env):
+    engine, (new_id, _, broken_id) = batch_env
+    stale = datetime.datetime.utcnow() - datetime.timedelta(seconds=settings.DRAFT_JOB_STALE_SECONDS + 1)
+    app = FastAPI()
+    app.include_router(generation.router)
+
+    async def scenario():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            live = DraftBatch(jobs=[DraftJob(proposal_id=new_id, status=JOB_RUNNING, started_at=datetime.datetime.utcnow())])
+            orphaned = DraftBatch(jobs=[DraftJob(proposal_id=broken_id, status=JOB_RUNNING, heartbeat_at=stale)])
+            session.add_all([live, orphaned])
+            await session.commit()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            polled_live = await client.get(f"/generation/initial_drafts/{live.id}")
+            # Polling a batch recovers its orphaned jobs
+            polled_orphaned = await client.get(f"/generation/initial_drafts/{orphaned.id}")
+            await get_draft_pool().join()
+            finished = await client.get(f"/generation/initial_drafts/{orphaned.id}")
+        return polled_live.json(), polled_orphaned.json(), finished.json()
+
+    live, orphaned, finished = asyncio.run(scenario())
+    assert live["counts"] == {JOB_RUNNING: 1}
+    assert orphaned["status"] == "running"
+    assert finished["status"] == "completed" and finished["counts"] == {"failed": 1}
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from backend import embeddings
+from backend.agent.tools import rag_tool
+from backend.benchmarks.fakes import InMemorySupabase
+from backend.config import settings
+from backend.embeddings import EmbeddingModelMismatch, EmbeddingQueueFull, LiteLLMEmbeddingProvider, LocalEmbeddingProvider
+from backend.routers import collections
+
+
+class _Vectors(list):
+    def tolist(self):
+        return list(self)
+
+
+class _FakeModel:
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(list(texts))
+        return _Vectors([[float(len(text))] for text in texts])
+
+    def get_sentence_embedding_dimension(self):
+        return 1
+
+
+class _GatedProvider(LocalEmbeddingProvider):
+    """Loads a fake model once ``loaded`` is set, so requests can queue up first."""
+
+    def __init__(self, **kwargs):
+        super().__init__("fake-model", 1, **kwargs)
+        self.model = _FakeModel()
+        self.loaded = threading.Event()
+
+    def _load_model(self):
+        self.loaded.wait(5)
+        return self.model
+
+
+def test_concurrent_callers_are_encoded_in_one_batch():
+    provider = _GatedProvider(max_batch_size=32, max_wait_ms=50)
+
+    async def scenario():
+        calls = [asyncio.ensure_future(provider.embed(["a" * i, "b" * i])) for i in range(1, 6)]
+        await asyncio.sleep(0.05)
+        provider.loaded.set()
+        return await asyncio.gather(*calls)
+
+    results = asyncio.run(scenario())
+    provider.close()
+    assert len(provider.model.batches) == 1 and len(provider.model.batches[0]) == 10
+    # Every caller gets its own vectors back, in order
+    assert results == [[[float(i)], [float(i)]] for i in range(1, 6)]
+
+
+def test_full_queue_is_refused_with_503(monkeypatch):
+    provider = _GatedProvider(max_queue_size=1)
+    # The worker is blocked loading the model, so nothing leaves the queue
+    provider._submit(["waiting"])
+    with pytest.raises(EmbeddingQueueFull):
+        provider._submit(["one too many"])
+
+    chunk = {"collection": "Pricing", "content": "Fixed fee.", "metadata": {"source": "a.txt"}}
+
+    async def fake_build_chunks(filename, document_ref):
+        return [chunk]
+
+    monkeypatch.setattr(collections, "build_chunks", fake_build_chunks)
+    monkeypatch.setattr(collections, "get_embedding_provider", lambda: provider)
+    supabase = InMemorySupabase(latency=0)
+    monkeypatch.setattr(collections, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(embeddings, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(embeddings, "_collection_models", {})
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(collections._ingest_document("a.txt", "blob:a.txt", "key"))
+    assert refused.value.status_code == 503
+    provider.loaded.set()
+    provider.close()
+
+
+def test_collections_embedded_with_another_model_are_refused(monkeypatch):
+    supabase = InMemorySupabase(latency=0)
+    supabase.table("documents").insert({"collection": "Pricing", "content": "Fixed fee.", "metadata": {"embedding_model": "local:other"}}).execute()
+    monkeypatch.setattr(embeddings, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(rag_tool, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(embeddings, "_collection_models", {})
+
+    with pytest.raises(EmbeddingModelMismatch) as mismatch:
+        rag_tool._match_documents([0.1], ["Pricing", "Empty"], "local:fake-model")
+    assert mismatch.value.mismatched == {"Pricing": "local:other"}
+
+    provider = _GatedProvider()
+    provider.loaded.set()
+    monkeypatch.setattr(rag_tool, "get_embedding_provider", lambda: provider)
+    answer = asyncio.run(rag_tool.aquery_collections("fees", ["Pricing"]))
+    provider.close()
+    assert "different model" in answer and provider.model.batches == [["fees"]]
+
+
+def test_agent_tool_embeds_through_the_governor(monkeypatch):
+    supabase = InMemorySupabase(latency=0)
+    supabase.table("documents").insert({"collection": "Pricing", "content": "Fixed fee.", "metadata": {"embedding_model": "remote-model"}}).execute()
+    monkeypatch.setattr(embeddings, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(rag_tool, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(embeddings, "_collection_models", {})
+    monkeypatch.setattr(rag_tool, "get_embedding_provider", lambda: LiteLLMEmbeddingProvider("remote-model", 1))
+    governed = []
+
+    class FakeGovernor:
+        async def aembedding(self, model, input, **kwargs):
+            governed.append((model, input))
+            return SimpleNamespace(data=[{"embedding": [0.1]} for _ in input])
+
+    monkeypatch.setattr(embeddings, "get_llm_governor", lambda: FakeGovernor())
+    tool = rag_tool.get_query_collection_tool()
+
+    assert tool.name == "query_collections"
+    asyncio.run(tool.func(query="fees", collections=["Pricing"]))
+    assert governed == [("remote-model", ["fees"])]
+
+
+def test_provider_of_another_size_than_the_knowledge_base_is_refused(monkeypatch):
+    monkeypatch.setattr(embeddings, "_provider", None)
+    monkeypatch.setattr(settings, "EMBEDDING_PROVIDER", "local")
+    monkeypatch.setattr(settings, "RAG_EMBEDDING_DIMENSIONS", 1536)
+
+    with pytest.raises(ValueError, match="384 dimensions"):
+        embeddings.get_embedding_provider()
+    assert embeddings._provider is None
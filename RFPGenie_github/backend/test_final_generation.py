@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+
+import litellm
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import final_generation, response_cache
+from backend.benchmarks.fakes import FakeCompletionProvider
+from backend.final_generation import (
+    RUN_COMPLETED, RUN_FAILED, RunNotResumable, advance_run, check_resumable, collect_abandoned_runs, split_sections, start_run,
+)
+from backend.models import FinalGenerationRun, FinalSection, Proposal, ProposalSection, Template
+from backend.routers import templates
+
+
+async def _with_proposal(engine, body):
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        template = Template(name="T", description="", sections=["Why Us"])
+        session.add(template)
+        await session.commit()
+        proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt", template_id=template.id)
+        proposal.proposal_sections = [ProposalSection(section_name="Why Us", collection_mappings=["Case Studies"])]
+        session.add(proposal)
+        await session.commit()
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        return await body(session, await session.get(Proposal, proposal.id))
+
+
+def test_failed_run_resumes_without_repeating_tool_calls(db_engine, monkeypatch):
+    fake = FakeCompletionProvider(latency=0, tokens_per_second=1e9)
+    failures = {"left": 1}
+    tool_calls = []
+
+    async def flaky_acompletion(**kwargs):
+        # The turn after the tool result fails once
+        if any(m["role"] == "tool" for m in kwargs["messages"]) and failures["left"]:
+            failures["left"] -= 1
+            raise ValueError("provider went away")
+        return await fake.acompletion(**kwargs)
+
+    async def fake_query_collections(query, collections):
+        tool_calls.append(collections)
+        return "Delivered 40 migrations."
+
+    monkeypatch.setattr(litellm, "acompletion", flaky_acompletion)
+    monkeypatch.setattr(final_generation, "aquery_collections", fake_query_collections)
+
+    async def body(session, proposal):
+        run = await start_run(session, proposal, {1: "We are good."})
+        with pytest.raises(ValueError):
+            await advance_run(session, run)
+        failed = await session.get(FinalGenerationRun, run.id)
+        assert (failed.status, failed.turns, len(tool_calls)) == (RUN_FAILED, 1, 1)
+        assert [m["role"] for m in failed.messages] == ["system", "user", "assistant", "tool"]
+
+        check_resumable(failed)
+        html = await advance_run(session, failed)
+        completed = await session.get(FinalGenerationRun, run.id)
+        return html, completed, (await session.get(Proposal, proposal.id)).final_rfp_json
+
+    html, run, stored_html = asyncio.run(_with_proposal(db_engine, body))
+    assert html == stored_html and html.startswith("<h2>Why Us</h2>")
+    assert (run.status, run.turns, len(tool_calls), fake.calls) == (RUN_COMPLETED, 2, 1, 2)
+    assert list(run.section_outputs) == ["Why Us"]
+    with pytest.raises(RunNotResumable):
+        check_resumable(run)
+
+
+def test_abandoned_runs_are_collected(db_engine):
+    async def body(session, proposal):
+        old = FinalGenerationRun(proposal_id=proposal.id, status=RUN_FAILED, updated_at=datetime.datetime.utcnow() - datetime.timedelta(days=2))
+        session.add_all([old, FinalGenerationRun(proposal_id=proposal.id, status=RUN_FAILED)])
+        await session.commit()
+        deleted = await collect_abandoned_runs(session)
+        return deleted, len((await session.exec(select(FinalGenerationRun))).all())
+
+    assert asyncio.run(_with_proposal(db_engine, body)) == (1, 1)
+
+
+def test_split_sections():
+    assert split_sections("<h2>Why Us</h2><p>A</p><h2>Team</h2><p>B</p>") == {"Why Us": "<p>A</p>", "Team": "<p>B</p>"}
+    assert split_sections("<p>Intro</p><h2>Why Us</h2><p>A</p>") == {"": "<p>Intro</p>", "Why Us": "<p>A</p>"}
+
+
+def test_deleting_a_template_deletes_its_proposals_generation_runs(db_engine, monkeypatch):
+    # Enforce foreign keys, as PostgreSQL does
+    event.listen(db_engine.sync_engine, "connect", lambda connection, _: connection.cursor().execute("pragma foreign_keys=on"))
+    monkeypatch.setattr(response_cache, "_cache", None)
+
+    async def setup():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=["Why Us"])
+            proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt",
+                                final_rfp_json="<h2>Why Us</h2>", template=template)
+            proposal.proposal_sections = [ProposalSection(section_name="Why Us")]
+            session.add(proposal)
+            await session.commit()
+            session.add_all([
+                FinalGenerationRun(proposal_id=proposal.id, status=RUN_COMPLETED),
+                FinalSection(proposal_id=proposal.id, section_name="Why Us", fingerprint="f", html=""),
+            ])
+            await session.commit()
+            return template.id
+
+    async def remaining():
+        async with AsyncSession(db_engine) as session:
+            return [len((await session.exec(select(model))).all()) for model in (Proposal, FinalGenerationRun, FinalSection)]
+
+    template_id = asyncio.run(setup())
+    app = FastAPI()
+    app.include_router(templates.router)
+    assert TestClient(app).delete(f"/templates/{template_id}").status_code == 200
+    assert asyncio.run(remaining()) == [0, 0, 0]
@@ -0,0 +1,60 @@
+import asyncio
+
+import litellm
+
+from backend.llm import LLMGovernor, ModelLimiter, ModelLimits, Priority, TokenBucket, llm_priority
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(per_minute=60)
+    now = bucket.updated
+    assert bucket.wait_time(60, now) == 0.0
+    bucket.consume(60)
+    assert abs(bucket.wait_time(1, now) - 1.0) < 1e-6
+    # Oversized requests wait for a full bucket instead of forever
+    assert abs(bucket.wait_time(600, now) - 60.0) < 1e-6
+
+
+def test_limiter_caps_concurrency_and_serves_by_priority():
+    async def scenario():
+        limiter = ModelLimiter("m", ModelLimits(concurrency=1))
+        order = []
+
+        async def job(name, priority):
+            await limiter.acquire(10, priority)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release()
+
+        await limiter.acquire(10, Priority.STANDARD)  # occupy the only slot
+        tasks = [asyncio.create_task(job("bulk", Priority.BULK)), asyncio.create_task(job("interactive", Priority.INTERACTIVE))]
+        await asyncio.sleep(0)
+        assert limiter.metrics()["queued"] == {"interactive": 1, "standard": 0, "bulk": 1}
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["interactive", "bulk"]
+
+
+def test_governor_retries_rate_limits(monkeypatch):
+    calls = []
+
+    async def flaky_acompletion(model, messages, **kwargs):
+        calls.append(model)
+        if len(calls) < 3:
+            raise litellm.RateLimitError("slow down", llm_provider="openai", model=model)
+        return litellm.ModelResponse(model=model, choices=[{"index": 0, "message": {"role": "assistant", "content": "ok"}}])
+
+    monkeypatch.setattr(litellm, "acompletion", flaky_acompletion)
+    governor = LLMGovernor(ModelLimits(concurrency=2), base_delay=0.001, max_delay=0.01)
+
+    async def scenario():
+        with llm_priority(Priority.INTERACTIVE):
+            return await governor.acompletion(model="gpt-test", messages=[{"role": "user", "content": "hi"}])
+
+    response = asyncio.run(scenario())
+    assert response.choices[0].message.content == "ok"
+    metrics = governor.metrics()["gpt-test"]
+    assert metrics["retries"] == 2 and metrics["rate_limited"] == 2 and metrics["completed"] == 1
+    assert metrics["in_flight"] == 0
@@ -0,0 +1,68 @@
+import logging
+import queue
+
+from backend import logging_config
+from backend.logging_config import NonBlockingQueueHandler, Payload, log_payload
+
+
+def _queued_logger(name, maxsize=100):
+    log_queue = queue.Queue(maxsize=maxsize)
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    logger.handlers = [NonBlockingQueueHandler(log_queue)]
+    return logger, log_queue
+
+
+def test_payloads_are_truncated():
+    assert str(Payload("x" * 10, max_chars=4)) == "xxxx...(+6 chars)"
+    assert str(Payload({"a": [1, 2]})) == '{"a": [1, 2]}'
+
+
+def test_arguments_are_captured_when_logged():
+    logger, log_queue = _queued_logger("test.capture")
+    state = {"status": "queued"}
+    logger.info("Job %s is %r", 1, state)
+    logger.info("Job state %s, payload %s", state, Payload("p" * 3))
+    state["status"] = "done"
+    first, second = log_queue.get_nowait(), log_queue.get_nowait()
+    assert first.getMessage() == "Job 1 is {'status': 'queued'}"
+    assert second.getMessage() == "Job state {'status': 'queued'}, payload ppp"
+    # The payload is still rendered by the listener
+    assert isinstance(second.args[1], Payload)
+
+
+def test_payload_sampling_never_drops_errors(monkeypatch):
+    logger, log_queue = _queued_logger("test.sampling")
+    monkeypatch.setattr(logging_config, "_payload_sample_rate", 0.0)
+    log_payload(logger, logging.DEBUG, "Response: %s", {"a": 1})
+    log_payload(logger, logging.ERROR, "Failed response: %s", {"a": 1})
+    assert [record.levelno for record in list(log_queue.queue)] == [logging.ERROR]
+
+
+def test_records_are_dropped_when_the_queue_is_full(monkeypatch):
+    logger, log_queue = _queued_logger("test.full", maxsize=1)
+    monkeypatch.setattr(NonBlockingQueueHandler, "dropped", 0)
+    for i in range(3):
+        logger.info("Record %d", i)
+    assert log_queue.qsize() == 1 and NonBlockingQueueHandler.dropped == 2
+
+
+def test_listener_survives_a_failing_filter_and_flushes_on_shutdown(tmp_path, monkeypatch):
+    monkeypatch.setattr(logging, "raiseExceptions", False)
+    root = logging.getLogger()
+    previous_level = root.level
+    logging_config.configure_logging(filename=str(tmp_path / "app.log"), json_format=False)
+    try:
+        file_handler = logging_config._listener.handlers[0]
+        file_handler.addFilter(lambda record: record.getMessage() != "poison" or {}["gone"])
+        logger = logging.getLogger("test.listener")
+        logger.info("poison")
+        logger.info("after")
+    finally:
+        logging_config.shutdown_logging()
+        root.setLevel(previous_level)
+    assert logging_config._listener is None
+    assert not any(isinstance(handler, NonBlockingQueueHandler) for handler in root.handlers)
+    lines = (tmp_path / "app.log").read_text().splitlines()
+    assert len(lines) == 1 and lines[0].endswith("after")
@@ -0,0 +1,49 @@
+import asyncio
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import prefetch
+from backend.assembly import bump_collection_revisions
+from backend.models import Proposal, ProposalSection, SectionVersion, Template
+from backend.prefetch import get_prefetcher, load_warm_context
+
+
+def test_prefetched_context_is_served_until_sources_change(db_engine, monkeypatch):
+    queries = []
+
+    async def fake_query_collections(query, collections):
+        queries.append(query)
+        return f"Context for {query}"
+
+    monkeypatch.setattr(prefetch, "aquery_collections", fake_query_collections)
+
+    async def scenario():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=["Why Us"])
+            proposal = Proposal(name="P", description="", client_name="C", scope_document_path="blob:x.txt", template=template)
+            section = ProposalSection(section_name="Why Us", collection_mappings=["Case Studies"], custom_prompt="Mention banking clients")
+            section.versions = [SectionVersion(version_number=1, content="<p>We migrated 40 banking platforms.</p>")]
+            proposal.proposal_sections = [section]
+            session.add(proposal)
+            await session.commit()
+
+            get_prefetcher().submit([section.id, section.id])
+            await get_prefetcher().join()
+            warm = await load_warm_context(session, [section.id])
+            context = warm.context_for(["Case Studies"])
+            close = warm.lookup("Why Us: We migrated 40 banking platforms", ["Case Studies"])
+            unrelated = warm.lookup("office locations", ["Case Studies"])
+            other_collections = warm.context_for(["Pricing"])
+
+            await bump_collection_revisions(["Case Studies"])
+            stale = await load_warm_context(session, [section.id])
+        return context, close, unrelated, other_collections, stale
+
+    context, close, unrelated, other_collections, stale = asyncio.run(scenario())
+    # Queued twice, fetched once: the name, the opening of the content and the custom prompt
+    assert queries == ["Why Us", "Why Us: We migrated 40 banking platforms.", "Why Us: Mention banking clients"]
+    assert context.split("\n\n---\n\n") == [f"Context for {query}" for query in queries]
+    assert close == "Context for Why Us: We migrated 40 banking platforms."
+    assert unrelated is None and other_collections is None
+    # New knowledge base content makes the prefetched rows stale
+    assert stale.rows == []
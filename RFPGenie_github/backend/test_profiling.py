@@ -0,0 +1,42 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import profiling
+from backend.config import settings
+from backend.profiling import ProfilingMiddleware
+from backend.routers import admin
+
+
+def test_requested_profile_records_stacks_and_loop_stalls(monkeypatch):
+    monkeypatch.setattr(settings, "PROFILING_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(settings, "PROFILING_BLOCK_THRESHOLD_MS", 20.0)
+    monkeypatch.setattr(profiling, "_store", None)
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+    app.include_router(admin.router)
+
+    @app.get("/slow")
+    async def slow():
+        # A blocking call on the event loop, like a sync Supabase request
+        time.sleep(0.2)
+        return {"ok": True}
+
+    client = TestClient(app)
+    assert "x-profile-id" not in client.get("/slow").headers
+    assert "x-profile-id" not in client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "wrong"}).headers
+    profiled = client.get("/slow", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+    profile_id = profiled.headers["x-profile-id"]
+
+    admin_headers = {"X-Admin-Token": "secret"}
+    assert client.get("/admin/profiles").status_code == 403
+    listed = client.get("/admin/profiles", headers=admin_headers).json()
+    assert [profile["id"] for profile in listed] == [int(profile_id)]
+    details = client.get(f"/admin/profiles/{profile_id}", headers=admin_headers).json()
+    assert details["status"] == 200 and details["wall_seconds"] >= 0.2
+    # The stall was seen with the blocking frame on the loop's stack
+    assert details["blocks"][0]["duration_ms"] >= 100
+    assert "slow (test_profiling.py" in details["blocks"][0]["stack"]
+    folded = client.get(f"/admin/profiles/{profile_id}/folded", headers=admin_headers).text
+    assert any(line.startswith("event-loop;") and "slow (test_profiling.py" in line for line in folded.splitlines())
@@ -0,0 +1,35 @@
+import pytest
+
+from backend.config import settings
+from backend.rag_migrations import MIGRATIONS, pending_migrations
+
+
+def test_versions_are_unique_and_ordered():
+    versions = [m.version for m in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+
+def test_pending_migrations_skip_applied():
+    assert [m.version for m in pending_migrations([1])] == [m.version for m in MIGRATIONS if m.version != 1]
+    assert pending_migrations(m.version for m in MIGRATIONS) == []
+
+
+@pytest.mark.parametrize("index, expected", [("hnsw", "using hnsw"), ("ivfflat", "using ivfflat")])
+def test_vector_index_follows_settings(monkeypatch, index, expected):
+    monkeypatch.setattr(settings, "RAG_VECTOR_INDEX", index)
+    statements = next(m for m in MIGRATIONS if m.version == 2).statements()
+    assert expected in statements[0]
+    assert any("metadata->>'source'" in s for s in statements)
+
+
+def test_match_documents_limits_before_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "RAG_EMBEDDING_DIMENSIONS", 384)
+    function = next(m for m in MIGRATIONS if m.version == 3).statements()[-1]
+    assert "vector(384)" in function
+    # The threshold is applied outside the index-ordered, limited scan
+    assert function.index("limit match_count") < function.index("where nearest.similarity > match_threshold")
+
+
+def test_content_hash_lookup_is_indexed():
+    statements = next(m for m in MIGRATIONS if m.version == 4).statements()
+    assert statements == ["create index if not exists documents_content_sha256_idx on documents ((metadata->>'content_sha256'))"]
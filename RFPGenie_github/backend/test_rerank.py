@@ -0,0 +1,54 @@
+import asyncio
+
+from backend import rerank
+from backend.config import settings
+from backend.rerank import Reranker, arerank
+
+
+class WordOverlapReranker(Reranker):
+    """Scores by shared words; stands in for the cross-encoder."""
+
+    def __init__(self):
+        self.calls = []
+
+    def score_sync(self, pairs):
+        self.calls.append(len(pairs))
+        return [len(set(query.lower().split()) & set(passage.lower().rstrip(".").split())) - 0.5 for query, passage in pairs]
+
+
+def test_rerank_keeps_relevant_sentences_of_the_best_chunks(monkeypatch):
+    monkeypatch.setattr(settings, "RERANK_ENABLED", True)
+    monkeypatch.setattr(settings, "RERANK_TOP_K", 2)
+    monkeypatch.setattr(settings, "RERANK_CONTEXT_TOKENS", 400)
+    scorer = WordOverlapReranker()
+    monkeypatch.setattr(rerank, "_reranker", scorer)
+    candidates = [
+        {"content": "Our office is in Leeds. We like tea.", "similarity": 0.9},
+        {"content": "We moved 40 banks to the cloud. The team has 12 people. Cloud migration took 9 months.", "similarity": 0.8},
+        {"content": "Cloud migration for banks is our focus.", "similarity": 0.75},
+        {"content": "Banks trust us.", "similarity": 0.72},
+    ]
+
+    selected = asyncio.run(arerank("cloud migration for banks", candidates))
+
+    assert [item["content"] for item in selected] == [
+        "Cloud migration for banks is our focus.",
+        "We moved 40 banks to the cloud. Cloud migration took 9 months.",
+    ]
+    assert selected[1]["similarity"] == 0.8
+    # One batch of candidates, one of the sentences of the two kept chunks
+    assert scorer.calls == [4, 4]
+
+
+def test_rerank_falls_back_to_similarity_order(monkeypatch):
+    class BrokenReranker(Reranker):
+        def score_sync(self, pairs):
+            raise RuntimeError("model not available")
+
+    monkeypatch.setattr(settings, "RERANK_ENABLED", True)
+    monkeypatch.setattr(settings, "RAG_MATCH_COUNT", 2)
+    monkeypatch.setattr(rerank, "_reranker", BrokenReranker())
+    candidates = [{"content": f"Chunk {i}."} for i in range(5)]
+
+    assert asyncio.run(arerank("query", candidates)) == candidates[:2]
+    assert rerank.match_count() == settings.RERANK_CANDIDATES
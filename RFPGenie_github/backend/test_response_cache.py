@@ -0,0 +1,54 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import response_cache
+from backend.models import Proposal, ProposalSection, SectionVersion, Template
+from backend.routers import generation, proposals, templates
+
+
+def test_reads_are_cached_revalidated_and_invalidated_by_writes(db_engine, monkeypatch):
+    monkeypatch.setattr(response_cache, "_cache", None)
+
+    async def setup():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=["Why Us"])
+            proposal = Proposal(name="P", description="A long description. " * 100, client_name="C", scope_document_path="blob:x.txt", template=template)
+            section = ProposalSection(section_name="Why Us")
+            section.versions = [SectionVersion(version_number=1, content="<p>We are good.</p>")]
+            proposal.proposal_sections = [section]
+            session.add(proposal)
+            await session.commit()
+            return proposal.id, section.versions[0].id
+
+    proposal_id, version_id = asyncio.run(setup())
+    app = FastAPI()
+    for module in (templates, proposals, generation):
+        app.include_router(module.router)
+    client = TestClient(app)
+
+    first = client.get(f"/proposals/{proposal_id}", headers={"Accept-Encoding": "gzip"})
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and first.json()["name"] == "P" and first.json()["draft_rfp_json"] is True
+    assert first.headers["content-encoding"] == "gzip"
+
+    revalidated = client.get(f"/proposals/{proposal_id}", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+    since = client.get(f"/proposals/{proposal_id}", headers={"If-Modified-Since": first.headers["last-modified"]})
+    assert since.status_code == 304
+    assert client.get("/proposals/999").status_code == 404
+
+    client.get("/templates/")
+    client.get("/templates/")
+    metrics = response_cache.cache_metrics()
+    # One load per key; the 404 is not cached
+    assert (metrics["misses"], metrics["hits"], metrics["not_modified"]) == (3, 3, 2)
+
+    client.put(f"/generation/section_versions/{version_id}", json={"content": "<p>We are better.</p>"})
+    sections = client.get(f"/proposals/{proposal_id}/sections").json()
+    assert sections[0]["versions"][0]["content"] == "<p>We are better.</p>"
+    # The edit invalidated the proposal; it is reloaded, but its body (and ETag) did not change
+    reloaded = client.get(f"/proposals/{proposal_id}", headers={"If-None-Match": etag})
+    assert reloaded.status_code == 304 and response_cache.cache_metrics()["misses"] == 5
@@ -0,0 +1,53 @@
+import asyncio
+
+import litellm
+
+from backend import routing
+from backend.config import settings
+from backend.routers.generation import _regenerate_routed
+from backend.routing import TASK_FINAL_PROPOSAL, TASK_INITIAL_DRAFT, TASK_REGENERATE, choose_route, prompt_complexity, routing_metrics, validate_section_html
+
+
+def test_small_light_edits_go_to_the_fast_model():
+    assert prompt_complexity("Make this shorter and more formal.") == 0
+    assert prompt_complexity("Expand on the technical architecture.") == 3
+
+    assert choose_route(TASK_REGENERATE, 300, "Make this shorter.").model == settings.ROUTING_FAST_MODEL
+    assert choose_route(TASK_REGENERATE, 300, "Add a comparison table.").model == settings.FINAL_GENERATION_MODEL
+    assert choose_route(TASK_REGENERATE, 5000).reason == "large input"
+    # The final proposal only has the strong model
+    assert choose_route(TASK_FINAL_PROPOSAL, 100).model == settings.FINAL_GENERATION_MODEL
+
+
+def test_initial_drafts_follow_their_model_setting(monkeypatch):
+    monkeypatch.setattr(settings, "INITIAL_DRAFT_MODEL", "draft-model")
+    assert choose_route(TASK_INITIAL_DRAFT, 100).model == "draft-model"
+
+
+def test_section_validation():
+    assert validate_section_html("<p>Fine.</p>", "stop") is None
+    assert validate_section_html("Plain text.", "stop") == "not HTML"
+    assert validate_section_html("<p>Cut", "length") == "output cut off"
+    assert validate_section_html("", "stop") == "empty output"
+
+
+def test_invalid_output_escalates_and_both_attempts_are_recorded(monkeypatch):
+    monkeypatch.setattr(routing, "_stats", {})
+
+    async def acompletion(model, messages, **kwargs):
+        content = "Just text." if model == settings.ROUTING_FAST_MODEL else "<p>Better.</p>"
+        return litellm.ModelResponse(
+            model=model,
+            choices=[{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            usage={"prompt_tokens": 100, "completion_tokens": 10, "total_tokens": 110},
+        )
+
+    monkeypatch.setattr(litellm, "acompletion", acompletion)
+    route = choose_route(TASK_REGENERATE, 100, "Make it formal.")
+    text = asyncio.run(_regenerate_routed([{"role": "user", "content": "Source"}], {}, route))
+
+    assert text == "<p>Better.</p>"
+    stats = routing_metrics()[TASK_REGENERATE]
+    fast, strong = stats[settings.ROUTING_FAST_MODEL], stats[settings.FINAL_GENERATION_MODEL]
+    assert (fast["attempts"], fast["invalid"], strong["attempts"], strong["escalations"]) == (1, 1, 1, 1)
+    assert strong["prompt_tokens"] == 100 and strong["cost_usd"] > 0
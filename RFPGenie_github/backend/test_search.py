@@ -0,0 +1,75 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend import response_cache
+from backend.drafts import save_initial_draft
+from backend.models import Proposal, SearchEntry, SectionVersion, Template
+from backend.routers import generation, proposals, search
+from backend.search import backfill_search_index
+
+
+def test_search_follows_writes_with_ranking_highlights_and_pages(db_engine, monkeypatch):
+    monkeypatch.setattr(response_cache, "_cache", None)
+
+    async def setup():
+        async with AsyncSession(db_engine, expire_on_commit=False) as session:
+            template = Template(name="T", description="", sections=["Why Us", "Pricing"])
+            # Created before search existed: indexed by the backfill
+            legacy = Proposal(name="Core banking migration", description="Move the ledger to the cloud.", client_name="Acme Bank",
+                              scope_document_path="blob:x.txt", template=template)
+            other = Proposal(name="Retail portal", description="A new storefront.", client_name="Shopco",
+                             scope_document_path="blob:y.txt", template=template)
+            session.add_all([legacy, other])
+            await session.commit()
+            assert await backfill_search_index(session) == 2
+            await save_initial_draft(session, legacy.id, {"Why Us": "<p>We migrated 40 <b>banking</b> platforms &amp; more.</p>", "Pricing": "<p>Fixed price.</p>"})
+            await save_initial_draft(session, other.id, {"Why Us": "<p>Our banking app team.</p>", "Pricing": "<p>Time and materials.</p>"})
+            version_id = (await session.exec(select(SectionVersion.id).where(SectionVersion.content.contains("Fixed")))).one()
+            return legacy.id, other.id, version_id
+
+    legacy_id, other_id, version_id = asyncio.run(setup())
+    app = FastAPI()
+    for module in (proposals, generation, search):
+        app.include_router(module.router)
+    client = TestClient(app)
+
+    found = client.get("/search/", params={"q": "banking"}).json()
+    # The proposal name is weighted above section text
+    assert found["total"] == 3
+    assert [(r["proposal_id"], r["kind"]) for r in found["results"]][0] == (legacy_id, "proposal")
+    why_us = next(r for r in found["results"] if r["kind"] == "version" and r["proposal_id"] == legacy_id)
+    assert why_us["section_name"] == "Why Us"
+    assert why_us["highlight"] == "We migrated 40 <mark>banking</mark> platforms &amp; more."
+
+    second_page = client.get("/search/", params={"q": "banking", "limit": 2, "offset": 2}).json()
+    assert second_page["total"] == 3 and len(second_page["results"]) == 1
+    assert client.get("/search/", params={"q": "banking platforms", "kind": "version"}).json()["total"] == 1
+    assert client.get("/search/", params={"q": "banking", "kind": "draft"}).status_code == 400
+
+    # Edits are searchable as soon as they are saved
+    assert client.get("/search/", params={"q": "outcome"}).json()["total"] == 0
+    client.put(f"/generation/section_versions/{version_id}", json={"content": "<p>Outcome based pricing.</p>"})
+    edited = client.get("/search/", params={"q": "outcome"}).json()["results"]
+    assert [(r["section_version_id"], r["highlight"]) for r in edited] == [(version_id, "<mark>Outcome</mark> based pricing.")]
+    assert client.get("/search/", params={"q": "fixed"}).json()["total"] == 0
+
+    # A final document saved through the proposal update is searchable too
+    client.put(f"/proposals/{other_id}", json={
+        "name": "Retail portal", "description": "A new storefront.", "client_name": "Shopco", "scope_document_path": "blob:y.txt",
+        "final_rfp_json": "<h2>Why Us</h2><p>Storefront banking expertise.</p>",
+    })
+    final = client.get("/search/", params={"q": "storefront expertise", "kind": "final"}).json()["results"]
+    assert [(r["proposal_id"], r["highlight"]) for r in final] == [(other_id, "Why Us <mark>Storefront</mark> banking <mark>expertise.</mark>")]
+
+    client.delete(f"/proposals/{legacy_id}")
+    assert {r["proposal_id"] for r in client.get("/search/", params={"q": "banking"}).json()["results"]} == {other_id}
+
+    async def remaining():
+        async with AsyncSession(db_engine) as session:
+            return (await session.exec(select(SearchEntry.proposal_id))).all()
+
+    assert set(asyncio.run(remaining())) == {other_id}
@@ -0,0 +1,71 @@
+import pytest
+
+from backend import snapshots
+from backend.benchmarks.fakes import FakeEmbeddingProvider, InMemorySupabase
+from backend.config import settings
+from backend.embeddings import EmbeddingModelMismatch
+from backend.snapshots import LocalVectorIndex, SnapshotReader, export_snapshot, import_snapshot
+
+TEXTS = [
+    ("Case Studies", "cloud migration case study"),
+    ("Pricing", "pricing model for enterprise clients"),
+    ("Case Studies", "banking platform migration"),
+    ("Case Studies", "security compliance audit"),
+    ("Team", "our delivery team"),
+]
+
+
+@pytest.fixture
+def source(monkeypatch):
+    embedder = FakeEmbeddingProvider(latency=0)
+    # Capped like PostgREST, so the last collection is beyond the first response
+    supabase = InMemorySupabase(latency=0, max_rows=2)
+    supabase.table("documents").insert([
+        {"collection": collection, "content": text, "metadata": {"source": f"{i}.txt", "embedding_model": "fake"},
+         "embedding": embedder.embed(text)}
+        for i, (collection, text) in enumerate(TEXTS)
+    ]).execute()
+    monkeypatch.setattr(snapshots, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(settings, "SNAPSHOT_BATCH_SIZE", 2)
+    return embedder, supabase
+
+
+@pytest.mark.parametrize("dtype", ["float32", "int8"])
+def test_snapshot_search_matches_the_rpc(tmp_path, source, dtype):
+    embedder, supabase = source
+    manifest = export_snapshot(str(tmp_path), dtype=dtype)
+    assert manifest["rows"] == 5 and list(manifest["collections"]) == ["Case Studies", "Pricing", "Team"]
+    # Collections are contiguous, in name order
+    assert manifest["collections"]["Case Studies"] == {"start": 0, "end": 3, "embedding_model": "fake"}
+
+    index = LocalVectorIndex(str(tmp_path))
+    query = embedder.embed("cloud migration")
+    local = index.search(query, ["Case Studies"], match_count=2, match_threshold=0.1)
+    remote = supabase.rpc("match_documents", {"query_embedding": query, "match_threshold": 0.1, "match_count": 2,
+                                              "collection_filter": ["Case Studies"]}).execute().data
+    assert [row["content"] for row in local] == [row["content"] for row in remote]
+    assert local[0]["similarity"] == pytest.approx(remote[0]["similarity"], abs=0.02)
+    assert local[0]["collection"] == "Case Studies" and local[0]["metadata"]["source"] == "0.txt"
+
+    # PostgREST returns vectors as text
+    assert snapshots._parse_embedding("[0.5,-1]") == [0.5, -1]
+    with pytest.raises(EmbeddingModelMismatch):
+        index.check_models(["Pricing"], "other-model")
+    index.close()
+
+
+def test_import_restores_rows_without_ids(tmp_path, source, monkeypatch):
+    embedder, supabase = source
+    export_snapshot(str(tmp_path))
+    target = InMemorySupabase(latency=0)
+    monkeypatch.setattr(snapshots, "get_supabase_rag", lambda: target)
+    monkeypatch.setattr(settings, "RAG_EMBEDDING_DIMENSIONS", len(embedder.embed("x")))
+
+    assert import_snapshot(str(tmp_path)) == 5
+    rows = target.tables["documents"]
+    assert sorted(row["content"] for row in rows) == sorted(text for _, text in TEXTS)
+    assert rows[0]["embedding"] == pytest.approx(embedder.embed(rows[0]["content"]), abs=1e-6)
+
+    reader = SnapshotReader(str(tmp_path))
+    assert [row["id"] for row in reader.rows()] == [1, 3, 4, 2, 5]
+    reader.close()
@@ -0,0 +1,5 @@
+from backend.benchmarks.startup import measure_import, HEAVY_MODULES
+
+def test_app_imports_without_credentials_or_heavy_clients():
+    result = measure_import()
+    assert result["heavy_modules"] == [], f"Imported at startup: {result['heavy_modules']} (expected none of {HEAVY_MODULES})"
@@ -0,0 +1,85 @@
+import io
+
+import pytest
+
+from backend.documents import UnsupportedDocumentType, extract_text
+from backend.storage import BlobNotFound, FilesystemBlobStore, S3BlobStore, blob_uri, parse_blob_uri
+
+
+class _NotFound(Exception):
+    response = {"Error": {"Code": "404"}}
+
+
+class _FakeS3Client:
+    """The handful of boto3 S3 client methods S3BlobStore calls."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = 0
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise _NotFound()
+        return {"ContentLength": len(self.objects[Key])}
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        self.uploads += 1
+        self.objects[key] = fileobj.read()
+
+    def download_fileobj(self, bucket, key, fileobj):
+        if key not in self.objects:
+            raise _NotFound()
+        fileobj.write(self.objects[key])
+
+    def get_object(self, Bucket, Key, Range):
+        if Key not in self.objects:
+            raise _NotFound()
+        start, _, end = Range[len("bytes="):].partition("-")
+        data = self.objects[Key]
+        return {"Body": io.BytesIO(data[int(start):int(end) + 1 if end else None])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+
+def _exercise(store):
+    first = store.put(io.BytesIO(b"hello blob store"))
+    second = store.put(io.BytesIO(b"hello blob store"))
+    assert first.created and not second.created
+    assert first.key == second.key and first.size == 16
+
+    assert store.exists(first.key)
+    assert store.size(first.key) == 16
+    assert store.read_range(first.key, 6, 4) == b"blob"
+    assert store.read_range(first.key, 11) == b"store"
+    with store.open(first.key) as f:
+        assert f.read() == b"hello blob store"
+
+    store.delete(first.key)
+    assert not store.exists(first.key)
+    with pytest.raises(BlobNotFound):
+        store.read_range(first.key, 0)
+
+
+def test_filesystem_store(tmp_path):
+    _exercise(FilesystemBlobStore(str(tmp_path)))
+    assert not any((tmp_path / ".tmp").iterdir())
+
+
+def test_s3_store_uploads_identical_content_once():
+    client = _FakeS3Client()
+    _exercise(S3BlobStore("bucket", client=client))
+    assert client.uploads == 1
+
+
+def test_blob_uri_round_trip():
+    uri = blob_uri("abc123", ".PDF")
+    assert uri == "blob:abc123.pdf"
+    assert parse_blob_uri(uri) == ("abc123", ".pdf")
+
+
+def test_extract_text():
+    assert extract_text(io.BytesIO(b"plain text"), ".txt") == "plain text"
+    assert extract_text(io.BytesIO(b"notes"), ".md", text_fallback=True) == "notes"
+    with pytest.raises(UnsupportedDocumentType):
+        extract_text(io.BytesIO(b""), ".xlsx")
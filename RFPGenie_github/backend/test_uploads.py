@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import storage, uploads
+from backend.benchmarks.fakes import InMemorySupabase
+from backend.config import settings
+from backend.routers import collections
+from backend.storage import FilesystemBlobStore
+from backend.uploads import PageCounter, TooManyPages, UploadTooLarge, store_upload
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def test_page_objects_are_counted_across_chunk_boundaries():
+    pdf = b"<< /Type /Pages /Count 3 >> << /Type /Page >> << /Type/Page >> << /Type /Page"
+    for split in range(1, len(pdf)):
+        counter = PageCounter()
+        counter.feed(pdf[:split])
+        counter.feed(pdf[split:])
+        assert counter.close() == 3, split
+
+
+def test_limits_are_enforced_while_streaming(tmp_path, monkeypatch):
+    store = FilesystemBlobStore(str(tmp_path))
+    monkeypatch.setattr(storage, "_store", store)
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 10)
+    monkeypatch.setattr(settings, "UPLOAD_MAX_PAGES", 1)
+
+    stored = asyncio.run(store_upload(_stream(b"hello", b"world"), ".txt"))
+    assert stored.size == 10 and store.exists(stored.key)
+
+    consumed = []
+
+    async def endless():
+        while True:
+            consumed.append(1)
+            yield b"x" * 4
+
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(store_upload(endless(), ".txt"))
+    # Refused on the third chunk, and nothing was left behind
+    assert len(consumed) == 3
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 1000)
+    with pytest.raises(TooManyPages):
+        asyncio.run(store_upload(_stream(b"/Type /Page ", b"/Type /Page "), ".pdf"))
+    assert list((tmp_path / ".tmp").iterdir()) == []
+
+
+def test_duplicate_content_is_refused_before_ingestion(tmp_path, monkeypatch):
+    supabase = InMemorySupabase(latency=0)
+    monkeypatch.setattr(collections, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(uploads, "get_supabase_rag", lambda: supabase)
+    monkeypatch.setattr(storage, "_store", FilesystemBlobStore(str(tmp_path)))
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 1000)
+    ingested = []
+
+    async def fake_ingest(filename, document_ref, content_key):
+        ingested.append(filename)
+        supabase.table('documents').insert({"collection": "A", "content": "...", "metadata": {"source": filename, "content_sha256": content_key}}).execute()
+        return {"message": "ok"}
+
+    monkeypatch.setattr(collections, "_ingest_document", fake_ingest)
+    app = FastAPI()
+    app.include_router(collections.router)
+    client = TestClient(app)
+
+    assert client.post("/collections/upload", files={"file": ("a.txt", b"Our delivery methodology.")}).status_code == 200
+    renamed = client.post("/collections/upload_stream?filename=b.txt", content=b"Our delivery methodology.")
+    assert renamed.status_code == 409 and "'a.txt'" in renamed.json()["detail"]
+    assert client.post("/collections/upload_stream?filename=c.txt", content=b"Our pricing model.").status_code == 200
+    too_large = client.post("/collections/upload", files={"file": ("d.txt", b"x" * 2000)})
+    assert too_large.status_code == 413
+    assert ingested == ["a.txt", "c.txt"]
+    assert uploads.upload_metrics()["ingesting"] == 0
+
+
+def test_pdf_refused_after_recount_is_deleted(tmp_path, monkeypatch):
+    store = FilesystemBlobStore(str(tmp_path))
+    monkeypatch.setattr(storage, "_store", store)
+    monkeypatch.setattr(settings, "UPLOAD_MAX_PAGES", 1)
+    # Pages in compressed object streams are only found by pypdf
+    monkeypatch.setattr(uploads, "count_pdf_pages", lambda ref: 2)
+
+    stored = asyncio.run(store_upload(_stream(b"%PDF-1.7 compressed"), ".pdf"))
+    with pytest.raises(TooManyPages):
+        asyncio.run(uploads.check_new_content(stored, storage.blob_uri(stored.key, ".pdf"), ".pdf"))
+    assert not store.exists(stored.key)
@@ -0,0 +1,171 @@
+"""Streaming storage of knowledge base uploads, with limits and content deduplication.
+
+An upload is written to the blob store chunk by chunk while its SHA-256 is
+computed, so memory use does not grow with the file. ``UPLOAD_MAX_BYTES`` is
+enforced as the bytes arrive; for PDFs so is ``UPLOAD_MAX_PAGES``, by counting
+page objects in the raw stream. That count misses pages inside compressed
+object streams, so the stored file is counted again with pypdf before it is
+parsed. A file over a limit is never parsed, and its blob is deleted unless
+an earlier upload stored the same content.
+
+Chunks record the hash as ``content_sha256`` in their metadata (indexed by
+``backend.rag_migrations``). Once an upload is stored, content that is already
+in the knowledge base, or that another request of this worker is ingesting,
+is refused before any parsing or LLM work. Its blob is left in place: storage
+is content-addressed, so it is the blob of the document already ingested.
+"""
+import asyncio
+import collections
+import logging
+import re
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Set
+from .config import settings
+from .database import get_supabase_rag
+from .storage import BlobWriter, StoredBlob, get_blob_store, open_document
+
+logger = logging.getLogger(__name__)
+
+# Bytes collected before they are handed to the blob store in a worker thread
+WRITE_BATCH_BYTES = 1024 * 1024
+_PAGE_OBJECT = re.compile(rb"/Type\s*/Page(?![s\w])")
+# Bytes carried over between chunks, so a page object split across two is still found
+_PAGE_TAIL = 32
+
+_ingesting: Set[str] = set()
+_rejected: Dict[str, int] = collections.Counter()
+
+
+class UploadTooLarge(ValueError):
+    """Raised when an upload is larger than ``UPLOAD_MAX_BYTES``."""
+
+
+class TooManyPages(ValueError):
+    """Raised when a PDF upload has more than ``UPLOAD_MAX_PAGES`` pages."""
+
+
+class DuplicateContent(ValueError):
+    """Raised for content that is already in the knowledge base or being ingested."""
+
+
+class PageCounter:
+    """Counts PDF page objects in a stream of chunks."""
+
+    def __init__(self):
+        self.pages = 0
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> int:
+        data = self._tail + chunk
+        # A match is counted once the byte after it is known, so "/Pages" is never taken for "/Page"
+        self.pages += sum(1 for match in _PAGE_OBJECT.finditer(data) if len(self._tail) <= match.end() < len(data))
+        self._tail = data[-_PAGE_TAIL:]
+        return self.pages
+
+    def close(self) -> int:
+        self.pages += sum(1 for match in _PAGE_OBJECT.finditer(self._tail) if match.end() == len(self._tail))
+        self._tail = b""
+        return self.pages
+
+
+def _too_large() -> UploadTooLarge:
+    _rejected["too_large"] += 1
+    return UploadTooLarge(f"The file is larger than the {settings.UPLOAD_MAX_BYTES // (1024 * 1024)} MB upload limit.")
+
+
+def _too_many_pages(pages: int) -> TooManyPages:
+    _rejected["too_many_pages"] += 1
+    return TooManyPages(f"The document has {pages} pages; at most {settings.UPLOAD_MAX_PAGES} can be uploaded.")
+
+
+def check_declared_size(size: Optional[int]) -> None:
+    """Rejects an upload by its declared size before any of it is read."""
+    if size is not None and size > settings.UPLOAD_MAX_BYTES:
+        raise _too_large()
+
+
+def _write_all(writer: BlobWriter, chunks: List[bytes]) -> None:
+    for chunk in chunks:
+        writer.write(chunk)
+
+
+async def store_upload(chunks: AsyncIterator[bytes], extension: str) -> StoredBlob:
+    """Writes an upload to the blob store as it arrives, enforcing the size and page limits."""
+    writer = await asyncio.to_thread(get_blob_store().writer)
+    pages = PageCounter() if extension == ".pdf" else None
+    pending: List[bytes] = []
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > settings.UPLOAD_MAX_BYTES:
+                raise _too_large()
+            if pages is not None and pages.feed(chunk) > settings.UPLOAD_MAX_PAGES:
+                raise _too_many_pages(pages.pages)
+            pending.append(chunk)
+            if size - writer.size >= WRITE_BATCH_BYTES:
+                await asyncio.to_thread(_write_all, writer, pending)
+                pending = []
+        if pages is not None and pages.close() > settings.UPLOAD_MAX_PAGES:
+            raise _too_many_pages(pages.pages)
+        await asyncio.to_thread(_write_all, writer, pending)
+        return await asyncio.to_thread(writer.commit)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def count_pdf_pages(ref: str) -> Optional[int]:
+    """Exact page count of a stored PDF, or None when pypdf cannot read it."""
+    import pypdf
+    try:
+        with open_document(ref) as f:
+            return len(pypdf.PdfReader(f).pages)
+    except Exception as e:
+        # Parsing reports unreadable files properly
+        logger.warning("Could not count the pages of %s: %s", ref, e)
+        return None
+
+
+def existing_source(content_key: str) -> Optional[str]:
+    """Source name of a document in the knowledge base with this content hash, if any."""
+    response = (
+        get_supabase_rag().table('documents').select('metadata')
+        .eq('metadata->>content_sha256', content_key).limit(1).execute()
+    )
+    if not response.data:
+        return None
+    return (response.data[0].get('metadata') or {}).get('source') or "another document"
+
+
+@contextmanager
+def claim_content(content_key: str) -> Iterator[None]:
+    """Marks content as being ingested by this request; a second upload of it meanwhile is refused."""
+    if content_key in _ingesting:
+        _rejected["duplicate"] += 1
+        raise DuplicateContent("The same content is being uploaded by another request.")
+    _ingesting.add(content_key)
+    try:
+        yield
+    finally:
+        _ingesting.discard(content_key)
+
+
+async def check_new_content(stored: StoredBlob, document_ref: str, extension: str) -> None:
+    """Refuses content already in the knowledge base and PDFs over the page limit; call within ``claim_content``."""
+    # A blob that was just created cannot have been ingested yet
+    if not stored.created:
+        source = await asyncio.to_thread(existing_source, stored.key)
+        if source is not None:
+            _rejected["duplicate"] += 1
+            raise DuplicateContent(f"The same content is already in the knowledge base as '{source}'.")
+    if extension == ".pdf":
+        pages = await asyncio.to_thread(count_pdf_pages, document_ref)
+        if pages is not None and pages > settings.UPLOAD_MAX_PAGES:
+            if stored.created:
+                await asyncio.to_thread(get_blob_store().delete, stored.key)
+            raise _too_many_pages(pages)
+
+
+def upload_metrics() -> Dict[str, int]:
+    return {"ingesting": len(_ingesting), **{f"rejected_{reason}": count for reason, count in sorted(_rejected.items())}}